@@ -0,0 +1,333 @@
+"""Cluster benchmark with YCSB-style workloads
+
+Launches N replicas on localhost ports, loads RECORDS keys, then drives a workload
+against /kvs from concurrent clients and reports throughput and p50/p95/p99 latency
+per operation as JSON.
+
+Run from the repository root:
+    python benchmarks/bench_cluster.py --replicas 6 --shards 2 --workload a --output results.json
+    python benchmarks/bench_cluster.py --workload b --distribution uniform --env WORKERS=2
+    python benchmarks/bench_cluster.py --addresses 10.10.0.2:8090,10.10.0.3:8090 --workload c
+"""
+import argparse
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bingus import resharding
+from bingus.resharding import hash_token
+from bingus_client import Client, ClientError
+
+# operation mix of every workload, named after the YCSB core workloads
+WORKLOADS = {
+    "a": {"read": 0.5, "update": 0.5}, # update heavy
+    "b": {"read": 0.95, "update": 0.05}, # read mostly
+    "c": {"read": 1.0}, # read only
+    "f": {"read": 0.5, "read-modify-write": 0.5}, # read-modify-write
+    "w": {"update": 1.0}, # write only
+}
+ZIPFIAN_CONSTANT = 0.99 # YCSB's default skew
+BOOT_TIMEOUT = 60 # max seconds to wait for the launched replicas to see each other
+VALUE_POOL = 64 # distinct values each client writes, generated up front
+
+class UniformGenerator():
+    def __init__(self, items, rng):
+        self.items = items
+        self.rng = rng
+
+    def next(self):
+        return self.rng.randrange(self.items)
+
+class ZipfianGenerator():
+    # Zipfian distributed item numbers as generated by YCSB(Gray et al., "Quickly generating billion-record synthetic databases")
+    # Item numbers are scrambled by hashing, so the popular items are spread over the key space(and the shards)
+    def __init__(self, items, rng, theta=ZIPFIAN_CONSTANT, zetan=None):
+        self.items = items
+        self.rng = rng
+        self.theta = theta
+        self.zetan = zeta(items, theta) if zetan is None else zetan
+        self.alpha = 1 / (1 - theta)
+        self.eta = (1 - (2 / items) ** (1 - theta)) / (1 - zeta(2, theta) / self.zetan)
+
+    def next(self):
+        u = self.rng.random()
+        uz = u * self.zetan
+        if uz < 1:
+            rank = 0
+        elif uz < 1 + 0.5 ** self.theta:
+            rank = 1
+        else:
+            rank = int(self.items * (self.eta * u - self.eta + 1) ** self.alpha)
+        return hash_token(str(rank)) % self.items
+
+def zeta(n, theta):
+    return sum(1 / i ** theta for i in range(1, n + 1))
+
+def key_name(item):
+    return f"user{item}"
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+def summarize(latencies, errors, elapsed):
+    """Returns: throughput and latency(in milliseconds) statistics of one operation"""
+    ordered = sorted(latencies)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    return dict(
+        operations=len(ordered),
+        errors=errors,
+        throughput=round(len(ordered) / elapsed, 2) if elapsed else None,
+        mean=ms(sum(ordered) / len(ordered)) if ordered else None,
+        p50=ms(percentile(ordered, 50)),
+        p95=ms(percentile(ordered, 95)),
+        p99=ms(percentile(ordered, 99)),
+        max=ms(ordered[-1]) if ordered else None,
+    )
+
+class Cluster():
+    # N replicas launched as local processes on consecutive ports
+    def __init__(self, replicas, shards, base_port, env=None, log_dir=None):
+        self.addresses = [f"127.0.0.1:{base_port + i}" for i in range(replicas)]
+        self.shards = shards
+        self.env = dict(os.environ, **(env or {}))
+        self.log_dir = log_dir or tempfile.mkdtemp(prefix="bingus-bench-")
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.processes = list()
+
+    def start(self):
+        # every replica partitions the view the same way at boot, and exits if it cannot
+        if not resharding.partition_by_hash(self.addresses, self.shards)[0]:
+            raise RuntimeError(f"{len(self.addresses)} replicas on ports {self.addresses[0].split(':')[1]}+ cannot be partitioned "
+                               f"into {self.shards} shards of at least {resharding.GLOBAL_MIN}, pick another --base-port or replica count")
+        view = ",".join(self.addresses)
+        for addr in self.addresses:
+            log = open(os.path.join(self.log_dir, f"{addr.replace(':', '_')}.log"), "w")
+            self.processes.append(subprocess.Popen([sys.executable, "replica.py", addr, view, str(self.shards)],
+                                                   cwd=ROOT, env=self.env, stdout=log, stderr=subprocess.STDOUT))
+        self.wait_ready()
+
+    def wait_ready(self):
+        """Wait until every replica answers and sees every other replica"""
+        deadline = time.monotonic() + BOOT_TIMEOUT
+        pending = set(self.addresses)
+        while pending:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"replicas did not boot in time, see the logs in {self.log_dir}: {sorted(pending)}")
+            for process in self.processes:
+                if process.poll() is not None:
+                    raise RuntimeError(f"a replica exited with code {process.returncode}, see the logs in {self.log_dir}")
+            for addr in list(pending):
+                try:
+                    view = requests.get(f"http://{addr}/view", timeout=1).json()["view"]
+                except (requests.RequestException, ValueError, KeyError):
+                    continue
+                if set(self.addresses) <= set(view):
+                    pending.discard(addr)
+            time.sleep(0.25)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+class RandomReplicaClient():
+    # Sends every request to a random replica, which forwards it to the key's owner if needed
+    def __init__(self, addresses, rng):
+        self.addresses = addresses
+        self.rng = rng
+        self.session = requests.Session()
+        self.metadata = None
+
+    def request(self, method, key, value=None):
+        payload = {"causal-metadata": self.metadata}
+        if value is not None:
+            payload["value"] = value
+        response = self.session.request(method, f"http://{self.rng.choice(self.addresses)}/kvs/{key}", json=payload, timeout=30)
+        body = response.json()
+        if "causal-metadata" in body:
+            self.metadata = body["causal-metadata"]
+        return response.status_code
+
+    def get(self, key):
+        return self.request("GET", key) == 200
+
+    def put(self, key, value):
+        return self.request("PUT", key, value) in (200, 201)
+
+class OwnerClient():
+    # Sends every request straight to the key's owner through bingus_client
+    def __init__(self, addresses, rng):
+        self.client = Client(addresses)
+
+    def get(self, key):
+        try:
+            self.client.get(key)
+            return True
+        except (KeyError, ClientError, requests.RequestException):
+            return False
+
+    def put(self, key, value):
+        try:
+            self.client.put(key, value)
+            return True
+        except (ClientError, requests.RequestException):
+            return False
+
+CLIENTS = {"random": RandomReplicaClient, "owner": OwnerClient}
+
+def load(addresses, args):
+    """Insert every record once, spread over the clients"""
+    rng = random.Random(args.seed)
+    value = "".join(rng.choices(string.ascii_letters, k=args.value_size))
+    failures = list()
+
+    def insert(client_id):
+        client = CLIENTS[args.client](addresses, random.Random(args.seed + client_id))
+        for item in range(client_id, args.records, args.concurrency):
+            if not client.put(key_name(item), value):
+                failures.append(item)
+
+    threads = [threading.Thread(target=insert, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(records=args.records, errors=len(failures), seconds=round(time.perf_counter() - start, 3))
+
+def run(addresses, args):
+    """Drive the workload from args.concurrency clients
+
+    Returns: dictionary of results, statistics per operation and over all operations
+    """
+    mix = dict(WORKLOADS[args.workload])
+    if args.read_proportion is not None:
+        mix = {"read": args.read_proportion, "update": 1 - args.read_proportion}
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    zetan = zeta(args.records, ZIPFIAN_CONSTANT) if args.distribution == "zipfian" else None
+    latencies = {op: list() for op in operations}
+    errors = {op: 0 for op in operations}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + args.duration
+    per_client = None if args.operations is None else args.operations // args.concurrency
+
+    def drive(client_id):
+        rng = random.Random(args.seed + 1000 + client_id)
+        client = CLIENTS[args.client](addresses, rng)
+        if args.distribution == "zipfian":
+            keys = ZipfianGenerator(args.records, rng, zetan=zetan)
+        else:
+            keys = UniformGenerator(args.records, rng)
+        values = ["".join(rng.choices(string.ascii_letters, k=args.value_size)) for _ in range(VALUE_POOL)]
+        local_latencies = {op: list() for op in operations}
+        local_errors = {op: 0 for op in operations}
+        done = 0
+        while (time.perf_counter() < stop_at) if per_client is None else (done < per_client):
+            op = rng.choices(operations, weights)[0]
+            key = key_name(keys.next())
+            start = time.perf_counter()
+            try:
+                if op == "read":
+                    ok = client.get(key)
+                elif op == "update":
+                    ok = client.put(key, rng.choice(values))
+                else:
+                    ok = client.get(key) and client.put(key, rng.choice(values))
+            except (requests.RequestException, ValueError):
+                ok = False
+            if ok:
+                local_latencies[op].append(time.perf_counter() - start)
+            else:
+                local_errors[op] += 1
+            done += 1
+        with lock:
+            for op in operations:
+                latencies[op] += local_latencies[op]
+                errors[op] += local_errors[op]
+
+    threads = [threading.Thread(target=drive, args=(i,)) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = {op: summarize(latencies[op], errors[op], elapsed) for op in operations}
+    results["total"] = summarize([latency for op in operations for latency in latencies[op]], sum(errors.values()), elapsed)
+    return dict(elapsed=round(elapsed, 3), operations=results)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark a local bingus cluster with YCSB-style workloads")
+    parser.add_argument("--replicas", type=int, default=4, help="replicas to launch")
+    parser.add_argument("--shards", type=int, default=2, help="shard count of the launched cluster")
+    parser.add_argument("--base-port", type=int, default=13800, help="port of the first launched replica")
+    parser.add_argument("--addresses", help="comma separated replicas of a running cluster, nothing is launched")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="environment variable of the launched replicas")
+    parser.add_argument("--log-dir", help="directory for the replica logs(default: a new temporary directory)")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="a")
+    parser.add_argument("--read-proportion", type=float, help="read/update mix overriding the workload's")
+    parser.add_argument("--distribution", choices=("zipfian", "uniform"), default="zipfian", help="key popularity")
+    parser.add_argument("--records", type=int, default=1000, help="keys loaded before the workload runs")
+    parser.add_argument("--value-size", type=int, default=100, help="characters per value")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds the workload runs")
+    parser.add_argument("--operations", type=int, help="total operations to run instead of running for --duration")
+    parser.add_argument("--client", choices=sorted(CLIENTS), default="random",
+                        help="random: requests go to a random replica, owner: straight to the key's owner(bingus_client)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file the JSON results are written to(default: stdout only)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    env = dict(item.split("=", 1) for item in args.env)
+    cluster = None
+    if args.addresses:
+        addresses = args.addresses.split(",")
+    else:
+        cluster = Cluster(args.replicas, args.shards, args.base_port, env, args.log_dir)
+        addresses = cluster.addresses
+    try:
+        if cluster is not None:
+            cluster.start()
+        loaded = load(addresses, args)
+        results = run(addresses, args)
+    finally:
+        if cluster is not None:
+            cluster.stop()
+
+    report = dict(benchmark="bench_cluster", timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                  commit=git_commit(), config=vars(args), load=loaded, **results)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
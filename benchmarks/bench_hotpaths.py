@@ -0,0 +1,274 @@
+"""Microbenchmarks of the pure-CPU hot paths
+
+Covers key lookup(consistent_hash_key), ring construction(calculate_ring_positions),
+partitioning(partition_by_hash, balance_shards, stable_partition) and the causal
+checks(VectorClock comparisons, dependency_check, max_of and its replacements, and the
+replica clock as a dictionary vs the CompactClock candidate below),
+at 10-500 replicas, 1-50 shards and up to millions of keys.
+Every benchmark reports ops/sec and the memory it allocates(tracemalloc): the peak
+allocated during one call and what the call leaves allocated.
+Only the Flask-free modules are imported, no replica is started.
+
+Run from the repository root:
+    python benchmarks/bench_hotpaths.py
+    python benchmarks/bench_hotpaths.py --quick --filter clock --json hotpaths.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bingus import resharding
+from array import array
+from vectorclock import VectorClock, has_dependency, merge_into, compare
+
+REPLICA_COUNTS = (10, 50, 100, 500)
+SHARD_COUNTS = (1, 5, 10, 50)
+CLOCK_SIZES = (2, 10, 50, 500) # members of a shard, i.e. entries of its vector clock
+KEYS = 1000000 # keys looked up per consistent_hash_key call
+REPEAT = 3 # timings per benchmark, the fastest is reported
+MIN_SECONDS = 0.2 # min duration of one timing
+
+def addresses(count):
+    return [f"10.10.{i // 250}.{i % 250 + 2}:8090" for i in range(count)]
+
+def measure(name, params, fn, ops_per_call=1):
+    """Time fn and trace the memory it allocates
+
+    Returns: result dictionary of the benchmark
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * MIN_SECONDS / 0.2))
+    seconds = min(timer.repeat(repeat=REPEAT, number=number)) / number
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return dict(name=name, params=params, ops_per_sec=round(ops_per_call / seconds, 1), ns_per_op=round(seconds / ops_per_call * 1e9, 1),
+                peak_bytes=peak - before, retained_bytes=after - before)
+
+def bench_consistent_hash_key(keys):
+    results = list()
+    for count in REPLICA_COUNTS:
+        # views_route.consistent_hash_key is a lookup on the replica's ring
+        ring = resharding.calculate_ring_positions(addresses(count))
+        lookup = ring.lookup
+        results.append(measure("consistent_hash_key", dict(replicas=count, keys=len(keys)),
+                               lambda: [lookup(key) for key in keys], ops_per_call=len(keys)))
+    return results
+
+def bench_calculate_ring_positions(keys):
+    return [measure("calculate_ring_positions", dict(replicas=count, vnodes=resharding.VNODES_PER_REPLICA),
+                    lambda replicas=addresses(count): resharding.calculate_ring_positions(replicas))
+            for count in REPLICA_COUNTS]
+
+def partition_sizes():
+    """(replicas, shards) pairs giving every shard at least GLOBAL_MIN replicas"""
+    return [(count, shards) for count in REPLICA_COUNTS for shards in SHARD_COUNTS if count // shards >= resharding.GLOBAL_MIN]
+
+def bench_partition_by_hash(keys):
+    return [measure("partition_by_hash", dict(replicas=count, shards=shards),
+                    lambda replicas=addresses(count), shards=shards: resharding.partition_by_hash(replicas, shards))
+            for count, shards in partition_sizes()]
+
+def bench_balance_shards(keys):
+    results = list()
+    for count, shards in partition_sizes():
+        # the uneven distribution partition_by_hash hands to balance_shards
+        skewed = {id: set() for id in range(shards)}
+        for replica in addresses(count):
+            skewed[int(hashlib.md5(replica.encode('ascii')).hexdigest(), 16) % shards].add(replica)
+        # balance_shards moves replicas between the sets it is given, every call gets a copy(included in the timing)
+        results.append(measure("balance_shards", dict(replicas=count, shards=shards),
+                               lambda skewed=skewed, minimum=count // shards: resharding.balance_shards({id: set(members) for id, members in skewed.items()}, minimum)))
+    return results
+
+def bench_stable_partition(keys):
+    results = list()
+    for count, shards in partition_sizes():
+        replicas = addresses(count)
+        current, _ = resharding.partition_by_hash(replicas, shards)
+        # balance_shards gives up on some distributions, reshard from scratch then
+        current = current or dict()
+        # reshard to one more shard where possible, else one less
+        target = shards + 1 if count // (shards + 1) >= resharding.GLOBAL_MIN else max(1, shards - 1)
+        results.append(measure("stable_partition", dict(replicas=count, shards=shards, new_shards=target),
+                               lambda current=current, replicas=replicas, target=target: resharding.stable_partition(current, replicas, target)))
+    return results
+
+def clocks(size):
+    """Returns: (local clock, older client clock, next relayed clock of the first member, first member)"""
+    members = addresses(size)
+    rng = random.Random(size)
+    local_vc = {member: rng.randrange(100, 1000) for member in members}
+    client_vc = {member: val - rng.randrange(0, 10) for member, val in local_vc.items()}
+    relayed_vc = dict(local_vc)
+    relayed_vc[members[0]] += 1
+    return local_vc, client_vc, relayed_vc, members[0]
+
+class CompactClock():
+    """Candidate replica clock: the counters of a shard epoch in an array, at fixed member positions
+
+    Measured against the dictionary clock by the compact rows, it is not used by the replica: the causal metadata
+    is an address-keyed dictionary on the wire, and building one from the array costs ~10x a dictionary copy
+    """
+    __slots__ = ("members", "positions", "counters")
+
+    def __init__(self, vc):
+        self.members = tuple(vc)
+        self.positions = {address: i for i, address in enumerate(self.members)}
+        self.counters = array('q', vc.values())
+
+    def to_dict(self):
+        return dict(zip(self.members, self.counters))
+
+    def copy(self):
+        clock = CompactClock.__new__(CompactClock)
+        clock.members, clock.positions, clock.counters = self.members, self.positions, array('q', self.counters)
+        return clock
+
+    def increment_address(self, address):
+        self.counters[self.positions[address]] += 1
+
+    def merge(self, other):
+        """Piecewise maximum with the dictionary clock other, in place"""
+        counters = self.counters
+        positions = self.positions
+        for address, val in other.items():
+            i = positions.get(address)
+            if i is not None and val > counters[i]:
+                counters[i] = val
+        return self
+
+    def has_dependency(self, sender_addr, sender_vc):
+        """has_dependency() against this clock in a single pass, without padding sender_vc"""
+        counters = self.counters
+        positions = self.positions
+        if sender_addr and len(sender_vc) != len(positions):
+            return True
+        for address, val in sender_vc.items():
+            i = positions.get(address)
+            if i is None:
+                return True
+            if address == sender_addr:
+                if val != counters[i] + 1:
+                    return True
+            elif val > counters[i]:
+                return True
+        return False
+
+def compact(vc):
+    return CompactClock(vc)
+
+def bench_vector_clock(keys):
+    results = list()
+    for size in CLOCK_SIZES:
+        local_vc, client_vc, _, _ = clocks(size)
+        local, client = VectorClock(dict(local_vc)), VectorClock(dict(client_vc))
+        params = dict(clock_size=size)
+        results.append(measure("VectorClock <=", params, lambda: client <= local))
+        results.append(measure("compare", params, lambda: compare(client_vc, local_vc)))
+    return results
+
+def bench_dependency_check(keys):
+    results = list()
+    for size in CLOCK_SIZES:
+        local_vc, client_vc, relayed_vc, sender = clocks(size)
+        compact_vc = compact(local_vc)
+        # views_route.dependency_check is has_dependency against the replica's clock
+        results.append(measure("dependency_check (client)", dict(clock_size=size), lambda: has_dependency(None, client_vc, local_vc)))
+        results.append(measure("dependency_check (relay)", dict(clock_size=size), lambda: has_dependency(sender, relayed_vc, local_vc)))
+        # the replica's clock as a CompactClock, the metadata of the request stays a dictionary
+        results.append(measure("dependency_check (client, compact)", dict(clock_size=size), lambda: compact_vc.has_dependency(None, client_vc)))
+        results.append(measure("dependency_check (relay, compact)", dict(clock_size=size), lambda: compact_vc.has_dependency(sender, relayed_vc)))
+    return results
+
+def bench_max_of(keys):
+    results = list()
+    for size in CLOCK_SIZES:
+        local_vc, client_vc, _, _ = clocks(size)
+        local, client = VectorClock(dict(local_vc)), VectorClock(dict(client_vc))
+        params = dict(clock_size=size)
+        # max_of was replaced by merge_into, the original allocated a new dictionary per merge
+        results.append(measure("max_of (new dict)", params, lambda: {key: max(local_vc[key], client_vc[key]) for key in local_vc}))
+        results.append(measure("merge_into", params, lambda: merge_into(local_vc, client_vc)))
+        results.append(measure("merge_into (compact)", params, lambda vc=compact(local_vc): vc.merge(client_vc)))
+        results.append(measure("VectorClock.max_with", params, lambda: local.max_with(client)))
+    return results
+
+def stamp(vc, sender):
+    """views_route.stamp_relay: advance the clock and copy it into the relay metadata"""
+    vc[sender] += 1
+    return dict(vc)
+
+def stamp_compact(vc, sender):
+    """stamp() with the replica clock as a CompactClock"""
+    vc.increment_address(sender)
+    return vc.to_dict()
+
+def bench_causal_metadata(keys):
+    results = list()
+    for size in CLOCK_SIZES:
+        local_vc, _, _, sender = clocks(size)
+        compact_vc = compact(local_vc)
+        params = dict(clock_size=size)
+        # get_local_causal_metadata snapshots the clock for every client response
+        results.append(measure("snapshot (dict)", params, lambda: dict(local_vc)))
+        results.append(measure("snapshot (compact)", params, lambda: compact_vc.to_dict()))
+        results.append(measure("stamp_relay (dict)", params, lambda: stamp(local_vc, sender)))
+        results.append(measure("stamp_relay (compact)", params, lambda: stamp_compact(compact_vc, sender)))
+        results.append(measure("copy (compact)", params, lambda: compact_vc.copy()))
+    return results
+
+BENCHMARKS = dict(
+    consistent_hash_key=bench_consistent_hash_key,
+    calculate_ring_positions=bench_calculate_ring_positions,
+    partition_by_hash=bench_partition_by_hash,
+    balance_shards=bench_balance_shards,
+    stable_partition=bench_stable_partition,
+    vector_clock=bench_vector_clock,
+    dependency_check=bench_dependency_check,
+    max_of=bench_max_of,
+    causal_metadata=bench_causal_metadata,
+)
+
+def main(argv=None):
+    global REPLICA_COUNTS, CLOCK_SIZES, REPEAT, MIN_SECONDS
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the hashing, partitioning and causal hot paths")
+    parser.add_argument("--filter", default="", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--keys", type=int, default=KEYS, help="keys looked up per consistent_hash_key call")
+    parser.add_argument("--quick", action="store_true", help="fewer sizes, keys and repeats, for a fast sanity run")
+    parser.add_argument("--json", help="file the results are written to as JSON")
+    args = parser.parse_args(argv)
+    keys = args.keys
+    if args.quick:
+        REPLICA_COUNTS, CLOCK_SIZES, REPEAT, MIN_SECONDS = (10, 100), (2, 50), 1, 0.05
+        keys = min(keys, 10000)
+    keys = [f"key{i}" for i in random.Random(0).sample(range(keys * 10), keys)]
+
+    results = list()
+    for name, bench in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        for result in bench(keys):
+            params = " ".join(f"{key}={val}" for key, val in result["params"].items())
+            print(f"{result['name']:<36} {params:<36} {result['ops_per_sec']:>14,.0f} ops/s {result['ns_per_op']:>12,.0f} ns/op "
+                  f"{result['peak_bytes']:>12,} B peak {result['retained_bytes']:>10,} B retained", flush=True)
+            results.append(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(benchmark="bench_hotpaths", results=results), f, indent=2)
+
+if __name__ == "__main__":
+    main()
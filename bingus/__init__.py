@@ -1,9 +1,18 @@
-from flask import Flask
-
+# Flask is only imported once an app is created, so the Flask-free modules(resharding, storage, merkle, ...)
+# can be imported on their own, e.g. by the microbenchmarks
 def create_app():
+    from flask import Flask
     app = Flask(__name__)
 
     from .views_route import views_route
     app.register_blueprint(views_route)
+
+    from .debug_route import debug_route
+    app.register_blueprint(debug_route)
+
+    # several worker processes serve this replica, route requests to the lane owning them
+    from . import workers
+    if workers.lane is not None:
+        app.wsgi_app = workers.LaneDispatcher(app.wsgi_app)
     
     return app
@@ -0,0 +1,136 @@
+from bingus import tracing, views_route
+from flask import Blueprint, request, jsonify, make_response, Response
+from threading import Lock, get_ident, enumerate as enumerate_threads
+from functools import wraps
+import json
+import re
+import sys
+import time
+import tracemalloc
+
+DEBUG_ENDPOINTS = False # serve /debug/profile and /debug/alloc, they cost CPU and memory while used
+PROFILE_INTERVAL = 0.005 # seconds between two samples of every thread's stack
+PROFILE_MAX_SECONDS = 60 # longest profile a request may ask for
+ALLOC_TOP = 25 # allocation sites reported by default
+TRACEMALLOC_FRAMES = 16 # frames kept per allocation once /debug/alloc starts tracing
+
+debug_route = Blueprint("debug", __name__)
+profile_lock = Lock() # one profile at a time, two would sample each other
+alloc_lock = Lock()
+last_snapshot = None # tracemalloc snapshot of the previous /debug/alloc, growth is reported against it
+
+def guarded(view):
+    """Answer 404 unless DEBUG_ENDPOINTS is set"""
+    @wraps(view)
+    def guarded_view(*args, **kwargs):
+        if not DEBUG_ENDPOINTS:
+            return make_response(jsonify(error="Debug endpoints are disabled, set DEBUG_ENDPOINTS to enable them"), 404)
+        return view(*args, **kwargs)
+    return guarded_view
+
+# Slow traces kept by this replica(or worker lane), most recent first
+# Query: limit=<count>, min_ms=<duration>, format=ndjson for JSON lines
+@debug_route.route("/debug/traces", methods=["GET"])
+def get_traces():
+    limit = request.args.get("limit", type=int)
+    min_ms = request.args.get("min_ms", type=float)
+    traces = tracing.slow_traces(limit, min_ms)
+    if request.args.get("format") == "ndjson":
+        return Response("".join(json.dumps(trace) + "\n" for trace in traces), mimetype="application/x-ndjson")
+    return jsonify(traces=traces, sample_rate=tracing.TRACE_SAMPLE_RATE, slow_threshold=tracing.TRACE_SLOW_THRESHOLD)
+
+# --------------------------------------------------------------------------------------------------------------
+# Profiling
+# --------------------------------------------------------------------------------------------------------------
+
+def frame_name(code):
+    """Returns: "<directory>/<file>:<function>" of a code object, without spaces so collapsed stacks stay parseable"""
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{'/'.join(path[-2:])}:{code.co_name}".replace(" ", "_")
+
+def thread_group(name):
+    """Threads of a pool share a group, e.g. "waitress-12" -> "waitress", "Thread-3 (run)" -> "Thread (run)" """
+    return re.sub(r"[-_]\d+(?=$| \()", "", name, count=1)
+
+def sample_stacks(seconds, interval, per_thread):
+    """Sample the stack of every other thread every interval seconds
+
+    Returns: {collapsed stack(root first, thread first): samples}
+    """
+    me = get_ident()
+    counts = dict()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in enumerate_threads()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = list()
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            name = names.get(ident, str(ident))
+            stack.append(name if per_thread else thread_group(name))
+            collapsed = ";".join(reversed(stack))
+            counts[collapsed] = counts.get(collapsed, 0) + 1
+        time.sleep(interval)
+    return counts
+
+# Sample every thread's stack(request threads, pulse, anti-entropy, relay pools, ...) for seconds
+# Returns collapsed stacks, "thread;outer frame;...;inner frame <samples>" per line, the input of flamegraph.pl
+# Query: seconds=<1..PROFILE_MAX_SECONDS>, interval=<seconds between samples>, threads=each to not group pool threads
+@debug_route.route("/debug/profile", methods=["GET"])
+@guarded
+def get_profile():
+    seconds = min(max(request.args.get("seconds", 5, type=float), 0), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get("interval", PROFILE_INTERVAL, type=float), 0.001)
+    if not profile_lock.acquire(blocking=False):
+        return make_response(jsonify(error="A profile is already running"), 409)
+    try:
+        counts = sample_stacks(seconds, interval, request.args.get("threads") == "each")
+    finally:
+        profile_lock.release()
+    lines = "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+    return Response(lines, mimetype="text/plain")
+
+# --------------------------------------------------------------------------------------------------------------
+# Allocations
+# --------------------------------------------------------------------------------------------------------------
+
+def alloc_site(stat):
+    frame = stat.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+# Top allocation sites of the memory currently allocated, and their growth since the previous call
+# The first call starts tracemalloc(or start the replica with PYTHONTRACEMALLOC=<frames> to trace from boot)
+# Query: limit=<sites>, group=lineno|filename, stop=1 to stop tracing
+@debug_route.route("/debug/alloc", methods=["GET"])
+@guarded
+def get_alloc():
+    global last_snapshot
+    limit = request.args.get("limit", ALLOC_TOP, type=int)
+    group = request.args.get("group", "lineno")
+    if group not in ("lineno", "filename"):
+        return make_response(jsonify(error="group must be lineno or filename"), 400)
+    stores = {"store": dict(keys=len(views_route._store), bytes=views_route._store.size),
+              "substore": dict(keys=len(views_route._substore), bytes=views_route._substore.size)}
+    with alloc_lock:
+        if request.args.get("stop"):
+            tracemalloc.stop()
+            last_snapshot = None
+            return jsonify(tracing=False, stores=stores)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            last_snapshot = None
+            return jsonify(tracing=True, started=True, stores=stores)
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                              tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                                                              tracemalloc.Filter(False, "<unknown>")))
+        previous, last_snapshot = last_snapshot, snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    top = [dict(site=alloc_site(stat), bytes=stat.size, count=stat.count) for stat in snapshot.statistics(group)[:limit]]
+    growth = None
+    if previous is not None:
+        growth = [dict(site=alloc_site(diff), bytes=diff.size, bytes_diff=diff.size_diff, count=diff.count, count_diff=diff.count_diff)
+                  for diff in snapshot.compare_to(previous, group)[:limit]]
+    return jsonify(tracing=True, traced_bytes=current, peak_bytes=peak, stores=stores, top=top, growth=growth)
@@ -0,0 +1,70 @@
+from threading import Lock
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = 1 # seconds to wait for a TCP connection to a peer
+READ_TIMEOUT = 10 # seconds to wait for a peer's response
+POOL_MAXSIZE = 16 # max keep-alive connections kept open per peer
+
+class PeerPool():
+    # Shared keep-alive HTTP sessions for inter-replica traffic, one per peer address
+    # Each session keeps at most POOL_MAXSIZE idle connections to its peer
+    def __init__(self, pool_maxsize=None):
+        self.pool_maxsize = POOL_MAXSIZE if pool_maxsize is None else pool_maxsize
+        self.sessions = dict() # {addr: requests.Session}
+        self.headers = dict() # headers sent with every request
+        self.lock = Lock()
+        # stats
+        self.hits = 0 # requests that found a session for their peer
+        self.misses = 0 # requests that had to open a session for their peer
+
+    def session(self, addr):
+        session = self.sessions.get(addr)
+        if session is not None:
+            self.hits += 1
+            return session
+        with self.lock:
+            session = self.sessions.get(addr)
+            if session is None:
+                self.misses += 1
+                session = requests.Session()
+                session.headers.update(self.headers)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount("http://", adapter)
+                self.sessions[addr] = session
+            else:
+                self.hits += 1
+        return session
+
+    def request(self, method, addr, path, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs):
+        """Send an HTTP request to http://<addr><path> over a pooled connection
+
+        timeout is a (connect, read) tuple, read may be None to wait indefinitely
+        """
+        return self.session(addr).request(method, f"http://{addr}{path}", timeout=timeout, **kwargs)
+
+    def close(self, addr):
+        """Drop the connections to a peer(e.g. once it is removed from the view)"""
+        with self.lock:
+            session = self.sessions.pop(addr, None)
+        if session is not None:
+            session.close()
+
+    def stats(self):
+        """Returns: pool hit/miss counts and per-peer connection reuse counts"""
+        peers = dict()
+        for addr, session in list(self.sessions.items()):
+            pools = session.get_adapter("http://").poolmanager.pools
+            connections = 0
+            sent = 0
+            for key in pools.keys():
+                pool = pools[key]
+                connections += pool.num_connections
+                sent += pool.num_requests
+            peers[addr] = dict(connections=connections, requests=sent, reused=max(sent - connections, 0))
+        return dict(hits=self.hits, misses=self.misses, peers=peers)
+
+peer_pool = PeerPool()
+
+def peer_request(method, addr, path, **kwargs):
+    return peer_pool.request(method, addr, path, **kwargs)
@@ -0,0 +1,182 @@
+import math
+import random
+import time
+from collections import deque
+from threading import Lock
+
+PROBE_FANOUT = 3 # members probed directly every round
+INDIRECT_PROBES = 2 # members asked to probe a target that missed its direct probe
+PROBE_TIMEOUT = 0.3 # seconds to wait for a probe's response
+PHI_THRESHOLD = 8 # suspicion level at which a member is declared dead
+INTERVAL_WINDOW = 100 # heartbeat inter-arrival times kept per member
+GOSSIP_MAX = 8 # membership updates piggybacked on a single probe
+GOSSIP_RETRANSMIT = 3 # times each update is piggybacked, scaled by log(cluster size)
+
+ALIVE = "alive"
+SUSPECT = "suspect"
+DEAD = "dead"
+
+class Member():
+    __slots__ = ("addr", "status", "incarnation", "last_heard", "last_confirmed", "intervals")
+
+    def __init__(self, addr, now):
+        self.addr = addr
+        self.status = ALIVE
+        self.incarnation = 0
+        self.last_heard = now # monotonic time we last heard from the member
+        self.last_confirmed = time.time() # wall clock time we last heard from the member
+        self.intervals = deque(maxlen=INTERVAL_WINDOW)
+
+    def heard(self, now):
+        self.intervals.append(now - self.last_heard)
+        self.last_heard = now
+        self.last_confirmed = time.time()
+
+    def phi(self, now, default_interval):
+        """Suspicion level that the member is down, given how long it has been silent
+
+        Models heartbeat inter-arrival times as exponentially distributed, so
+        phi = -log10(P(silent for this long)) = elapsed / mean * log10(e)
+        """
+        mean = sum(self.intervals) / len(self.intervals) if self.intervals else default_interval
+        mean = max(mean, default_interval / 10)
+        return (now - self.last_heard) / mean * math.log10(math.e)
+
+class Membership():
+    # SWIM style membership list for one replica
+    # A few members are probed each round in randomized round robin order, membership
+    # changes are piggybacked on the probes, and a phi-accrual detector decides when
+    # a silent member is dead
+    def __init__(self, addr, probe_interval):
+        self.addr = addr
+        self.probe_interval = probe_interval
+        # a restarted replica comes back with a higher incarnation than any stale record of it
+        self.incarnation = int(time.time())
+        self.members = dict() # {addr: Member}
+        self.updates = dict() # {addr: [status, incarnation, transmissions left]}
+        self.probe_order = list()
+        self.lock = Lock()
+
+    def sync(self, views):
+        """Track exactly the members in views(other than this replica)"""
+        now = time.monotonic()
+        with self.lock:
+            for view in views:
+                if view != self.addr and view not in self.members:
+                    self.members[view] = Member(view, now)
+            for addr in list(self.members):
+                if addr not in views:
+                    del self.members[addr]
+
+    def next_targets(self):
+        """Returns the next PROBE_FANOUT members to probe"""
+        with self.lock:
+            targets = list()
+            while len(targets) < min(PROBE_FANOUT, len(self.members)):
+                if not self.probe_order:
+                    self.probe_order = list(self.members)
+                    random.shuffle(self.probe_order)
+                addr = self.probe_order.pop()
+                if addr in self.members and addr not in targets:
+                    targets.append(addr)
+            return targets
+
+    def helpers(self, target):
+        """Returns up to INDIRECT_PROBES random members to probe target on our behalf"""
+        with self.lock:
+            candidates = [addr for addr, member in self.members.items() if addr != target and member.status == ALIVE]
+        return random.sample(candidates, min(INDIRECT_PROBES, len(candidates)))
+
+    def heard_from(self, addr):
+        with self.lock:
+            member = self.members.get(addr)
+            if member is None:
+                return
+            member.heard(time.monotonic())
+            if member.status == SUSPECT:
+                member.status = ALIVE
+                self.queue_update(addr, ALIVE, member.incarnation)
+
+    def suspect(self, addr):
+        with self.lock:
+            member = self.members.get(addr)
+            if member is not None and member.status == ALIVE:
+                member.status = SUSPECT
+                self.queue_update(addr, SUSPECT, member.incarnation)
+
+    # Must be called with self.lock held
+    def queue_update(self, addr, status, incarnation):
+        transmissions = GOSSIP_RETRANSMIT * max(1, math.ceil(math.log2(len(self.members) + 2)))
+        self.updates[addr] = [status, incarnation, transmissions]
+
+    def gossip(self):
+        """Returns the membership updates to piggyback on the next message"""
+        with self.lock:
+            res = [dict(addr=self.addr, status=ALIVE, incarnation=self.incarnation)]
+            # least transmitted updates first
+            for addr, update in sorted(self.updates.items(), key=lambda item: -item[1][2])[:GOSSIP_MAX]:
+                res.append(dict(addr=addr, status=update[0], incarnation=update[1]))
+                update[2] -= 1
+                if update[2] <= 0:
+                    del self.updates[addr]
+            return res
+
+    def merge(self, updates):
+        """Apply piggybacked membership updates
+
+        Returns:
+            set of members that were confirmed dead by the updates
+        """
+        dead = set()
+        with self.lock:
+            for update in updates:
+                addr = update["addr"]
+                status = update["status"]
+                incarnation = update["incarnation"]
+                # refute suspicion about this replica
+                if addr == self.addr:
+                    if status != ALIVE and incarnation >= self.incarnation:
+                        self.incarnation = incarnation + 1
+                        self.queue_update(self.addr, ALIVE, self.incarnation)
+                    continue
+                member = self.members.get(addr)
+                if member is None:
+                    continue
+                if status == ALIVE and incarnation > member.incarnation:
+                    member.incarnation = incarnation
+                    if member.status != ALIVE:
+                        member.status = ALIVE
+                        self.queue_update(addr, ALIVE, incarnation)
+                elif status == SUSPECT and incarnation >= member.incarnation and member.status == ALIVE:
+                    member.incarnation = incarnation
+                    member.status = SUSPECT
+                    self.queue_update(addr, SUSPECT, incarnation)
+                elif status == DEAD and incarnation >= member.incarnation:
+                    del self.members[addr]
+                    self.queue_update(addr, DEAD, incarnation)
+                    dead.add(addr)
+        return dead
+
+    def evaluate(self):
+        """Returns: set of members whose phi crossed PHI_THRESHOLD, they are declared dead"""
+        now = time.monotonic()
+        # expected time between hearing from a member when probes go out round robin
+        default_interval = self.probe_interval * max(1, len(self.members) / PROBE_FANOUT)
+        dead = set()
+        with self.lock:
+            for addr, member in list(self.members.items()):
+                if member.phi(now, default_interval) >= PHI_THRESHOLD:
+                    del self.members[addr]
+                    self.queue_update(addr, DEAD, member.incarnation)
+                    dead.add(addr)
+        return dead
+
+    def snapshot(self):
+        """Returns: {addr: {status, incarnation, last_confirmed, phi}} for every tracked member"""
+        now = time.monotonic()
+        default_interval = self.probe_interval * max(1, len(self.members) / PROBE_FANOUT)
+        with self.lock:
+            return {addr: dict(status=member.status, incarnation=member.incarnation,
+                               last_confirmed=member.last_confirmed,
+                               phi=round(member.phi(now, default_interval), 3))
+                    for addr, member in self.members.items()}
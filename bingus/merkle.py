@@ -0,0 +1,65 @@
+import hashlib
+import json
+from bingus.resharding import hash_token, TOKEN_BITS
+
+MERKLE_DEPTH = 10 # the tree has 2**MERKLE_DEPTH leaves, each covering a contiguous range of key hashes
+
+def entry_hash(key, value):
+    """64-bit digest of a key value pair"""
+    return int.from_bytes(hashlib.md5(json.dumps([key, value]).encode('utf-8')).digest()[:8], 'big')
+
+class MerkleTree():
+    # Hash tree over the key hash space, stored as an array heap(root at 1, children of i at 2i and 2i + 1)
+    # A node's hash is the XOR of the entry hashes of every key in its range, so a PUT/DELETE
+    # only updates the O(depth) nodes on its leaf's path
+    # Leaves also keep the keys in their range, so the keys that differ can be listed per leaf
+    def __init__(self, depth=None):
+        self.depth = MERKLE_DEPTH if depth is None else depth
+        self.leaf_count = 1 << self.depth
+        self.nodes = [0] * (2 * self.leaf_count)
+        self.leaf_keys = dict() # {leaf index: set of keys}
+
+    # Returns the index of the leaf whose range contains key
+    def leaf(self, key):
+        return hash_token(key) >> (TOKEN_BITS - self.depth)
+
+    def toggle(self, key, value):
+        """Add(or remove, since XOR is its own inverse) a key value pair"""
+        leaf = self.leaf(key)
+        digest = entry_hash(key, value)
+        i = self.leaf_count + leaf
+        while i:
+            self.nodes[i] ^= digest
+            i >>= 1
+        return leaf
+
+    def add(self, key, value):
+        self.leaf_keys.setdefault(self.toggle(key, value), set()).add(key)
+
+    def remove(self, key, value):
+        leaf = self.toggle(key, value)
+        keys = self.leaf_keys.get(leaf)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.leaf_keys[leaf]
+
+    def rebuild(self, data):
+        self.nodes = [0] * (2 * self.leaf_count)
+        self.leaf_keys = dict()
+        for key, value in data.items():
+            self.add(key, value)
+
+    def root(self):
+        return self.nodes[1]
+
+    def hashes(self, level, indices):
+        """Returns: hashes of the nodes at indices of level(level 0 is the root)"""
+        return [self.nodes[(1 << level) + index] for index in indices]
+
+    def keys(self, leaves):
+        """Returns: every key in the given leaves"""
+        res = list()
+        for leaf in leaves:
+            res.extend(self.leaf_keys.get(leaf, ()))
+        return res
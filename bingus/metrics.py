@@ -0,0 +1,182 @@
+import bisect
+import math
+import threading
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Buckets for long running operations(reshards) in seconds
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+registry = list() # every metric, in the order they were created
+collectors = list() # functions returning the samples of values computed when scraped
+
+class Cells():
+    # Preallocated per-thread arrays of counts, summed when scraped
+    # A thread only ever writes its own array, so recording needs no lock
+    __slots__ = ("size", "local", "arrays", "lock")
+
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self.arrays = list()
+        self.lock = threading.Lock() # only taken the first time a thread records, and when scraped
+
+    def array(self):
+        try:
+            return self.local.array
+        except AttributeError:
+            array = [0] * self.size
+            with self.lock:
+                self.arrays.append(array)
+            self.local.array = array
+            return array
+
+    def totals(self):
+        with self.lock:
+            arrays = list(self.arrays)
+        totals = [0] * self.size
+        for array in arrays:
+            for i, val in enumerate(array):
+                totals[i] += val
+        return totals
+
+class CounterCells(Cells):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        self.array()[0] += amount
+
+class HistogramCells(Cells):
+    # a count per bucket, one for +Inf, then the sum of the observations
+    __slots__ = ("buckets",)
+
+    def __init__(self, buckets):
+        super().__init__(len(buckets) + 2)
+        self.buckets = buckets
+
+    def observe(self, value):
+        array = self.array()
+        array[bisect.bisect_left(self.buckets, value)] += 1
+        array[-1] += value
+
+class Metric():
+    # Metric family, one child per combination of label values
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = dict() # {label values: child}
+        self.lock = threading.Lock()
+        if not self.label_names:
+            self.children[()] = self.new_child()
+        registry.append(self)
+
+    def labels(self, *values):
+        """Returns: the child for the given label values, created on first use"""
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Returns: list of (name suffix, {label: value}, value)"""
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterCells(1)
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def samples(self):
+        return [("_total", dict(zip(self.label_names, values)), child.totals()[0]) for values, child in list(self.children.items())]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels)
+
+    def new_child(self):
+        return HistogramCells(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def samples(self):
+        res = list()
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.label_names, values))
+            totals = child.totals()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), totals):
+                cumulative += count
+                res.append(("_bucket", dict(labels, le=format_value(bound)), cumulative))
+            res.append(("_count", labels, cumulative))
+            res.append(("_sum", labels, totals[-1]))
+        return res
+
+def collector(fn):
+    """Register fn as a collector, it returns a list of (name, type, help, [({label: value}, value), ...])"""
+    collectors.append(fn)
+    return fn
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(val).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for val in labels.values())
+    return "{" + ",".join(f'{name}="{val}"' for name, val in zip(labels, escaped)) + "}"
+
+def render(extra_labels=None):
+    """Returns: every metric in the Prometheus text exposition format"""
+    extra_labels = extra_labels or dict()
+    lines = list()
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{format_labels(dict(extra_labels, **labels))} {format_value(value)}")
+    for fn in collectors:
+        for name, kind, help, samples in fn():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(dict(extra_labels, **labels))} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def merge(texts):
+    """Merge expositions whose samples carry distinct labels(e.g. one per worker lane) into one,
+    keeping a single HELP and TYPE line per metric
+    """
+    families = dict() # {name: [lines]}, in the order they first appear
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                if name in families:
+                    continue
+                families[name] = [line]
+            elif line.startswith("# TYPE "):
+                if len(families[name]) == 1:
+                    families[name].append(line)
+            elif line:
+                families[name].append(line)
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
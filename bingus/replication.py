@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import deque
+
+class ReplicationQueue():
+    """Ordered outbound queue of relayed writes for a single shard peer
+
+    A background sender thread drains the queue into batches of at most batch_size
+    operations. Operations are only removed from the head once the peer reports
+    them as applied, so the peer always sees them in the order they were queued.
+
+    send_batch(peer, ops) must return the number of ops (from the head) that the peer
+    applied, or None if the peer is unreachable and the queue should be dropped.
+    The ops still queued then are counted as dropped, anti-entropy repairs the peer later.
+    """
+    def __init__(self, peer, send_batch, batch_size, flush_interval):
+        self.peer = peer
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ops = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        # stats
+        self.enqueued = 0
+        self.sent_ops = 0
+        self.sent_batches = 0
+        self.failed_batches = 0
+        self.last_batch_size = 0
+        self.max_depth = 0
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self.run, name=f"replicate-{peer}", daemon=True)
+        self.thread.start()
+
+    def put(self, op):
+        with self.cond:
+            self.ops.append(op)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self.ops))
+            # wake the sender as soon as a full batch is available
+            if len(self.ops) >= self.batch_size:
+                self.cond.notify()
+
+    def depth(self):
+        return len(self.ops)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.dropped += len(self.ops)
+            self.ops.clear()
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                # wait for a full batch or the flush interval, whichever comes first
+                if len(self.ops) < self.batch_size and not self.closed:
+                    self.cond.wait(self.flush_interval)
+                if self.closed:
+                    return
+                if not self.ops:
+                    continue
+                batch = [self.ops[i] for i in range(min(self.batch_size, len(self.ops)))]
+
+            applied = self.send_batch(self.peer, batch)
+            if applied is None:
+                # peer is down, nothing left to deliver to
+                self.close()
+                return
+
+            with self.cond:
+                for _ in range(applied):
+                    self.ops.popleft()
+                self.sent_ops += applied
+                self.sent_batches += 1
+                self.last_batch_size = len(batch)
+            if applied < len(batch):
+                # peer could not apply the rest yet, back off before retrying
+                self.failed_batches += 1
+                time.sleep(self.flush_interval)
+
+    def stats(self):
+        return dict(depth=self.depth(), enqueued=self.enqueued, sent_ops=self.sent_ops,
+                    sent_batches=self.sent_batches, failed_batches=self.failed_batches,
+                    last_batch_size=self.last_batch_size, max_depth=self.max_depth, dropped=self.dropped)
@@ -1,9 +1,69 @@
 import math
 import hashlib
+import bisect
+import time
+from threading import Lock
 
-HASH_OUTPUT_SPACE = 128
+TOKEN_BITS = 64 # ring positions are the first 64 bits of an MD5 digest
+VNODES_PER_REPLICA = 128 # positions each replica takes on the ring
+MIN_VNODES_DIVISOR = 4 # the rebalancer leaves a replica at least the ring's positions per replica over this(and at least 1)
+MAX_VNODES_FACTOR = 8 # the rebalancer gives a replica at most this many times the ring's positions per replica
 GLOBAL_MIN = 2
 
+def hash_token(value):
+    """Position of value on the imaginary ring"""
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:TOKEN_BITS // 8], 'big')
+
+class HashRing():
+    # Consistent hash ring stored as parallel sorted arrays of tokens and owners
+    # Every replica is placed at vnodes positions so keys spread evenly across owners, unless
+    # weights gives it another number of positions(see plan_weights)
+    # Build a new ring whenever membership or weights change, lookups never modify it
+    def __init__(self, replicas=(), vnodes=None, weights=None):
+        self.vnodes = VNODES_PER_REPLICA if vnodes is None else vnodes
+        self.replicas = set(replicas)
+        # {replica: positions} of the replicas that do not take vnodes positions
+        self.weights = {replica: count for replica, count in (weights or dict()).items() if replica in self.replicas and count != self.vnodes}
+        # sort by (token, address) so every replica builds the exact same ring
+        # a replica's i-th position does not depend on its number of positions, so changing it only moves the ranges
+        # of the positions added or removed
+        positions = sorted((hash_token(f"{replica}#{i}"), replica) for replica in self.replicas for i in range(self.vnodes_of(replica)))
+        self.tokens = [token for token, _ in positions]
+        self.owners = [replica for _, replica in positions]
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def __contains__(self, replica):
+        return replica in self.replicas
+
+    def vnodes_of(self, replica):
+        """Returns: number of positions replica takes on the ring"""
+        return self.weights.get(replica, self.vnodes)
+
+    def owner_of_token(self, token):
+        """Returns: the replica at the first position clockwise from token"""
+        i = bisect.bisect_left(self.tokens, token)
+        return self.owners[i if i < len(self.tokens) else 0]
+
+    # Returns the replica at the first position clockwise from key, or None if the ring is empty
+    def lookup(self, key):
+        if not self.tokens:
+            return None
+        i = bisect.bisect_left(self.tokens, hash_token(key))
+        # wrap around the ring
+        if i == len(self.tokens):
+            i = 0
+        return self.owners[i]
+
+    # Returns the set of replicas whose positions come directly before one of replica's positions
+    def predecessors(self, replica):
+        res = set()
+        for i, owner in enumerate(self.owners):
+            if owner == replica and self.owners[i - 1] != replica:
+                res.add(self.owners[i - 1])
+        return res
+
 def balance_shards(shards, MIN_NODES_PER_SHARD):
     """
     Returns:
@@ -45,7 +105,6 @@ def partition_by_hash(replicas, shard_count):
     initial_distribution = dict()
     for id in range(shard_count):
         initial_distribution[id] = set()
-    ring_pos = dict()
     for replica in replicas:
         # Hash each replica by address
         raw_hash = hashlib.md5(bytes(replica.encode('ascii')))
@@ -53,26 +112,140 @@ def partition_by_hash(replicas, shard_count):
         # Calculate shard_id for replica
         shard_id = hash_as_decimal % shard_count
         initial_distribution[shard_id].add(replica)
-        # calculate position on imaginary ring
-        ring_pos[hash_as_decimal % HASH_OUTPUT_SPACE] = replica 
     # each partition must have at least 2 nodes
     initial_distribution = balance_shards(initial_distribution, math.floor(len(replicas)/shard_count))
-    return (initial_distribution, ring_pos)
+    return (initial_distribution, calculate_ring_positions(replicas))
+
+def stable_partition(shards, replicas, shard_count):
+    """Partition replicas into shard_count shards, keeping every replica in its current shard where possible
+
+    Shard sizes differ by at most one, the larger sizes go to the shards that already hold the most replicas
+    Returns:
+        dictionary of {shard_id: set of replicas}, or None if a shard would get fewer than GLOBAL_MIN replicas
+    """
+    replicas = sorted(replicas)
+    if shard_count < 1 or len(replicas) // shard_count < GLOBAL_MIN:
+        return None
+    current = {id: sorted(set(shards.get(id, ())) & set(replicas)) for id in range(shard_count)}
+    base, extra = divmod(len(replicas), shard_count)
+    by_size = sorted(range(shard_count), key=lambda id: (-len(current[id]), id))
+    sizes = {id: base + 1 if rank < extra else base for rank, id in enumerate(by_size)}
+
+    partition = {id: set(current[id][:sizes[id]]) for id in range(shard_count)}
+    placed = set().union(*partition.values())
+    # replicas of dropped shards, surplus replicas and unassigned replicas fill the remaining spots
+    pool = [replica for replica in replicas if replica not in placed]
+    for id in range(shard_count):
+        while len(partition[id]) < sizes[id]:
+            partition[id].add(pool.pop(0))
+    return partition
+
+def movement_plan(old_shards, new_shards):
+    """Substores every replica must fetch to move from old_shards to new_shards
+
+    A replica already holds the keys of the members of its old shard, so it only fetches
+    the substores of the members of its new shard it did not share a shard with
+    Returns:
+        dictionary of {replica: set of replicas whose substores it fetches}
+    """
+    old_members = dict()
+    for members in old_shards.values():
+        for replica in members:
+            old_members[replica] = set(members)
+    plan = dict()
+    for members in new_shards.values():
+        for replica in members:
+            plan[replica] = set(members) - old_members.get(replica, set()) - {replica}
+    return plan
+
+class Throttle():
+    # Limits transfers to rate bytes per second(None = unlimited), shared by concurrent transfers
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.lock = Lock()
+        self.next_free = time.monotonic() # time the next transfer may start
 
-def calculate_ring_positions(replicas):
+    def consume(self, amount):
+        """Block until amount bytes may be transferred"""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_free)
+            self.next_free = start + amount / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+def moved_ranges(old_ring, new_ring):
+    """Key ranges whose owner differs between two rings of the same replicas
+
+    Between two consecutive positions of either ring, both rings map every key to the owner of the later position
+    Returns:
+        set of (old owner, new owner) pairs
+    """
+    res = set()
+    for token in set(old_ring.tokens) | set(new_ring.tokens):
+        old, new = old_ring.owner_of_token(token), new_ring.owner_of_token(token)
+        if old != new:
+            res.add((old, new))
+    return res
+
+def load_shares(loads, key_weight=0.5):
+    """Share of the cluster's load every replica carries, from the keys it owns and the requests it serves
+
+    loads is {replica: {"keys": <INTEGER>, "requests-per-second": <FLOAT>}}, key_weight the weight of the keys
+    Returns:
+        dictionary of {replica: share}, the shares add up to 1(empty if there is no load at all)
+    """
+    total_keys = sum(load["keys"] for load in loads.values())
+    total_rate = sum(load["requests-per-second"] for load in loads.values())
+    if not total_rate:
+        key_weight = 1
+    if not total_keys:
+        key_weight = 0
+    if not total_keys and not total_rate:
+        return dict()
+    return {replica: (key_weight * load["keys"] / total_keys if total_keys else 0) +
+                     ((1 - key_weight) * load["requests-per-second"] / total_rate if total_rate else 0)
+            for replica, load in loads.items()}
+
+def plan_weights(shares, ring, trigger=1.25, target=1.1, step=0.25):
+    """Positions to move from the replicas carrying the most load to those carrying the least
+
+    A replica's load is assumed to follow its number of positions. Nothing moves until some replica carries
+    trigger times the mean share, then every replica outside target times the mean(either way) gets its
+    positions scaled towards the mean by at most step of them, within ring.vnodes // MIN_VNODES_DIVISOR and
+    ring.vnodes * MAX_VNODES_FACTOR.
+    trigger above target keeps rounds from undoing each other
+    Returns:
+        dictionary of {replica: new number of positions} for the replicas whose positions change
+    """
+    replicas = sorted(replica for replica in shares if replica in ring)
+    if len(replicas) < 2:
+        return dict()
+    mean = sum(shares[replica] for replica in replicas) / len(replicas)
+    if not mean or max(shares[replica] for replica in replicas) < mean * trigger:
+        return dict()
+    low = max(1, ring.vnodes // MIN_VNODES_DIVISOR)
+    high = ring.vnodes * MAX_VNODES_FACTOR
+    res = dict()
+    for replica in replicas:
+        ratio = shares[replica] / mean
+        if 1 / target <= ratio <= target:
+            continue
+        current = ring.vnodes_of(replica)
+        desired = min(max(current / max(ratio, 1e-9), current * (1 - step)), current * (1 + step))
+        desired = int(round(min(max(desired, low), high)))
+        if desired != current:
+            res[replica] = desired
+    return res
+
+def calculate_ring_positions(replicas, weights=None):
     """Calculate imaginary ring positions given an iterable of replica addresses
     
-    returns dict containing ring positions follow {hash: replica} format
-    ex: {5: a, 14: b}
+    returns HashRing with VNODES_PER_REPLICA positions per replica(or their number in weights)
+    ex: tokens [5, 9, 14, 20], owners [a, b, a, b]
     # new node added
-    {5: a, 7:c, 14:b}
+    tokens [5, 7, 9, 14, 16, 20], owners [a, c, b, a, c, b]
     """
-    ring_pos = dict()
-    for replica in replicas:
-        # Hash each replica by address
-        raw_hash = hashlib.md5(bytes(replica.encode('ascii')))
-        hash_as_decimal = int(raw_hash.hexdigest(),16)
-        # calculate position on imaginary ring
-        ring_pos[hash_as_decimal % HASH_OUTPUT_SPACE] = replica 
-    
-    return ring_pos
+    return HashRing(replicas, weights=weights)
@@ -0,0 +1,152 @@
+import hashlib
+import time
+from threading import Lock
+
+class CountMinSketch():
+    # Approximate count of every key in width * depth counters, whatever the number of keys
+    # An estimate is never below the true count, and above it by at most 2/width of all the counts(with
+    # probability 1 - 1/2^depth)
+    __slots__ = ("width", "depth", "mask", "rows", "total")
+
+    def __init__(self, width=2048, depth=4):
+        # a power of two width turns the modulo into a mask
+        self.width = 1 << max(width - 1, 1).bit_length()
+        self.depth = depth
+        self.mask = self.width - 1
+        self.rows = [[0] * self.width for _ in range(depth)]
+        self.total = 0
+
+    def indices(self, key):
+        """Returns: the counter of key in every row, from one hash of key"""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4 * row:4 * row + 4], "little") & self.mask for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Count key, conservatively(only the counters holding its estimate grow)
+
+        Returns: the new estimate of key
+        """
+        indices = self.indices(key)
+        estimate = min(row[i] for row, i in zip(self.rows, indices)) + count
+        for row, i in zip(self.rows, indices):
+            if row[i] < estimate:
+                row[i] = estimate
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        return min(row[i] for row, i in zip(self.rows, self.indices(key)))
+
+class TopK():
+    # The k keys with the highest estimated counts seen so far
+    # A key displaces the lowest one once its estimate is higher, so only the keys counted most stay tracked
+    __slots__ = ("k", "counts", "floor")
+
+    def __init__(self, k=32):
+        self.k = k
+        self.counts = dict() # {key: estimate}
+        self.floor = 0 # never above the lowest tracked estimate, keys at or below it are not tracked
+
+    def offer(self, key, estimate):
+        counts = self.counts
+        if key in counts or len(counts) < self.k:
+            counts[key] = estimate
+            return
+        if estimate <= self.floor:
+            return
+        victim = min(counts, key=counts.get)
+        # estimates only grow, so the floor stays below the lowest estimate until the next eviction
+        self.floor = counts[victim]
+        if estimate > self.floor:
+            del counts[victim]
+            counts[key] = estimate
+
+    def top(self, n=None):
+        """Returns: list of (key, estimate), highest first"""
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+class RateWindow():
+    # Amounts added during the last seconds seconds, in one bucket per second
+    __slots__ = ("seconds", "amounts", "stamps", "total")
+
+    def __init__(self, seconds=60):
+        self.seconds = seconds
+        self.amounts = [0] * seconds
+        self.stamps = [0] * seconds # second every bucket holds the amount of
+        self.total = 0 # everything ever added
+
+    def add(self, amount, now):
+        second = int(now)
+        i = second % self.seconds
+        if self.stamps[i] != second:
+            self.stamps[i] = second
+            self.amounts[i] = 0
+        self.amounts[i] += amount
+        self.total += amount
+
+    def rate(self, now):
+        """Returns: average amount per second over the window"""
+        second = int(now)
+        return sum(amount for amount, stamp in zip(self.amounts, self.stamps) if 0 <= second - stamp < self.seconds) / self.seconds
+
+class AccessStats():
+    # Streaming statistics on the client requests a replica serves: a count-min sketch and the top keys
+    # by access count, plus read and write rates and byte volumes. Its memory does not grow with the keys
+    KINDS = ("read", "write")
+
+    def __init__(self, width=2048, depth=4, top_keys=32, window=60):
+        self.lock = Lock()
+        self.sketch = CountMinSketch(width, depth)
+        self.top_keys = TopK(top_keys)
+        self.requests = {kind: RateWindow(window) for kind in self.KINDS}
+        self.bytes = {kind: RateWindow(window) for kind in self.KINDS}
+
+    def record(self, kind, key, size):
+        """Count one client read or write of key, moving size bytes"""
+        now = time.monotonic()
+        with self.lock:
+            self.top_keys.offer(key, self.sketch.add(key))
+            self.requests[kind].add(1, now)
+            self.bytes[kind].add(size, now)
+
+    def estimate(self, key):
+        with self.lock:
+            return self.sketch.estimate(key)
+
+    def summary(self, limit=None):
+        """Returns: JSON friendly statistics, see merge_summaries()"""
+        now = time.monotonic()
+        with self.lock:
+            res = {"accesses": self.sketch.total,
+                   "top-keys": [{"key": key, "count": count} for key, count in self.top_keys.top(limit)],
+                   # top key counts may be overestimated by up to max-error
+                   "max-error": round(2 * self.sketch.total / self.sketch.width, 3),
+                   "sketch": {"width": self.sketch.width, "depth": self.sketch.depth}}
+            for kind in self.KINDS:
+                res[f"{kind}s"] = self.requests[kind].total
+                res[f"{kind}-bytes"] = self.bytes[kind].total
+                res[f"{kind}s-per-second"] = round(self.requests[kind].rate(now), 3)
+                res[f"{kind}-bytes-per-second"] = round(self.bytes[kind].rate(now), 3)
+        return res
+
+def merge_summaries(summaries, limit=None):
+    """Add up the summaries of several replicas(or shards): counts, rates and the access counts of their top keys
+
+    Returns: summary of the same form
+    """
+    res = {"accesses": 0, "max-error": 0}
+    for kind in AccessStats.KINDS:
+        for field in (f"{kind}s", f"{kind}-bytes", f"{kind}s-per-second", f"{kind}-bytes-per-second"):
+            res[field] = 0
+    counts = dict()
+    for summary in summaries:
+        for field in res:
+            res[field] += summary.get(field, 0)
+        for entry in summary.get("top-keys", ()):
+            counts[entry["key"]] = counts.get(entry["key"], 0) + entry["count"]
+    for field in res:
+        if isinstance(res[field], float):
+            res[field] = round(res[field], 3)
+    top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+    res["top-keys"] = [{"key": key, "count": count} for key, count in top]
+    return res
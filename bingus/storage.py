@@ -0,0 +1,421 @@
+import json
+import os
+import time
+from threading import Thread, Lock, Condition
+from bingus.merkle import MerkleTree
+
+SNAPSHOT_EVERY = 10000 # WAL records written between two snapshots
+WAL_PREFIX = "wal."
+SNAPSHOT_FILE = "snapshot.json"
+
+def newer(version, current):
+    """True if a write stamped version supersedes the state of a key stamped current
+
+    Versions are (counter, replica) pairs, see MemoryStore.next_version(). Keys written without
+    one(e.g. migrated keys) have no version, any write supersedes them
+    """
+    return current is None or (version is not None and tuple(version) > tuple(current))
+
+def entry_size(key, value):
+    """Size in bytes of a key value pair: the key and its JSON encoded value"""
+    return len(key) + len(json.dumps(value))
+
+class SizedDict(dict):
+    # Dictionary that keeps the size in bytes of its entries(see entry_size), used for _substore
+    def __init__(self, data=()):
+        super().__init__()
+        self.size = 0
+        self.update(data)
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.size -= entry_size(key, dict.__getitem__(self, key))
+        dict.__setitem__(self, key, value)
+        self.size += entry_size(key, value)
+
+    def __delitem__(self, key):
+        self.size -= entry_size(key, dict.__getitem__(self, key))
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        if key in self:
+            value = dict.pop(self, key)
+            self.size -= entry_size(key, value)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, data=(), **kwargs):
+        for key, value in dict(data, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        self.size = 0
+
+class MemoryStore(dict):
+    # Default storage engine behind _store, an in-memory dictionary
+    # Every mutation also updates a Merkle tree over the store(used for anti-entropy)
+    # Writes may carry a version, deletes with one leave a tombstone, so anti-entropy never
+    # repairs a key with an older value or brings a deleted key back
+    # Persistent engines override the mutators and commit()
+    vc = None # last committed vector clock(recovered from disk by persistent engines)
+
+    def __init__(self):
+        super().__init__()
+        self.lock = Lock() # guards the data, the tree, the size, the versions and the tombstones
+        self.tree = MerkleTree()
+        self.size = 0 # bytes of the entries, see entry_size
+        self.versions = dict() # {key: version of its last write}, keys written without a version are left out
+        self.tombstones = dict() # {deleted key: version of its delete}
+
+    # Must be called with self.lock held
+    def put_locked(self, key, value, version=None):
+        if key in self:
+            old = dict.__getitem__(self, key)
+            self.tree.remove(key, old)
+            self.size -= entry_size(key, old)
+        dict.__setitem__(self, key, value)
+        self.tree.add(key, value)
+        self.size += entry_size(key, value)
+        self.tombstones.pop(key, None)
+        if version is None:
+            self.versions.pop(key, None)
+        else:
+            self.versions[key] = tuple(version)
+
+    # Must be called with self.lock held, key may already be absent
+    # Without a version the key is only dropped(e.g. its range moved to another shard), no tombstone is left
+    def delete_locked(self, key, version=None):
+        if key in self:
+            value = dict.pop(self, key)
+            self.tree.remove(key, value)
+            self.size -= entry_size(key, value)
+        self.versions.pop(key, None)
+        if version is None:
+            self.tombstones.pop(key, None)
+        else:
+            self.tombstones[key] = tuple(version)
+
+    # Must be called with self.lock held
+    def version_locked(self, key):
+        """Returns: version of key's last write or delete, None if it has none"""
+        version = self.versions.get(key)
+        return self.tombstones.get(key) if version is None else version
+
+    def next_version(self, key, replica):
+        """Version of a new write to key coordinated by replica: newer than every version key had,
+        and otherwise the current time in milliseconds, so versions stamped by different replicas compare sensibly
+
+        Must be called with the key's key lock held
+        """
+        with self.lock:
+            current = self.version_locked(key)
+        counter = int(time.time() * 1000)
+        if current is not None:
+            counter = max(counter, current[0] + 1)
+        return (counter, replica)
+
+    def put(self, key, value, version=None):
+        """Write key, unless its current version is newer than version(see newer())
+
+        Returns: True if key was written
+        """
+        with self.lock:
+            if not newer(version, self.version_locked(key)):
+                return False
+            self.put_locked(key, value, version)
+            return True
+
+    def delete(self, key, version=None):
+        """Delete key, unless its current version is newer than version(see newer()),
+        a delete with a version leaves a tombstone even if key is absent
+
+        Returns: True if key was deleted
+        """
+        with self.lock:
+            if not newer(version, self.version_locked(key)):
+                return False
+            if key in self or version is not None:
+                self.delete_locked(key, version)
+            return True
+
+    def purge_tombstones(self, before):
+        """Drop the tombstones of deletes whose version counter is below before(milliseconds, see next_version())
+
+        Returns: number of tombstones dropped
+        """
+        with self.lock:
+            expired = [key for key, version in self.tombstones.items() if version[0] < before]
+            for key in expired:
+                del self.tombstones[key]
+        return len(expired)
+
+    def counts(self):
+        """Returns: tuple in the form (number of keys, bytes), kept up to date by every write"""
+        with self.lock:
+            return (dict.__len__(self), self.size)
+
+    # Must be called with self.lock held, after the data was replaced as a whole
+    def rebuild_locked(self):
+        self.tree.rebuild(self)
+        self.size = sum(entry_size(key, value) for key, value in dict.items(self))
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.put_locked(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            self.delete_locked(key)
+
+    def pop(self, key, *default):
+        with self.lock:
+            if key in self:
+                value = dict.__getitem__(self, key)
+                self.delete_locked(key)
+                return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, data=(), **kwargs):
+        with self.lock:
+            for key, value in dict(data, **kwargs).items():
+                self.put_locked(key, value)
+
+    def clear(self):
+        self.replace(dict())
+
+    def replace(self, data):
+        """Replace the whole store with data, unversioned"""
+        with self.lock:
+            dict.clear(self)
+            dict.update(self, data)
+            self.versions.clear()
+            self.tombstones.clear()
+            self.rebuild_locked()
+
+    def tree_hashes(self, level, indices):
+        """Returns: Merkle tree hashes of the nodes at indices of level"""
+        with self.lock:
+            return self.tree.hashes(level, indices)
+
+    def leaf_items(self, leaves):
+        """Returns: tuple in the form ({key: value}, {key: version}, {deleted key: version})
+            for every key(and tombstone) in the given Merkle tree leaves
+        """
+        with self.lock:
+            keys = self.tree.keys(leaves)
+            leaves = set(leaves)
+            return ({key: dict.__getitem__(self, key) for key in keys},
+                    {key: self.versions[key] for key in keys if key in self.versions},
+                    {key: version for key, version in self.tombstones.items() if self.tree.leaf(key) in leaves})
+
+    def commit(self, vc=None):
+        """Make every write so far(and the vector clock vc) durable, a no-op in memory"""
+        pass
+
+    def close(self):
+        pass
+
+class WalStore(MemoryStore):
+    # Persistent storage engine: every write is appended to a write-ahead log(JSON lines)
+    # and made durable by commit(), which fsyncs once for every writer waiting on it(group commit)
+    # Every SNAPSHOT_EVERY records the store is compacted into a snapshot and the old log is dropped
+    # On startup the store and the last committed vector clock are recovered from the snapshot and the log
+    def __init__(self, directory, snapshot_every=None):
+        super().__init__()
+        self.directory = directory
+        self.snapshot_every = SNAPSHOT_EVERY if snapshot_every is None else snapshot_every
+        # self.lock also guards the log file and the lsn
+        self.sync_cond = Condition() # guards durable_lsn and syncing
+        self.lsn = 0 # records appended so far
+        self.durable_lsn = 0 # records known to be on disk
+        self.syncing = False
+        self.snapshotting = False
+        self.records_since_snapshot = 0
+        os.makedirs(directory, exist_ok=True)
+        self.segment = self.recover()
+        self.wal = open(self.segment_path(self.segment), "a", encoding="utf-8")
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"{WAL_PREFIX}{segment}")
+
+    def segments(self):
+        """Returns: sorted numbers of the log segments on disk"""
+        return sorted(int(name[len(WAL_PREFIX):]) for name in os.listdir(self.directory) if name.startswith(WAL_PREFIX))
+
+    def recover(self):
+        """Load the snapshot and replay the log after it
+
+        Returns: number of the log segment to append to, always a new one so
+            nothing is appended after a torn record
+        """
+        first_segment = 0
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            dict.update(self, snapshot["data"])
+            self.versions.update((key, tuple(version)) for key, version in snapshot.get("versions", {}).items())
+            self.tombstones.update((key, tuple(version)) for key, version in snapshot.get("tombstones", {}).items())
+            self.vc = snapshot["vc"]
+            first_segment = snapshot["wal_segment"]
+        segments = [segment for segment in self.segments() if segment >= first_segment]
+        for segment in segments:
+            with open(self.segment_path(segment), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn write at the end of the log
+                        break
+                    self.replay(record)
+        self.rebuild_locked()
+        return segments[-1] + 1 if segments else first_segment
+
+    def replay(self, record):
+        op = record["op"]
+        if op == "put":
+            dict.__setitem__(self, record["key"], record["value"])
+            self.replay_version(record["key"], record.get("version"), deleted=False)
+        elif op == "del":
+            dict.pop(self, record["key"], None)
+            self.replay_version(record["key"], record.get("version"), deleted=True)
+        elif op == "update":
+            dict.update(self, record["data"])
+            for key in record["data"]:
+                self.versions.pop(key, None)
+                self.tombstones.pop(key, None)
+        elif op == "replace":
+            dict.clear(self)
+            dict.update(self, record["data"])
+            self.versions.clear()
+            self.tombstones.clear()
+        elif op == "vc":
+            self.vc = record["vc"]
+
+    def replay_version(self, key, version, deleted):
+        self.versions.pop(key, None)
+        self.tombstones.pop(key, None)
+        if version is not None:
+            (self.tombstones if deleted else self.versions)[key] = tuple(version)
+
+    # Must be called with self.lock held
+    def append(self, record):
+        self.wal.write(json.dumps(record) + "\n")
+        self.lsn += 1
+        self.records_since_snapshot += 1
+
+    def put_locked(self, key, value, version=None):
+        super().put_locked(key, value, version)
+        self.append(dict(op="put", key=key, value=value, version=version))
+
+    def delete_locked(self, key, version=None):
+        super().delete_locked(key, version)
+        self.append(dict(op="del", key=key, version=version))
+
+    def update(self, data=(), **kwargs):
+        data = dict(data, **kwargs)
+        with self.lock:
+            for key, value in data.items():
+                MemoryStore.put_locked(self, key, value)
+            self.append(dict(op="update", data=data))
+
+    def replace(self, data):
+        with self.lock:
+            dict.clear(self)
+            dict.update(self, data)
+            self.versions.clear()
+            self.tombstones.clear()
+            self.rebuild_locked()
+            self.append(dict(op="replace", data=data))
+
+    def commit(self, vc=None):
+        with self.lock:
+            if vc is not None:
+                # log the copy, joins and reshards resize the live clock while it would be serialized
+                self.vc = dict(vc)
+                self.append(dict(op="vc", vc=self.vc))
+            lsn = self.lsn
+        self.sync(lsn)
+        if self.records_since_snapshot >= self.snapshot_every and not self.snapshotting:
+            self.snapshotting = True
+            Thread(target=self.snapshot, name="wal-snapshot", daemon=True).start()
+
+    def sync(self, lsn):
+        """Wait until the first lsn records are on disk
+
+        The first waiter to arrive becomes the leader and fsyncs for everyone that appended before it
+        """
+        with self.sync_cond:
+            while self.durable_lsn < lsn and self.syncing:
+                self.sync_cond.wait()
+            if self.durable_lsn >= lsn:
+                return
+            self.syncing = True
+        try:
+            with self.lock:
+                target = self.lsn
+                self.wal.flush()
+                wal = self.wal
+            os.fsync(wal.fileno())
+        finally:
+            with self.sync_cond:
+                self.durable_lsn = max(self.durable_lsn, target)
+                self.syncing = False
+                self.sync_cond.notify_all()
+
+    def snapshot(self):
+        """Write the store to a snapshot and drop the log segments it covers"""
+        # keep the group commit leader away from the log file while it is swapped
+        with self.sync_cond:
+            while self.syncing:
+                self.sync_cond.wait()
+            self.syncing = True
+        released = False
+        try:
+            # start a new log segment, the snapshot covers everything before it
+            with self.lock:
+                self.wal.flush()
+                os.fsync(self.wal.fileno())
+                self.wal.close()
+                self.segment += 1
+                self.wal = open(self.segment_path(self.segment), "a", encoding="utf-8")
+                data = dict(self)
+                versions = dict(self.versions)
+                tombstones = dict(self.tombstones)
+                vc = self.vc
+                self.records_since_snapshot = 0
+                segment = self.segment
+                lsn = self.lsn
+            with self.sync_cond:
+                self.durable_lsn = max(self.durable_lsn, lsn)
+                self.syncing = False
+                self.sync_cond.notify_all()
+            released = True
+            snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+            with open(snapshot_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(dict(data=data, versions=versions, tombstones=tombstones, vc=vc, wal_segment=segment), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+            for old in self.segments():
+                if old < segment:
+                    os.remove(self.segment_path(old))
+        finally:
+            if not released:
+                with self.sync_cond:
+                    self.syncing = False
+                    self.sync_cond.notify_all()
+            self.snapshotting = False
+
+    def close(self):
+        with self.lock:
+            self.wal.flush()
+            os.fsync(self.wal.fileno())
+            self.wal.close()
@@ -0,0 +1,130 @@
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+TRACE_HEADER = "X-Trace-Id" # trace a request belongs to, propagated on every hop it causes
+TRACE_SAMPLE_RATE = 0.0 # fraction of requests without a trace id that start a trace(0 = tracing off)
+TRACE_SLOW_THRESHOLD = 0.1 # seconds, sampled traces at least this slow are kept in the ring buffer
+TRACE_BUFFER_SIZE = 256 # most recent slow traces kept in memory
+TRACE_EXPORT_PATH = None # file every kept trace is also appended to as a JSON line(None = no export)
+
+recent = deque(maxlen=TRACE_BUFFER_SIZE) # most recent kept traces, oldest first
+export_lock = threading.Lock()
+local = threading.local() # trace of the request the current thread serves
+
+class Trace():
+    # Timed spans recorded while serving one request, spans may be recorded from several threads
+    __slots__ = ("id", "name", "start", "wall_start", "spans", "tags")
+
+    def __init__(self, id, name, **tags):
+        self.id = id
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = list() # list.append is atomic, relay threads append concurrently
+        self.tags = tags
+
+    def to_dict(self, duration):
+        return dict(trace_id=self.id, name=self.name, start=self.wall_start, duration_ms=round(duration * 1000, 3),
+                    spans=sorted(self.spans, key=lambda span: span["start_ms"]), **self.tags)
+
+class Span():
+    # Context manager timing one stage of a traced request
+    __slots__ = ("trace", "name", "tags", "start")
+
+    def __init__(self, trace, name, tags):
+        self.trace = trace
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        span = dict(name=self.name, start_ms=round((self.start - self.trace.start) * 1000, 3),
+                    duration_ms=round((end - self.start) * 1000, 3), thread=threading.current_thread().name, **self.tags)
+        if exc_type is not None:
+            span["error"] = exc_type.__name__
+        self.trace.spans.append(span)
+        return False
+
+    def tag(self, name, value):
+        self.tags[name] = value
+
+class NoSpan():
+    # Returned when the request is not traced, so untraced requests only pay for a lookup
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def tag(self, name, value):
+        pass
+
+NO_SPAN = NoSpan()
+
+def begin(name, trace_id=None, **tags):
+    """Start tracing the current request if it carries a trace id or is sampled
+
+    Returns: the Trace, or None if the request is not traced
+    """
+    if trace_id is None:
+        if not TRACE_SAMPLE_RATE or random.random() >= TRACE_SAMPLE_RATE:
+            local.trace = None
+            return None
+        trace_id = uuid.uuid4().hex
+    trace = Trace(trace_id, name, **tags)
+    local.trace = trace
+    return trace
+
+def current():
+    """Returns: the trace of the request served by this thread, or None"""
+    return getattr(local, "trace", None)
+
+def span(name, trace=None, **tags):
+    """Time a stage of the current request(or of trace, for stages run on other threads)"""
+    if trace is None:
+        trace = getattr(local, "trace", None)
+        if trace is None:
+            return NO_SPAN
+    return Span(trace, name, tags)
+
+def headers(trace=None):
+    """Returns: headers propagating the current trace(or trace) to a peer, None if the request is not traced"""
+    if trace is None:
+        trace = getattr(local, "trace", None)
+        if trace is None:
+            return None
+    return {TRACE_HEADER: trace.id}
+
+def finish(trace, **tags):
+    """Stop tracing the current request, keeping the trace if it was slow"""
+    local.trace = None
+    duration = time.perf_counter() - trace.start
+    if duration < TRACE_SLOW_THRESHOLD:
+        return
+    trace.tags.update(tags)
+    record = trace.to_dict(duration)
+    recent.append(record)
+    if TRACE_EXPORT_PATH:
+        export([record], TRACE_EXPORT_PATH)
+
+def export(records, path):
+    """Append records to path as JSON lines"""
+    lines = "".join(json.dumps(record) + "\n" for record in records)
+    with export_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+def slow_traces(limit=None, min_ms=None):
+    """Returns: kept traces, most recent first"""
+    traces = [trace for trace in reversed(list(recent)) if min_ms is None or trace["duration_ms"] >= min_ms]
+    return traces[:limit] if limit else traces
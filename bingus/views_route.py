@@ -1,17 +1,30 @@
-from bingus import resharding
-from flask import Flask, request, jsonify, make_response, Blueprint
+from bingus import resharding, workers, metrics, tracing
+from bingus.replication import ReplicationQueue
+from bingus.http_pool import peer_pool, peer_request, CONNECT_TIMEOUT, READ_TIMEOUT
+from bingus.storage import MemoryStore, SizedDict, entry_size, newer
+from bingus.sketches import AccessStats, merge_summaries
+from bingus.membership import Membership, PROBE_FANOUT, INDIRECT_PROBES, PROBE_TIMEOUT
+from flask import Flask, request, jsonify, make_response, Blueprint, Response, g
 import json
 import ast
+import copy
 import requests
-from threading import Thread, Lock
-from vectorclock import VectorClock
+from threading import Thread, Lock, Condition
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from vectorclock import VectorClock, has_dependency, merge_into, compare, BEFORE, EQUAL, AFTER
 from queue import Queue
 import time
 import hashlib
 import math
+import random
+import bisect
+import itertools
+import uuid
+from collections import OrderedDict
 
 views_route = Blueprint("views", __name__)
-_store = dict()
+TOPOLOGY_HEADER = "X-Topology-Epoch" # response header carrying topology_epoch(), clients refresh their ring when it changes
+_store = MemoryStore() # storage engine, replaced by a persistent engine at startup if configured
 MIN_KEY_LENGTH = 50
 
 shard_count = 0 # current # of shards in the system
@@ -19,18 +32,126 @@ shard_count = 0 # current # of shards in the system
 # Pulse vars 
 PULSE_INTERVAL = 0.5 # duration of time between pulse request sends
 update_views_lock = Lock()
+membership = Membership(None, PULSE_INTERVAL) # address is set at startup
+probe_pool = ThreadPoolExecutor(max_workers=PROBE_FANOUT, thread_name_prefix="probe")
+indirect_pool = ThreadPoolExecutor(max_workers=PROBE_FANOUT * INDIRECT_PROBES, thread_name_prefix="indirect-probe")
+FRESH_VIEW_DEADLINE = 1 # max seconds GET /view?fresh=true waits for its probes
+fresh_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fresh-probe")
 
 MIN_NODES = 2
 
-OUTPUT_SPACE = 128
+# Causal delivery vars
+CAUSAL_WAIT_TIMEOUT = 5 # max seconds a request waits for its causal dependencies before a 503
+clock_advanced = Condition() # guards every change to local_vc, notified whenever it advances
+
+# Concurrency vars
+KEY_LOCK_STRIPES = 64 # writes to keys in different stripes proceed in parallel
+key_locks = [Lock() for _ in range(KEY_LOCK_STRIPES)]
+
+# Relay vars
+RELAY_WORKERS = 16 # max number of concurrent relay sends per replica
+RELAY_ACK_COUNT = None # shard peers that must confirm a relay before the client is answered (None = all), see relay_kvs()
+RELAY_DEADLINE = 30 # max seconds a relay is retried before its peer is reported as failed(anti-entropy repairs it later)
+RELAY_BACKOFF = 0.05 # seconds before the first retry of a relay, doubled on every retry
+RELAY_MAX_BACKOFF = 2 # max seconds between two retries of a relay
+relay_pool = ThreadPoolExecutor(max_workers=RELAY_WORKERS, thread_name_prefix="relay")
+
+# Batch vars
+BATCH_WORKERS = 16 # max number of shard owners a /kvs/batch request is scattered to concurrently
+BATCH_TIMEOUT = 30 # max seconds a group of a /kvs/batch request waits for its owner, its operations then get a 503
+scatter_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="scatter")
+
+# Async replication vars
+ASYNC_REPLICATION = False # queue relays per peer and acknowledge clients before peers apply them
+REPLICATION_BATCH_SIZE = 64 # max number of writes sent to a peer in one /replicate request
+REPLICATION_FLUSH_INTERVAL = 0.05 # max time a queued write waits before its batch is sent
+replication_queues = dict() # {peer: ReplicationQueue}
+replication_dropped = dict() # {peer: writes dropped by its closed queues}, anti-entropy repairs them
+replication_lock = Lock()
+
+# Read routing vars
+READ_POLICIES = ("owner", "local-first", "round-robin", "least-outstanding")
+READ_POLICY = "owner" # which member of the owning shard serves a client GET, see route_read()
+read_counter = itertools.count() # round-robin position
+outstanding = dict() # {replica: client requests in flight here(for this replica) or forwarded to it}
+outstanding_lock = Lock()
+read_stats = dict(local=0, owner=0, replica=0, fallback=0)
+
+# Anti-entropy vars
+ANTI_ENTROPY_INTERVAL = 5 # seconds between two background Merkle tree syncs with a random shard peer
+TOMBSTONE_TTL = 3600 # seconds deletes are remembered for, a replica partitioned for longer may bring deleted keys back
+anti_entropy_lock = Lock() # one sync at a time
+anti_entropy_stats = dict(rounds=0, failed_rounds=0, ranges_compared=0, keys_repaired=0, last_peer=None)
+
+# Substore transfer vars
+SUBSTORE_PAGE_LIMIT = 1000 # default max number of keys in one /get-substore page
+SUBSTORE_STREAM_CHUNK = 256 # keys serialized, and applied by the receiver, at a time when streaming a substore
+TRANSFER_WORKERS = 8 # max number of members a reshard streams substores from concurrently
+SUBSTORE_SNAPSHOTS = 4 # max sorted key snapshots of paginated /get-substore walks kept at once, least recently used dropped first
+SUBSTORE_SNAPSHOT_TTL = 60 # seconds a walk's key snapshot is kept after its last page was served
+substore_snapshots = OrderedDict() # {snapshot id: [owner, sorted keys, expiry]}
+substore_snapshots_lock = Lock()
+transfer_pool = ThreadPoolExecutor(max_workers=TRANSFER_WORKERS, thread_name_prefix="transfer")
+
+# Online reshard vars
+MIGRATION_BANDWIDTH = None # max bytes per second a replica receives while migrating keys(None = unthrottled)
+MIGRATION_RETRIES = 3 # attempts to stream a member's substore before giving up on it
+migration = None # state of the current(or last) migration, see begin_migration()
+migration_thread = None
+migration_lock = Lock() # orders migrated keys with local writes to the same keys
+migration_written = set() # keys written since the current migration began, migrated values must not overwrite them
+
+# Rebalance vars, see /shard/rebalance
+REBALANCE_INTERVAL = None # seconds between two load checks by the lowest addressed replica(None = rebalance only on request)
+REBALANCE_TRIGGER = 1.25 # a round starts once a replica carries this many times the mean load
+REBALANCE_TARGET = 1.1 # replicas within this factor of the mean load keep their ring positions
+REBALANCE_STEP = 0.25 # max fraction of a replica's ring positions added or removed in one round
+REBALANCE_KEY_WEIGHT = 0.5 # weight of owned keys in a replica's load, request rates weigh the rest
+REBALANCE_TIMEOUT = 300 # max seconds a round waits for the key ranges it moved to migrate
+REBALANCE_COOLDOWN = 60 # min seconds between the end of a round and the next automatic one, so request rates reflect the new ring
+rebalance_round = 0 # rounds of ring weights applied, every replica applies the same rounds
+rebalance_lock = Lock() # one round coordinated at a time
+rebalance_state = dict(phase="idle", round=0, started=None, finished=None, plan=None, error=None) # round coordinated here
+previous_ring = None # ring before the current round, while the key ranges it moved migrate
+
+# Access statistics vars, exposed at /shard/stats
+SKETCH_WIDTH = 2048 # counters per row of the count-min sketch of key accesses
+SKETCH_DEPTH = 4 # rows of the count-min sketch
+TOP_KEYS = 32 # hottest keys tracked per replica
+RATE_WINDOW = 60 # seconds request and byte rates are averaged over
+STATS_TIMEOUT = 2 # max seconds a /shard/stats request waits for a member's statistics
+KEY_COUNT_TIMEOUT = 2 # max seconds /shard/key-count(s) waits for the members of other shards
+access_stats = AccessStats(SKETCH_WIDTH, SKETCH_DEPTH, TOP_KEYS, RATE_WINDOW) # client requests served here
+stats_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="stats")
+
+# Metrics vars, exposed at /metrics
+REQUEST_LATENCY = metrics.Histogram("bingus_request_duration_seconds", "Time to answer a request", ("route", "method"))
+REQUESTS = metrics.Counter("bingus_requests", "Requests answered", ("route", "method", "code"))
+FORWARDS = metrics.Counter("bingus_forwards", "Client requests forwarded to another replica", ("peer",))
+FORWARD_ERRORS = metrics.Counter("bingus_forward_errors", "Forwarded requests the peer did not answer", ("peer",))
+FORWARD_LATENCY = metrics.Histogram("bingus_forward_duration_seconds", "Round trip of a forwarded request", ("peer",))
+RELAYS = metrics.Counter("bingus_relays", "Writes relayed to a shard peer, by outcome", ("peer", "outcome"))
+RELAY_RETRIES = metrics.Counter("bingus_relay_retries", "Relay sends repeated because the peer answered 503 or timed out", ("peer",))
+RELAY_LATENCY = metrics.Histogram("bingus_relay_duration_seconds", "Time until a shard peer accepted a relayed write, retries included", ("peer",))
+CAUSAL_WAITS = metrics.Counter("bingus_causal_waits", "Requests parked on undelivered causal dependencies or an unapplied reshard", ("reason",))
+CAUSAL_REJECTS = metrics.Counter("bingus_causal_rejects", "Parked requests answered 503 because the wait timed out", ("reason",))
+CAUSAL_WAIT_LATENCY = metrics.Histogram("bingus_causal_wait_duration_seconds", "Time a request was parked", ("reason",))
+PULSE_RTT = metrics.Histogram("bingus_pulse_rtt_seconds", "Round trip of an answered direct pulse", ("peer",))
+PULSE_FAILURES = metrics.Counter("bingus_pulse_failures", "Direct pulses that went unanswered", ("peer",))
+RESHARD_DURATION = metrics.Histogram("bingus_reshard_duration_seconds", "Time from applying a reshard to the end of its key migration",
+                                     buckets=metrics.DURATION_BUCKETS)
+MIGRATED_KEYS = metrics.Counter("bingus_migrated_keys", "Keys received while migrating after a reshard")
+MIGRATED_BYTES = metrics.Counter("bingus_migrated_bytes", "Bytes received while migrating after a reshard")
+
 views = set()
 socket_address = None # this replica's address
 local_vc = dict()
-request_lock = Lock()
 shard_id = None # id of the shard this node belongs to
 shards = dict() # {shard_id: shard_members}
-ring_positions = dict()
-_substore = dict()
+shard_epoch = 0 # number of reshards applied, vector clocks restart every epoch
+ring_positions = resharding.HashRing() # rebuilt only when membership changes
+_substore = SizedDict()
+_MISSING = object() # value of keys absent from _store, see process_kvs()
 
 # --------------------------------------------------------------------------------------------------------------
 # Functions
@@ -39,17 +160,132 @@ def print_replica():
     print(f"_store: {_store}, views: {views}, VC: {local_vc}", flush=True)
 
 def get_local_causal_metadata(sender=True, sender_vc_all=None):
+    with clock_advanced:
+        vc = dict(local_vc)
     if not sender:
         if not sender_vc_all:
             sender_vc_all = dict()
-        sender_vc_all[str(shard_id)] = local_vc
-        return {"vc" : sender_vc_all} 
+        sender_vc_all[clock_id()] = vc
+        return {"vc" : sender_vc_all, "epoch": shard_epoch}
+
+    return {"vc":vc}
+
+def clock_id():
+    """Key of this replica's shard clock in client causal metadata
+
+    Every lane of a replica served by several worker processes keeps its own clock
+    """
+    return str(shard_id) if workers.lane is None else f"{shard_id}/{workers.lane}"
+
+def key_lock(key):
+    """Lock serializing the writes to key(shared by every key in its stripe)"""
+    return key_locks[hash(key) % KEY_LOCK_STRIPES]
 
-    return {"vc":local_vc}
+def forward(method, addr, key, payload):
+    """Returns: tuple in the form (response body, status code) from addr"""
+    track_outstanding(addr, 1)
+    FORWARDS.labels(addr).inc()
+    start = time.perf_counter()
+    try:
+        with tracing.span("forward", peer=addr):
+            response = peer_request(method, addr, f"/kvs/{key}", json=payload, headers=tracing.headers())
+    except requests.RequestException:
+        FORWARD_ERRORS.labels(addr).inc()
+        raise
+    finally:
+        track_outstanding(addr, -1)
+    FORWARD_LATENCY.labels(addr).observe(time.perf_counter() - start)
+    return (response.json(), response.status_code)
+
+def track_outstanding(addr, delta):
+    with outstanding_lock:
+        outstanding[addr] = outstanding.get(addr, 0) + delta
+
+def serves_locally(owner, payload) -> bool:
+    """True if this replica can serve a client GET for a key of owner right away:
+    it is in owner's shard, holds owner's keys(not still migrating them) and its clock
+    covers the client's causal metadata
+    """
+    if owner not in shards.get(shard_id, ()):
+        return False
+    if migrating() and migration["sources"].get(owner, "done") != "done":
+        return False
+    meta = payload.get("causal-metadata")
+    if not meta or "sender" in meta or meta.get("epoch", 0) < shard_epoch:
+        return True
+    if meta.get("epoch", 0) > shard_epoch:
+        return False
+    client_vc = meta["vc"].get(clock_id()) or dict()
+    return all(val <= local_vc.get(addr, 0) for addr, val in client_vc.items())
+
+def route_read(owner, payload):
+    """Pick the member of owner's shard that serves a client GET, according to READ_POLICY
+
+    Returns: address of the member, socket_address to serve the GET here
+    """
+    # forwarded by another member under a read policy, serve it here unless it has to go to the owner
+    if payload.get("forwarded-read"):
+        return socket_address if serves_locally(owner, payload) else owner
+    if READ_POLICY == "owner":
+        return owner
+    if READ_POLICY == "local-first":
+        return socket_address if serves_locally(owner, payload) else owner
+    members = sorted(member for member in shards.get(find_replica_id(shards, owner), ()) if member in views)
+    if not members:
+        return owner
+    if READ_POLICY == "round-robin":
+        target = members[next(read_counter) % len(members)]
+    else:
+        # least-outstanding, ties go to this replica, then to the owner
+        with outstanding_lock:
+            target = min(members, key=lambda member: (outstanding.get(member, 0), member != socket_address, member != owner))
+    if target == socket_address:
+        return socket_address if serves_locally(owner, payload) else owner
+    return target
 
-def forward(req, addr, key):
-    response = requests.request(req.method, f"http://{addr}/kvs/{key}",json=req.json)
-    return make_response(response.json(), response.status_code)
+def forward_read(key, target, owner, payload):
+    """Forward a client GET to target, falling back to owner if target is not the owner and is unreachable
+
+    Returns: tuple in the form (response body, status code)
+    """
+    if target == owner:
+        read_stats["owner"] += 1
+        return forward("GET", owner, key, payload)
+    try:
+        read_stats["replica"] += 1
+        return forward("GET", target, key, dict(payload, **{"forwarded-read": True}))
+    except (requests.RequestException, ValueError):
+        read_stats["fallback"] += 1
+        return forward("GET", owner, key, payload)
+
+def topology_epoch():
+    """Fingerprint of the ring and shard map, equal on every replica that agrees on the topology"""
+    topology = [shard_epoch, sorted(ring_positions.replicas), ring_positions.vnodes, sorted(ring_positions.weights.items()),
+                sorted((id, sorted(members)) for id, members in list(shards.items()))]
+    return hashlib.md5(json.dumps(topology).encode('utf-8')).hexdigest()[:16]
+
+@views_route.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # traced if a peer's request carries a trace id, or sampled
+    g.trace = tracing.begin(f"{request.method} {request.path}", request.headers.get(tracing.TRACE_HEADER),
+                            replica=socket_address, lane=workers.lane)
+
+@views_route.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    if "request_start" in g:
+        REQUEST_LATENCY.labels(route, request.method).observe(time.perf_counter() - g.request_start)
+    REQUESTS.labels(route, request.method, str(response.status_code)).inc()
+    if g.get("trace") is not None:
+        tracing.finish(g.trace, status=response.status_code)
+        response.headers[tracing.TRACE_HEADER] = g.trace.id
+    return response
+
+@views_route.after_request
+def add_topology_epoch(response):
+    response.headers[TOPOLOGY_HEADER] = topology_epoch()
+    return response
 
 def consistent_hash_key(key):
     """determine which shard key needs to go to
@@ -57,36 +293,66 @@ def consistent_hash_key(key):
     Returns:
         address that key should be processed at  
     """
-    raw_hash = hashlib.md5(bytes(key.encode('ascii')))
-    hash_as_decimal = int(raw_hash.hexdigest(),16)
+    # binary search for nearest node(clockwise)
+    return ring_positions.lookup(key)
 
-    key_ring_pos =  hash_as_decimal % OUTPUT_SPACE
+def buffer_send_kvs(method, key, addr, metadata, trace=None):
+    """Send update local vector clock along with request to other replicas
 
-    # walk along ring to nearest node(clockwise)
-    while key_ring_pos not in ring_positions:
-        key_ring_pos = (key_ring_pos + 1) % OUTPUT_SPACE
-    
-    return ring_positions[key_ring_pos]
+    trace is the trace of the relayed request, relays run on the relay pool's threads
+
+    Returns:
+        "delivered" once addr has processed the request, "unreachable" if addr is down, or "failed"
+    """
+    with tracing.span("relay-send", trace=trace, peer=addr) as span:
+        outcome = send_kvs(method, key, addr, metadata, tracing.headers(trace))
+        span.tag("outcome", outcome)
+    return outcome
 
-def buffer_send_kvs(req, key, addr):
-    """Send update local vector clock along with request to other replicas"""
+def send_kvs(method, key, addr, metadata, headers=None):
+    """Send a relayed write to addr, retrying with exponential backoff while addr answers 503 or times out
+
+    Returns: "delivered" once addr has processed the request, "unreachable" if addr is down, or "failed"
+        if addr did not process it within RELAY_DEADLINE seconds
+    """
+    start = time.perf_counter()
+    deadline = time.monotonic() + RELAY_DEADLINE
+    backoff = RELAY_BACKOFF
     while True:
+        remaining = deadline - time.monotonic()
         try:
-            metadata = req.json
-            metadata["causal-metadata"] = dict(sender=socket_address, vc=local_vc)
-            response = requests.request(f"{req.method}", f"http://{addr}/kvs/{key}", json=metadata, timeout=10)
-            if 'get-vc' in response.json() and VectorClock(response.json()['get-vc']) == VectorClock(local_vc):
-                break
+            response = peer_request(method, addr, f"/kvs/{key}", json=metadata, headers=headers,
+                                    timeout=(CONNECT_TIMEOUT, max(min(READ_TIMEOUT, remaining), CONNECT_TIMEOUT)))
             if response.status_code != 503:
-                break
+                return relay_outcome(addr, "delivered", start)
+            body = response.json()
+            if 'get-vc' in body and VectorClock(body['get-vc']) == VectorClock(metadata["causal-metadata"]["vc"]):
+                return relay_outcome(addr, "delivered", start)
         except requests.Timeout:
             with update_views_lock:
                 update_views({addr}, removed=True)
-            continue
         except (requests.ConnectionError, requests.RequestException):
             with update_views_lock:
                 update_views({addr}, removed=True)
-            break
+            return relay_outcome(addr, "unreachable", start)
+        except ValueError:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return relay_outcome(addr, "failed", start)
+        RELAY_RETRIES.labels(addr).inc()
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, RELAY_MAX_BACKOFF)
+
+def record_access(kind, key, value=None):
+    """Count a client read or write served by this replica, see /shard/stats"""
+    access_stats.record(kind, key, len(key) if value is None else entry_size(key, value))
+
+def relay_outcome(addr, outcome, start):
+    RELAYS.labels(addr, outcome).inc()
+    if outcome == "delivered":
+        RELAY_LATENCY.labels(addr).observe(time.perf_counter() - start)
+    return outcome
 
 def buffer_send_view(req : Flask.request_class, view : str):
     """Keep sending updated view information until received and processed (eventual consistency)"""
@@ -95,7 +361,7 @@ def buffer_send_view(req : Flask.request_class, view : str):
     metadata["relay"] = None
     while True:
         try:
-            response = requests.request(f"{req.method}", f"http://{view}/view", json=metadata)
+            response = peer_request(req.method, view, "/view", json=metadata, headers=tracing.headers())
             if response.status_code != 503:
                 return
         except requests.Timeout:
@@ -103,41 +369,79 @@ def buffer_send_view(req : Flask.request_class, view : str):
         except (requests.ConnectionError, requests.RequestException):
             continue
 
-def max_of(first : dict, second: dict):
-    """Return dictionary containing max of two dictionaries"""
-    keys = first.keys()
-    res = dict()
-    for key in keys:
-        res[key] = max(first[key], second[key])
-    return res
-
 def dependency_check(sender_addr, sender_vc) -> bool:
-    # Request is from client
-    if not sender_addr:
-        # Compare sender vc with what we have
-        # Pad if unequal length from sender
-        if len(sender_vc) < len(local_vc):
-            for key in local_vc:
-                if key not in sender_vc:
-                    sender_vc[key] = local_vc[key]
-        # Compare clocks
-        return not (VectorClock(sender_vc) <= VectorClock(local_vc))
-    # Request is from a Replica(i.e it is a relayed/broadcasted msg)
-    else:
-        # Make sure that both VCs have the same view before comparing
-        if not VectorClock(local_vc).has_same_view_as(VectorClock(sender_vc)):
-            return True
-
-        # Compare local vector clock with received vector clock
-        if sender_vc[sender_addr] != local_vc[sender_addr] + 1:
-            return True
-        for addr in sender_vc:
-            if addr == sender_addr:
-                continue
-            if not (sender_vc[addr] <= local_vc[addr]):
-                return True
-        # There are no dependencies
-        return False
+    """True if the request has causal dependencies local_vc has not delivered yet"""
+    return has_dependency(sender_addr, sender_vc, local_vc)
+
+def already_delivered(sender_addr, sender_vc) -> bool:
+    """True if the relayed message from sender_addr was delivered here before(i.e. it is a retry)"""
+    return bool(sender_addr) and sender_addr in local_vc and sender_vc.get(sender_addr, 0) <= local_vc[sender_addr]
+
+def wait_for_dependencies(sender_addr, sender_vc) -> bool:
+    """Park the request until local_vc satisfies its causal dependencies
+
+    Returns: True if the dependencies were satisfied within CAUSAL_WAIT_TIMEOUT seconds
+    """
+    start = time.perf_counter()
+    with tracing.span("causal-wait", sender=sender_addr), clock_advanced:
+        satisfied = clock_advanced.wait_for(lambda: not dependency_check(sender_addr, sender_vc), timeout=CAUSAL_WAIT_TIMEOUT)
+    return record_causal_wait("dependency", start, satisfied)
+
+def wait_for_epoch(epoch) -> bool:
+    """Park a relayed request sent after a reshard this replica has not applied yet
+
+    Returns: True if this replica reached epoch within CAUSAL_WAIT_TIMEOUT seconds
+    """
+    start = time.perf_counter()
+    with tracing.span("epoch-wait", epoch=epoch), clock_advanced:
+        reached = clock_advanced.wait_for(lambda: shard_epoch >= epoch, timeout=CAUSAL_WAIT_TIMEOUT)
+    return record_causal_wait("epoch", start, reached)
+
+def wait_for_migration(key) -> bool:
+    """Park a request for a key whose range a rebalance is still migrating to this replica's shard
+
+    Returns: True once the range migrated(or failed to), False if it did not within CAUSAL_WAIT_TIMEOUT seconds
+    """
+    state = migration
+    ring = previous_ring
+    if state is None or not state["active"] or state["kind"] != "rebalance" or ring is None:
+        return True
+    source = f"{ring.lookup(key)}>{consistent_hash_key(key)}"
+    if state["sources"].get(source, "done") != "pending":
+        return True
+    start = time.perf_counter()
+    with tracing.span("migration-wait", source=source), clock_advanced:
+        migrated = clock_advanced.wait_for(lambda: state["sources"][source] != "pending", timeout=CAUSAL_WAIT_TIMEOUT)
+    return record_causal_wait("migration", start, migrated)
+
+def record_causal_wait(reason, start, satisfied):
+    CAUSAL_WAITS.labels(reason).inc()
+    CAUSAL_WAIT_LATENCY.labels(reason).observe(time.perf_counter() - start)
+    if not satisfied:
+        CAUSAL_REJECTS.labels(reason).inc()
+    return satisfied
+
+def apply_stale_write(method, key, value=None, version=None):
+    """Apply a relayed write sent before the last reshard, if its key still belongs to this shard
+
+    Its clock belongs to the previous epoch, so it skips the causal checks: the key's owner
+    applied it already, and every write to the key is coordinated by its owner
+
+    Returns: tuple in the form (response body, status code)
+    """
+    owner = consistent_hash_key(key)
+    if owner not in shards[shard_id]:
+        return ({"result": "stale epoch, key moved"}, 200)
+    with key_lock(key):
+        write_local(method, key, value, owner, version)
+    _store.commit(local_vc)
+    return ({"result": "stale epoch, applied"}, 200)
+
+def advance_clock(sender_vc):
+    """Merge sender_vc into local_vc(in place) and wake requests waiting on their dependencies"""
+    with clock_advanced:
+        merge_into(local_vc, sender_vc)
+        clock_advanced.notify_all()
 
 def in_json(value_to_find, json):
     if value_to_find not in json:
@@ -146,18 +450,132 @@ def in_json(value_to_find, json):
 
 # Relay/rebroadcast a request to all replicas on the /view endpoint
 def relay_view(relayed_request):
-    for view in views:
+    # views may change while relaying
+    for view in list(views):
         if view != socket_address:
-            buffer_send_view(relayed_request, view)
+            with tracing.span("relay-view", peer=view):
+                buffer_send_view(relayed_request, view)
+
+def stamp_relay(method, key, payload):
+    """Advance this replica's own clock entry for a client write about to be relayed
+
+    Must be called in the same key_lock section as the write, so relays of the writes
+    to a key carry clocks in the order the writes were applied
+    With ASYNC_REPLICATION the write is also queued for every shard peer here, in the same
+    section as the clock advance, so every peer's queue is in clock order
+
+    Returns: tuple in the form (relay payload, shard members to relay to)
+    """
+    # snapshot the request since relay threads run outside of the request context
+    metadata = dict(payload)
+    with clock_advanced:
+        local_vc[socket_address] += 1
+        clock_advanced.notify_all()
+        metadata["causal-metadata"] = dict(sender=socket_address, vc=dict(local_vc), epoch=shard_epoch)
+        members = list(shards[shard_id])
+        if ASYNC_REPLICATION:
+            enqueue_replication(method, key, metadata, members)
+    return (metadata, members)
 
 # Relay/rebroadcast a request to all replicas on the /kvs endpoint
-def relay_kvs(relayed_request, key):
-    local_vc[socket_address] += 1
+def relay_kvs(method, key, metadata, members):
+    """Send the request stamped by stamp_relay() to every other shard member concurrently
+
+    Returns once RELAY_ACK_COUNT peers (or all of them) have answered; slower peers
+    keep being relayed to in the background.
+
+    Returns:
+        dictionary of {member: "delivered" | "unreachable" | "failed" | "pending" | "queued"}
+    """
+    if ASYNC_REPLICATION:
+        # queued by stamp_relay()
+        return {member: "queued" for member in members if member != socket_address}
     # relay request
-    for member in shards[shard_id]:
+    trace = tracing.current()
+    futures = dict()
+    for member in members:
         if member != socket_address:
             # Send request until it is received or the receiver is down
-            buffer_send_kvs(relayed_request, key, member)
+            futures[relay_pool.submit(buffer_send_kvs, method, key, member, metadata, trace)] = member
+
+    acks_needed = len(futures) if RELAY_ACK_COUNT is None else min(RELAY_ACK_COUNT, len(futures))
+    outcomes = {member: "pending" for member in futures.values()}
+    pending = set(futures)
+    acks = 0
+    with tracing.span("relay", peers=len(futures), acks_needed=acks_needed):
+        while pending and acks < acks_needed:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcomes[futures[future]] = future.result()
+                if outcomes[futures[future]] == "delivered":
+                    acks += 1
+    return outcomes
+
+def enqueue_replication(method, key, metadata, members):
+    """Queue a relayed write on every shard peer's ordered replication queue
+
+    Must be called with clock_advanced held, so writes are queued in the order of their clocks
+    """
+    op = dict(method=method, key=key, value=metadata.get("value"), vc=metadata["causal-metadata"]["vc"],
+              epoch=metadata["causal-metadata"]["epoch"], version=metadata.get("version"))
+    outcomes = dict()
+    with replication_lock:
+        for member in members:
+            if member == socket_address:
+                continue
+            queue = replication_queues.get(member)
+            if queue is None or queue.closed:
+                if queue is not None:
+                    replication_dropped[member] = replication_dropped.get(member, 0) + queue.dropped
+                queue = ReplicationQueue(member, send_replication_batch, REPLICATION_BATCH_SIZE, REPLICATION_FLUSH_INTERVAL)
+                replication_queues[member] = queue
+            queue.put(op)
+            outcomes[member] = "queued"
+    return outcomes
+
+def send_replication_batch(addr, ops):
+    """Send a batch of relayed writes to addr
+
+    Returns:
+        number of ops addr applied, or None if addr is down
+    """
+    try:
+        response = peer_request("POST", addr, "/replicate", json=dict(sender=socket_address, operations=ops))
+        return response.json()["applied"]
+    except requests.Timeout:
+        return 0
+    except (requests.ConnectionError, requests.RequestException, ValueError, KeyError):
+        with update_views_lock:
+            update_views({addr}, removed=True)
+        return None
+
+def write_local(method, key, value=None, owner=None, version=None):
+    """Apply a PUT/DELETE to _store, and to _substore if the key hashes to this replica,
+    unless the key already has a newer version than version
+
+    Returns: True if the write was applied
+    """
+    if owner is None:
+        owner = consistent_hash_key(key)
+    if migration is not None and migration["active"]:
+        # keys written while migrating are newer than any migrated value
+        with migration_lock:
+            migration_written.add(key)
+            return apply_write(method, key, value, owner, version)
+    return apply_write(method, key, value, owner, version)
+
+def apply_write(method, key, value, owner, version=None):
+    if method == "PUT":
+        if not _store.put(key, value, version):
+            return False
+        if owner == socket_address:
+            _substore[key] = value
+    else:
+        if not _store.delete(key, version):
+            return False
+        if owner == socket_address:
+            _substore.pop(key, None)
+    return True
 
 def valid_json(json_str):
     '''
@@ -178,111 +596,366 @@ def valid_json(json_str):
     except ValueError:
         return None
 
-def get_metadata(req):
-    """Metadata of a request
+def get_metadata(payload):
+    """Metadata of a request body
 
     Returns: tuple in the form (sender_addr, sender_vc) 
         or (None, sender_vc)
     """
     sender = None
-    meta = req.json["causal-metadata"]
+    meta = payload["causal-metadata"]
     sender_vc = meta['vc']
 
     if "sender" in meta:
         sender = meta["sender"]
         return (sender, sender_vc,None)
 
-    if str(shard_id) not in sender_vc:
-        sender_vc[str(shard_id)] = local_vc
-    return (sender, sender_vc[str(shard_id)], sender_vc)
+    # client metadata from before the last reshard, its clocks no longer apply
+    # the metadata is copied, not changed: the operations of a batch may share it across threads
+    sender_vc = dict() if meta.get("epoch", 0) < shard_epoch else dict(sender_vc)
+    if clock_id() in sender_vc:
+        sender_vc[clock_id()] = dict(sender_vc[clock_id()])
+    else:
+        with clock_advanced:
+            sender_vc[clock_id()] = dict(local_vc)
+    return (sender, sender_vc[clock_id()], sender_vc)
 
 # --------------------------------------------------------------------------------------------------------------
 # Key Value Store endpoint
 # --------------------------------------------------------------------------------------------------------------
 @views_route.route("/kvs/<key>", methods=["GET", "PUT", "DELETE"])
 def adjust_mapping(key):
+    track_outstanding(socket_address, 1)
+    try:
+        body, status = process_kvs(request.method, key, request.json)
+    finally:
+        track_outstanding(socket_address, -1)
+    return make_response(body, status)
+
+def process_kvs(method, key, payload):
+    """Perform a single GET/PUT/DELETE on the key value store, forwarding it if needed
+
+    Returns: tuple in the form (response body, status code)
+    """
     global local_vc
     global _store
     # key length must be less than 50 characters
     if len(key) > MIN_KEY_LENGTH:
-        return make_response(jsonify(error="Key is too long"), 400)
+        return ({"error": "Key is too long"}, 400)
     
     sender = None
     sender_vc = None
     sender_vc_all = None
     addr_to_send = None
     # Perform logic if causal-metadata is present(not None)
-    if request.json["causal-metadata"]:
-        sender, sender_vc, sender_vc_all = get_metadata(request)
+    if payload["causal-metadata"]:
+        sender, sender_vc, sender_vc_all = get_metadata(payload)
         # hash value to determine whether to forward or proceed locally
         addr_to_send = consistent_hash_key(key)
         # request is from client and key is hashed to different replica
         if not sender and addr_to_send != socket_address:
-                return forward(request, addr_to_send,key)
+            if method != "GET":
+                return forward(method, addr_to_send, key, payload)
+            # GETs may be served by any member of the owning shard
+            target = route_read(addr_to_send, payload)
+            if target != socket_address:
+                return forward_read(key, target, addr_to_send, payload)
+
+        if sender:
+            epoch = payload["causal-metadata"].get("epoch", shard_epoch)
+            # Relayed message sent after a reshard this replica has not applied yet
+            if epoch > shard_epoch and not wait_for_epoch(epoch):
+                return ({"error": "Reshard not applied yet; try again later", "get-vc" : get_local_causal_metadata()["vc"]}, 503)
+            # Relayed message sent before the last reshard
+            if epoch < shard_epoch:
+                return apply_stale_write(method, key, payload.get("value"), payload.get("version"))
    
+        # Relayed message that was already delivered(sender is retrying)
+        if already_delivered(sender, sender_vc):
+            return ({"result": "already delivered"}, 200)
         # Check for dependencies
         dependency_result = dependency_check(sender, sender_vc)
-        # There is a dependency return 503
-        if dependency_result:
-            return make_response({"error": "Causal dependencies not satisfied; try again later", "get-vc" : get_local_causal_metadata()["vc"]}, 503)
+        # There is a dependency, wait for it to be delivered and return 503 if it does not arrive in time
+        if dependency_result and not wait_for_dependencies(sender, sender_vc):
+            return ({"error": "Causal dependencies not satisfied; try again later", "get-vc" : get_local_causal_metadata()["vc"]}, 503)
     else:
         addr_to_send = consistent_hash_key(key)
         if addr_to_send != socket_address:
-            return forward(request, addr_to_send,key)
+            if method != "GET":
+                return forward(method, addr_to_send, key, payload)
+            target = route_read(addr_to_send, payload)
+            if target != socket_address:
+                return forward_read(key, target, addr_to_send, payload)
     # PUT request
-    if request.method == "PUT":
+    if method == "PUT":
         # Verify that request contains valid json and "value" as a key
-        if not 'value' in request.json:
-            return make_response(jsonify(error="PUT request does not specify a value"), 400)
-
-        value = request.json['value']
-
-        # Update local VC if request contains a VC
-        if sender_vc:
-            local_vc = max_of(local_vc, sender_vc)
-
-        # Only broadcast delivered client requests
+        if not 'value' in payload:
+            return ({"error": "PUT request does not specify a value"}, 400)
+
+        value = payload['value']
+        # writes to a key are applied, and stamped for relaying, one at a time
+        with tracing.span("write"), key_lock(key):
+            replaced = key in _store
+            # the owner versions every write to its keys, relays carry the version
+            version = payload.get("version") if sender else _store.next_version(key, socket_address)
+            # Update store(and _substore if key hashed to local replica)
+            # before the clock advances, so requests woken by the new clock see the write
+            write_local("PUT", key, value, addr_to_send, version)
+
+            # Update local VC if request contains a VC
+            if sender_vc:
+                advance_clock(sender_vc)
+            if not sender:
+                relay = stamp_relay(method, key, dict(payload, version=version))
+
+        # Only broadcast delivered client requests(outside the key lock, receivers restore the order)
         if not sender:
-            relay_kvs(request, key)
-
-        # Created new mapping
-        res = make_response({"result": "created", "causal-metadata": get_local_causal_metadata(sender, sender_vc_all)}, 201)
-        # Replaced old mapping
-        if key in _store:
-            res = make_response({"result": "replaced", "causal-metadata": get_local_causal_metadata(sender, sender_vc_all)}, 200)
-        # Update store
-        _store[key] = value
-        # possibly update _substore if key hashed to local replica
-        if addr_to_send == socket_address:
-            _substore[key] = value
-        
-        return res
+            record_access("write", key, value)
+            outcomes = relay_kvs(method, key, *relay)
+        # Make the write durable before answering
+        with tracing.span("commit"):
+            _store.commit(local_vc)
+
+        # Replaced old mapping, or created a new one
+        body = {"result": "replaced" if replaced else "created", "causal-metadata": get_local_causal_metadata(sender, sender_vc_all)}
+        if not sender:
+            body["relay"] = outcomes
+        return (body, 200 if replaced else 201)
     
+    # read once, a concurrent DELETE may remove the key at any point
+    value = _store.get(key, _MISSING)
+    if value is _MISSING:
+        # The key's range may still be migrating here after a rebalance
+        if not wait_for_migration(key):
+            return ({"error": "Key is migrating; try again later"}, 503)
+        value = _store.get(key, _MISSING)
+
     # Cannot process GET or DELETE requests if key does not exist in _store
-    if key not in _store:
-        return make_response(jsonify(error="Key does not exist"), 404)
+    # (a relayed DELETE is still delivered, the key may not have been migrated here yet)
+    if value is _MISSING and not (sender and method == "DELETE"):
+        return ({"error": "Key does not exist"}, 404)
     
     # GET Request
-    if request.method == "GET":  
-        return make_response({"result": "found", "value": _store[key], "causal-metadata": get_local_causal_metadata()}, 200)
+    if method == "GET":  
+        read_stats["local"] += 1
+        record_access("read", key, value)
+        return ({"result": "found", "value": value, "causal-metadata": get_local_causal_metadata(sender, sender_vc_all)}, 200)
 
     # DELETE Request
-    if request.method == "DELETE":
-        # Remove key from dictionary
-        _store.pop(key, None)
-        # possibly remove key from _substore
-        if addr_to_send == socket_address:
-            _substore.pop(key, None)
-        # Update local VC if request contains a VC
-        if sender_vc:
-            local_vc = max_of(local_vc, sender_vc)
+    if method == "DELETE":
+        with tracing.span("write"), key_lock(key):
+            version = payload.get("version") if sender else _store.next_version(key, socket_address)
+            # Remove key from dictionary(and _substore if key hashed to local replica), leaving a tombstone
+            write_local("DELETE", key, owner=addr_to_send, version=version)
+            # Update local VC if request contains a VC
+            if sender_vc:
+                advance_clock(sender_vc)
+            if not sender:
+                relay = stamp_relay(method, key, dict(payload, version=version))
 
         # Only broadcast delivered client requests
         if not sender:
-            relay_kvs(request, key)
+            record_access("write", key)
+            outcomes = relay_kvs(method, key, *relay)
+        # Make the delete durable before answering
+        with tracing.span("commit"):
+            _store.commit(local_vc)
         
         # Complete delete request
-        return make_response({"result": "deleted", "causal-metadata": get_local_causal_metadata()}, 200)
+        body = {"result": "deleted", "causal-metadata": get_local_causal_metadata(sender, sender_vc_all)}
+        if not sender:
+            body["relay"] = outcomes
+        return (body, 200)
+
+# Perform many GET/PUT/DELETE operations in one request
+# Given JSON body {"operations": [{"method": <GET|PUT|DELETE>, "key": <key>, "value": <value>}, ...], "causal-metadata": <metadata>}
+@views_route.route("/kvs/batch", methods=["POST"])
+def batch_mapping():
+    operations = in_json("operations", request.json)
+    if not isinstance(operations, list):
+        return make_response(jsonify(error="Missing operations"), 400)
+    metadata = in_json("causal-metadata", request.json)
+
+    results = [None] * len(operations)
+    # group operations by the replica(and worker lane) their key hashes to, keeping request order within a group
+    groups = dict()
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict) or not isinstance(op.get("key"), str) or op.get("method") not in ("GET", "PUT", "DELETE"):
+            results[index] = dict(status=400, error="Operation must specify a method and a string key")
+            continue
+        groups.setdefault((consistent_hash_key(op["key"]), workers.lane_of(op["key"])), []).append(index)
+
+    # scatter remote groups to their owners while the local group runs here
+    local = (socket_address, workers.lane)
+    trace = tracing.current()
+    futures = dict()
+    for (owner, lane), indices in groups.items():
+        if (owner, lane) != local:
+            # every group gets its own copy of the metadata
+            futures[scatter_pool.submit(forward_batch, owner, [operations[i] for i in indices], copy.deepcopy(metadata),
+                                        lane, trace)] = indices
+    group_results = list()
+    if local in groups:
+        indices = groups[local]
+        group_results.append((indices, run_batch([operations[i] for i in indices], copy.deepcopy(metadata))))
+    # gather
+    for future, indices in futures.items():
+        group_results.append((indices, future.result()))
+
+    merged_metadata = merge_causal_metadata([metadata] + [meta for _, (_, meta) in group_results])
+    for indices, (op_results, _) in group_results:
+        for index, result in zip(indices, op_results):
+            results[index] = result
+    return make_response(dict(results=results, **{"causal-metadata": merged_metadata}), 200)
+
+def run_batch(operations, metadata):
+    """Perform operations in order, passing each one the causal metadata returned by the previous one
+
+    Returns: tuple in the form (list of per-operation results, final causal metadata)
+    """
+    results = list()
+    for op in operations:
+        payload = {"causal-metadata": metadata}
+        if "value" in op:
+            payload["value"] = op["value"]
+        body, status = process_kvs(op["method"], op["key"], payload)
+        if "causal-metadata" in body:
+            metadata = body.pop("causal-metadata")
+        body["status"] = status
+        results.append(body)
+    return (results, metadata)
+
+def forward_batch(addr, operations, metadata, lane=None, trace=None):
+    """Send a group of operations to the replica(and worker lane) that owns their keys
+    trace is the trace of the batch, groups are forwarded from the scatter pool's threads
+
+    Returns: tuple in the form (list of per-operation results, final causal metadata)
+    """
+    headers = dict(tracing.headers(trace) or ())
+    if lane is not None:
+        headers[workers.WORKER_HEADER] = str(lane)
+    try:
+        with tracing.span("forward-batch", trace=trace, peer=addr, operations=len(operations)):
+            response = peer_request("POST", addr, "/kvs/batch", json={"operations": operations, "causal-metadata": metadata},
+                                    headers=headers, timeout=(CONNECT_TIMEOUT, BATCH_TIMEOUT))
+        body = response.json()
+        return (body["results"], body["causal-metadata"])
+    except requests.Timeout:
+        # the owner may still apply some of them
+        return ([dict(status=503, error=f"Replica {addr} did not answer in time") for _ in operations], metadata)
+    except (requests.ConnectionError, requests.RequestException, ValueError, KeyError):
+        return ([dict(status=503, error=f"Replica {addr} is unreachable") for _ in operations], metadata)
+
+def merge_causal_metadata(all_metadata):
+    """Merge client causal metadata of the form {"vc": {shard_id: vc}} by taking the max of every clock"""
+    all_metadata = [metadata for metadata in all_metadata if metadata and "vc" in metadata]
+    # only clocks of the latest shard epoch are kept
+    epoch = max((metadata.get("epoch", 0) for metadata in all_metadata), default=0)
+    merged = dict()
+    for metadata in all_metadata:
+        if metadata.get("epoch", 0) != epoch:
+            continue
+        for id, vc in metadata["vc"].items():
+            merged_vc = merged.setdefault(str(id), dict())
+            for addr, val in vc.items():
+                merged_vc[addr] = max(merged_vc.get(addr, 0), val)
+    return {"vc": merged, "epoch": epoch} if merged else None
+
+# Apply a batch of relayed writes queued by a shard peer(async replication)
+# Given JSON body {"sender": <IP:PORT>, "operations": [{"method", "key", "value", "vc"}, ...]}
+@views_route.route("/replicate", methods=["POST"])
+def apply_replication_batch():
+    global local_vc
+    sender = request.json["sender"]
+    operations = request.json["operations"]
+    applied = 0
+    # apply in queue order, stopping at the first write whose dependencies are not satisfied yet
+    for op in operations:
+        sender_vc = op["vc"]
+        epoch = op.get("epoch", shard_epoch)
+        if epoch > shard_epoch and not wait_for_epoch(epoch):
+            break
+        # queued before the last reshard
+        if epoch < shard_epoch:
+            apply_stale_write(op["method"], op["key"], op["value"], op.get("version"))
+            applied += 1
+            continue
+        # already delivered by an earlier attempt of this batch
+        if already_delivered(sender, sender_vc):
+            applied += 1
+            continue
+        if dependency_check(sender, sender_vc) and not wait_for_dependencies(sender, sender_vc):
+            break
+        with key_lock(op["key"]):
+            write_local(op["method"], op["key"], op["value"], version=op.get("version"))
+            advance_clock(sender_vc)
+        applied += 1
+    # one durable commit for the whole batch
+    _store.commit(local_vc)
+
+    if applied < len(operations):
+        return make_response({"error": "Causal dependencies not satisfied; try again later", "applied": applied,
+                              "get-vc": get_local_causal_metadata()["vc"]}, 503)
+    return make_response({"applied": applied}, 200)
+
+# Connection pool hit/miss and connection reuse counts for inter-replica traffic
+@views_route.route("/pool/stats", methods=["GET"])
+def get_pool_stats():
+    return make_response(peer_pool.stats(), 200)
+
+# Where client GETs were served under READ_POLICY, and requests in flight per replica
+@views_route.route("/read/stats", methods=["GET"])
+def get_read_stats():
+    with outstanding_lock:
+        in_flight = dict(outstanding)
+    return make_response(dict(policy=READ_POLICY, outstanding=in_flight, **read_stats), 200)
+
+# Queue depth, batching and flush stats of the async replication queues
+@views_route.route("/replication/stats", methods=["GET"])
+def get_replication_stats():
+    return make_response(dict(enabled=ASYNC_REPLICATION, batch_size=REPLICATION_BATCH_SIZE,
+                              flush_interval=REPLICATION_FLUSH_INTERVAL, peers=replication_stats()), 200)
+
+def replication_stats():
+    """Returns: stats of every peer's replication queue, dropped counts the writes of its earlier closed queues too"""
+    with replication_lock:
+        peers = {peer: queue.stats() for peer, queue in replication_queues.items()}
+        for peer, stats in peers.items():
+            stats["dropped"] += replication_dropped.get(peer, 0)
+    return peers
+
+# Prometheus text exposition of this replica's metrics
+@views_route.route("/metrics", methods=["GET"])
+def get_metrics():
+    labels = dict(lane=str(workers.lane)) if workers.lane is not None else None
+    return Response(metrics.render(labels), mimetype="text/plain; version=0.0.4")
+
+@metrics.collector
+def collect_metrics():
+    """Values read when /metrics is scraped: store sizes, membership, and the counters of the other stats endpoints"""
+    pool = peer_pool.stats()
+    queues = replication_stats()
+    return [
+        ("bingus_store_keys", "gauge", "Keys held", [(dict(store="store"), len(_store)), (dict(store="substore"), len(_substore))]),
+        ("bingus_store_bytes", "gauge", "Bytes of the keys and their JSON encoded values held",
+         [(dict(store="store"), _store.size), (dict(store="substore"), _substore.size)]),
+        ("bingus_views", "gauge", "Replicas in this replica's view", [(dict(), len(views))]),
+        ("bingus_shard_epoch", "gauge", "Reshards applied", [(dict(), shard_epoch)]),
+        ("bingus_migrating", "gauge", "1 while keys are migrating after a reshard", [(dict(), int(migrating()))]),
+        ("bingus_reads_total", "counter", "Client GETs by where they were served, see READ_POLICY",
+         [(dict(served=served), count) for served, count in read_stats.items()]),
+        ("bingus_pool_requests_total", "counter", "Peer requests by whether a pooled session existed",
+         [(dict(session="hit"), pool["hits"]), (dict(session="miss"), pool["misses"])]),
+        ("bingus_replication_queue_depth", "gauge", "Relayed writes queued for a shard peer(async replication)",
+         [(dict(peer=peer), stats["depth"]) for peer, stats in queues.items()]),
+        ("bingus_replication_batches_total", "counter", "Replication batches sent to a shard peer, by outcome",
+         [(dict(peer=peer, outcome=outcome), stats[f"{outcome}_batches"]) for peer, stats in queues.items() for outcome in ("sent", "failed")]),
+        ("bingus_replication_dropped_total", "counter", "Queued writes dropped because a shard peer was unreachable(async replication)",
+         [(dict(peer=peer), stats["dropped"]) for peer, stats in queues.items()]),
+        ("bingus_anti_entropy_rounds_total", "counter", "Anti-entropy syncs, by outcome",
+         [(dict(outcome="ok"), anti_entropy_stats["rounds"]), (dict(outcome="failed"), anti_entropy_stats["failed_rounds"])]),
+        ("bingus_anti_entropy_keys_repaired_total", "counter", "Keys repaired by anti-entropy", [(dict(), anti_entropy_stats["keys_repaired"])]),
+    ]
 
 # --------------------------------------------------------------------------------------------------------------
 # View endpoint
@@ -297,7 +970,7 @@ def handle_views():
             return make_response(jsonify(error="bad request"), 400)
         # already part of the view
         if new_view in views:
-           return make_response(jsonify(result="already present", replica_data=dict(vc=get_local_causal_metadata()["vc"], store=_store)), 200)
+           return make_response(jsonify(result="already present", replica_data=get_replica_data()), 200)
 
         # relay request to all views(replicas)
         if "relay" in request.json and request.json["relay"]:
@@ -307,14 +980,21 @@ def handle_views():
         with update_views_lock:
             update_views({new_view}, removed=False)
 
-         #result  replica_data = {vc: <1,2,3>, store: _store}
-        return make_response(jsonify(result="added", replica_data=dict(vc=get_local_causal_metadata()["vc"], store=_store)), 201)
+         #result  replica_data = {vc: <1,2,3>}
+        return make_response(jsonify(result="added", replica_data=get_replica_data()), 201)
     
     # Get views
+    # answered from the failure detector's state, ?fresh=true probes every view first
     if request.method == "GET":
-        with update_views_lock:
-            update_views(pulse(), removed=True)
-        return make_response(jsonify(view=list(views)), 200)
+        if request.args.get("fresh") == "true":
+            # unresponsive views become suspects, the failure detector decides when to remove them
+            for view in pulse(FRESH_VIEW_DEADLINE):
+                membership.suspect(view)
+        membership.sync(views)
+        members = membership.snapshot()
+        members[socket_address] = dict(status="alive", last_confirmed=time.time())
+        return make_response(jsonify(view=list(views), members={view: dict(status=members[view]["status"], last_confirmed=members[view]["last_confirmed"])
+                                                                 for view in views if view in members}), 200)
     
     # Remove replica by view
     if request.method == "DELETE":
@@ -336,28 +1016,92 @@ def handle_views():
 
         return make_response(jsonify(result="deleted"), 200)
 
+def get_replica_data():
+    """Clock and ring weights for a replica joining the views
+
+    The store is not shipped, the joiner repairs it from one shard peer with anti_entropy()
+    """
+    return {"vc": get_local_causal_metadata()["vc"], "ring-weights": ring_positions.weights, "rebalance-round": rebalance_round}
+
 # --------------------------------------------------------------------------------------------------------------
 # Heartbeat / Pulse endpoint
 # --------------------------------------------------------------------------------------------------------------
 
 # Simple acknowledgement to the "pulse" request sent by other replicas, to tell them that they are still up
+# Probes carry {"from": <IP:PORT>, "gossip": [membership updates]}, the response piggybacks our own updates
 @views_route.route("/pulse", methods=["GET"])
 def respond_to_pulse():
-    return make_response(jsonify(result="Ahoy!"), 200)
+    body = request.get_json(silent=True) or dict()
+    if "from" in body:
+        membership.heard_from(body["from"])
+        remove_dead_views(membership.merge(body.get("gossip", [])))
+    return make_response(jsonify(result="Ahoy!", gossip=membership.gossip()), 200)
+
+# Probe <target> on behalf of a replica whose own probe went unanswered
+# Given JSON body {"target": <IP:PORT>, "from": <IP:PORT>, "gossip": [membership updates]}
+@views_route.route("/pulse/indirect", methods=["POST"])
+def respond_to_indirect_pulse():
+    body = request.json
+    membership.heard_from(body["from"])
+    remove_dead_views(membership.merge(body.get("gossip", [])))
+    ack = send_pulse(body["target"])
+    return make_response(jsonify(ack=ack, gossip=membership.gossip()), 200)
+
+# Sends pulses to the /pulse endpoint at every replica in this replica's view in parallel
+def pulse(deadline):
+    """Returns: set of views that did not answer within deadline seconds"""
+    futures = {fresh_pool.submit(send_pulse, view): view for view in views if view != socket_address}
+    done, _ = wait(futures, timeout=deadline)
+    return {futures[future] for future in futures if future not in done or not future.result()}
+
+def send_pulse(view):
+    """Probe view directly, exchanging membership updates
+
+    Returns: True if view answered
+    """
+    start = time.perf_counter()
+    try:
+        response = peer_request("GET", view, "/pulse", json={"from": socket_address, "gossip": membership.gossip()},
+                                timeout=(PROBE_TIMEOUT, PROBE_TIMEOUT))
+        PULSE_RTT.labels(view).observe(time.perf_counter() - start)
+        remove_dead_views(membership.merge(response.json().get("gossip", [])))
+    except (requests.RequestException, ValueError):
+        PULSE_FAILURES.labels(view).inc()
+        return False
+    membership.heard_from(view)
+    return True
 
-# Sends pulses to the /pulse endpoint at every replica in this replica's view
-def pulse():
-    global views
-    crashed_replicas = set()
-    for view in views:
-        if view == socket_address:
-            continue
-        try:
-            response = requests.get(f"http://{view}/pulse", json=dict())
-        except (requests.Timeout, requests.ConnectionError, requests.RequestException, requests.exceptions.HTTPError):
-            crashed_replicas.add(view)
+def send_indirect_pulse(helper, view):
+    """Ask helper to probe view for us
+
+    Returns: True if helper heard back from view
+    """
+    try:
+        response = peer_request("POST", helper, "/pulse/indirect", json={"target": view, "from": socket_address, "gossip": membership.gossip()},
+                                timeout=(PROBE_TIMEOUT, PROBE_TIMEOUT * 2))
+        remove_dead_views(membership.merge(response.json().get("gossip", [])))
+        return response.json()["ack"]
+    except (requests.RequestException, ValueError, KeyError):
+        return False
 
-    return crashed_replicas
+def probe(view):
+    """Probe view directly, then through INDIRECT_PROBES other members if it does not answer
+
+    Views that answer neither way become suspects, the phi-accrual detector decides when they are dead
+    """
+    if send_pulse(view):
+        return True
+    futures = [indirect_pool.submit(send_indirect_pulse, helper, view) for helper in membership.helpers(view)]
+    if any(future.result() for future in futures):
+        membership.heard_from(view)
+        return True
+    membership.suspect(view)
+    return False
+
+def remove_dead_views(dead):
+    if dead:
+        with update_views_lock:
+            update_views(dead, removed=True)
 
 # This function should always be called with a mutex
 # To be called whenever the replica's views needs to be changed
@@ -371,27 +1115,193 @@ def update_views(new_views, removed=False):
     if removed:
         # remove new_views from views
         views = views.difference(new_views)
+        # drop pooled connections to removed views
+        for view in new_views:
+            peer_pool.close(view)
     else:
         # add new_views to views
         views = views.union(new_views)
-        for view in new_views:
-            if view in shards[shard_id]:
-                local_vc[view] = 0
+        with clock_advanced:
+            for view in new_views:
+                if view in shards[shard_id]:
+                    local_vc[view] = 0
 
 # Pulse Sender Thread
-# Sends out a pulse at a regular interval, and updates the replica view if any replicas do not respond
+# Every interval probes the next PROBE_FANOUT members in parallel, then removes the members
+# the phi-accrual detector considers dead from the views
 def periodic_pulse_sender():
     global views
     while True:
-        crashed_replicas = pulse()
+        membership.sync(views)
+        # probe this round's members in parallel
+        list(probe_pool.map(probe, membership.next_targets()))
         # Remove all crashed replicas from views
         # Only 1 thread can access update_views() at a time
-        if crashed_replicas:
-            with update_views_lock:
-                update_views(crashed_replicas, removed=True)
+        remove_dead_views(membership.evaluate())
         # Wait a set interval of time between pulses
         time.sleep(PULSE_INTERVAL)
 
+# --------------------------------------------------------------------------------------------------------------
+# Anti-entropy endpoints
+# --------------------------------------------------------------------------------------------------------------
+# Merkle tree hashes of the given nodes of one level of the tree(level 0 is the root)
+# Given JSON body {"level": <INTEGER>, "indices": [<INTEGER>, ...]}
+@views_route.route("/anti-entropy/tree", methods=["POST"])
+def get_tree_hashes():
+    level = request.json["level"]
+    indices = request.json["indices"]
+    if not 0 <= level <= _store.tree.depth or any(not 0 <= index < (1 << level) for index in indices):
+        return make_response(jsonify(error="Invalid tree level or index"), 400)
+    # clock first, so it never covers a write missing from the hashes
+    vc = dict(local_vc)
+    return make_response(jsonify(hashes=_store.tree_hashes(level, indices), depth=_store.tree.depth,
+                                 vc=vc, epoch=shard_epoch, migrating=migrating(),
+                                 **{"shard-id": shard_id}), 200)
+
+# Every key value pair in the given leaves of the Merkle tree, with the versions of the keys and the tombstones of
+# the deleted keys in them
+# Given JSON body {"leaves": [<INTEGER>, ...]}
+@views_route.route("/anti-entropy/keys", methods=["POST"])
+def get_tree_keys():
+    # clock first, so it never covers a write missing from the data
+    vc = dict(local_vc)
+    data, versions, tombstones = _store.leaf_items(request.json["leaves"])
+    return make_response(jsonify(data=data, versions=versions, tombstones=tombstones, vc=vc), 200)
+
+@views_route.route("/anti-entropy/stats", methods=["GET"])
+def get_anti_entropy_stats():
+    return make_response(dict(interval=ANTI_ENTROPY_INTERVAL, root=_store.tree.root(), tombstones=len(_store.tombstones),
+                              **anti_entropy_stats), 200)
+
+def clock_order(peer_vc):
+    """Returns: how local_vc compares to peer_vc(BEFORE/EQUAL/AFTER/CONCURRENT), missing entries count as 0"""
+    members = set(local_vc) | set(peer_vc)
+    return compare({member: local_vc.get(member, 0) for member in members},
+                   {member: peer_vc.get(member, 0) for member in members})
+
+def differing_leaves(peer):
+    """Compare Merkle trees with peer, descending only into the ranges whose hashes differ
+
+    Returns: tuple in the form (leaves that differ, peer's vc), or None if peer is not a shard peer
+    """
+    level = 0
+    indices = [0]
+    peer_vc = None
+    while True:
+        response = peer_request("POST", peer, "/anti-entropy/tree", json=dict(level=level, indices=indices))
+        body = response.json()
+        # stores are only comparable within a shard epoch, once both sides finished migrating
+        if body["shard-id"] != shard_id or body["depth"] != _store.tree.depth or body.get("epoch", 0) != shard_epoch \
+                or body.get("migrating") or migrating():
+            return None
+        if peer_vc is None:
+            peer_vc = body["vc"]
+        anti_entropy_stats["ranges_compared"] += len(indices)
+        local_hashes = _store.tree_hashes(level, indices)
+        indices = [index for index, local_hash, peer_hash in zip(indices, local_hashes, body["hashes"]) if local_hash != peer_hash]
+        if not indices or level == _store.tree.depth:
+            return (indices, peer_vc)
+        # children of the differing nodes
+        indices = [child for index in indices for child in (2 * index, 2 * index + 1)]
+        level += 1
+
+def anti_entropy(peer):
+    """Repair this replica's store from shard peer, transferring only the keys that differ
+
+    Unless this replica is ahead of peer(peer then repairs itself from this replica), every key of the
+    differing ranges whose write or delete(tombstone) is newer on peer is repaired, see repair_keys(), and
+    peer's clock is merged into this replica's. Behind peer(or equal, and peer has the lower address), this
+    replica also adopts peer's values of unversioned keys
+
+    Returns: number of keys repaired, or None if peer could not be synced with
+    """
+    with anti_entropy_lock:
+        try:
+            result = differing_leaves(peer)
+            if result is None:
+                return None
+            leaves, peer_vc = result
+            order = clock_order(peer_vc)
+            adopt = order == BEFORE or (order == EQUAL and peer < socket_address)
+            repaired = 0
+            if leaves and order != AFTER:
+                response = peer_request("POST", peer, "/anti-entropy/keys", json=dict(leaves=leaves))
+                body = response.json()
+                repaired = repair_keys(leaves, body["data"], body["versions"], body["tombstones"], adopt)
+        except (requests.RequestException, ValueError, KeyError):
+            anti_entropy_stats["failed_rounds"] += 1
+            return None
+        with clock_advanced:
+            # pad local clock with the shard members peer knows of
+            for member in peer_vc:
+                if member in shards.get(shard_id, ()):
+                    local_vc.setdefault(member, 0)
+            # peer's clock was taken before its tree hashes, so this replica now holds every write it covers
+            # (or a newer one). Merging concurrent clocks too keeps relays from waiting on writes missed while down
+            advanced = order != AFTER and any(val > local_vc.get(member, val) for member, val in peer_vc.items())
+            if advanced:
+                merge_into(local_vc, peer_vc)
+                clock_advanced.notify_all()
+        if advanced or repaired:
+            _store.commit(local_vc)
+        anti_entropy_stats["rounds"] += 1
+        anti_entropy_stats["keys_repaired"] += repaired
+        anti_entropy_stats["last_peer"] = peer
+        return repaired
+
+def repair_keys(leaves, peer_data, peer_versions, peer_tombstones, adopt):
+    """Apply peer's writes and deletes of the keys in leaves that are newer than this replica's
+
+    Every key is applied under its key lock, and only if its version here is still older(so a relay
+    delivered meanwhile is never overwritten). Keys without a version(migrated keys) are only added where
+    missing, unless adopt: then peer's value replaces this replica's, and keys peer does not have are dropped
+
+    Returns: number of keys repaired
+    """
+    local_data, local_versions, local_tombstones = _store.leaf_items(leaves)
+    repaired = 0
+    for key, value in peer_data.items():
+        version = peer_versions.get(key)
+        if version is None:
+            if key in local_tombstones or (key in local_data and (not adopt or local_data[key] == value)):
+                continue
+        elif not newer(version, local_versions.get(key, local_tombstones.get(key))):
+            continue
+        with key_lock(key):
+            repaired += write_local("PUT", key, value, version=version)
+    for key, version in peer_tombstones.items():
+        if newer(version, local_versions.get(key, local_tombstones.get(key))):
+            with key_lock(key):
+                repaired += write_local("DELETE", key, version=version)
+    if adopt:
+        for key in local_data:
+            if key not in peer_data and key not in peer_tombstones and key not in local_versions:
+                with key_lock(key):
+                    repaired += write_local("DELETE", key)
+    return repaired
+
+def sync_with_shard(peers=None):
+    """Run anti-entropy with the first of peers(default: shard peers in random order) that can be synced with
+
+    Returns: peer synced with, or None
+    """
+    if peers is None:
+        peers = [member for member in shards.get(shard_id, ()) if member != socket_address and member in views]
+        random.shuffle(peers)
+    for peer in peers:
+        if anti_entropy(peer) is not None:
+            return peer
+    return None
+
+# Anti-entropy Thread
+# Every interval syncs with a random shard peer, so replicas that missed relays converge
+def periodic_anti_entropy():
+    while True:
+        time.sleep(ANTI_ENTROPY_INTERVAL)
+        sync_with_shard()
+        # versions count milliseconds, see MemoryStore.next_version()
+        _store.purge_tombstones(int((time.time() - TOMBSTONE_TTL) * 1000))
+
 # --------------------------------------------------------------------------------------------------------------
 # Shard endpoints
 # --------------------------------------------------------------------------------------------------------------
@@ -406,6 +1316,12 @@ def get_shard_ids():
 def get_shard_id():
     return make_response({"node-shard-id": shard_id}, 200)
 
+# Export the hash ring, so clients can hash keys to their owners themselves
+@views_route.route("/shard/ring", methods=["GET"])
+def get_ring():
+    return make_response({"replicas": sorted(ring_positions.replicas), "vnodes": ring_positions.vnodes, "weights": ring_positions.weights,
+                          "epoch": topology_epoch()}, 200)
+
 # Look up the members of the specified shard
 @views_route.route("/shard/members/<ID>", methods=["GET"])
 def get_members(ID):
@@ -423,17 +1339,99 @@ def get_key_count(ID):
     shard_ids = list(shards.keys())
     if ID not in shard_ids:
         return make_response({"error": "Shard ID does not exist"}, 404) 
-    elif ID != shard_id:
-        while True:
-            for node in shards[ID]:
-                try:
-                    response = requests.get(f"http://{node}/shard/key-count/{ID}", json=dict())
-                    key_count = response.json()["shard-key-count"]
-                    return make_response({"shard-key-count": key_count}, 200)
-                except (requests.Timeout, requests.ConnectionError, requests.RequestException, requests.exceptions.HTTPError):
-                    continue
-    else:
-        return make_response({"shard-key-count": len(_store)}, 200)
+    counts = shard_key_count(ID, time.monotonic() + KEY_COUNT_TIMEOUT)
+    if counts is None:
+        return make_response({"error": f"No member of shard {ID} is reachable"}, 503)
+    return make_response(counts, 200)
+
+# Look up the number of kv pairs and their bytes stored in every shard, asking one member of every
+# other shard in parallel, shards whose members did not answer within KEY_COUNT_TIMEOUT seconds are
+# listed under "unreachable"
+@views_route.route("/shard/key-counts", methods=["GET"])
+def get_key_counts():
+    deadline = time.monotonic() + KEY_COUNT_TIMEOUT
+    futures = {stats_pool.submit(shard_key_count, id, deadline): id for id in list(shards)}
+    done, _ = wait(futures, timeout=KEY_COUNT_TIMEOUT)
+    answers = {futures[future]: future.result() for future in done}
+    counts = {str(id): answers[id] for id in sorted(futures.values()) if answers.get(id) is not None}
+    unreachable = sorted(id for id in futures.values() if answers.get(id) is None)
+    return make_response({"shards": counts, "unreachable": unreachable,
+                          "key-count": sum(count["shard-key-count"] for count in counts.values()),
+                          "bytes": sum(count["shard-bytes"] for count in counts.values())}, 200)
+
+def shard_key_count(id, deadline):
+    """Keys and bytes of shard id: this replica's counters if it is a member, else those of the first member
+    of the shard that answers before deadline(live members first)
+
+    Returns: {"shard-key-count", "shard-bytes"}, None if no member answered
+    """
+    if id == shard_id:
+        keys, size = _store.counts()
+        return {"shard-key-count": keys, "shard-bytes": size}
+    for member in sorted(shards.get(id, ()), key=lambda member: member not in views):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        try:
+            response = peer_request("GET", member, f"/shard/key-count/{id}", timeout=min(remaining, KEY_COUNT_TIMEOUT))
+            if response.status_code == 200:
+                return response.json()
+        except (requests.RequestException, ValueError):
+            continue
+    return None
+
+# Access statistics of the shard <ID>: key access counts(count-min sketch), its hottest keys,
+# read and write rates and byte volumes, added up over every member
+# Query: limit=<hottest keys returned>, local=true for the statistics of this member alone
+@views_route.route("/shard/stats/<ID>", methods=["GET"])
+def get_shard_stats(ID):
+    ID = int(ID)
+    if ID not in shards:
+        return make_response({"error": "Shard ID does not exist"}, 404)
+    limit = request.args.get("limit", TOP_KEYS, type=int)
+    if request.args.get("local"):
+        if ID != shard_id:
+            return make_response({"error": f"{socket_address} is not a member of shard {ID}"}, 400)
+        return make_response(dict(access_stats.summary(limit), replica=socket_address), 200)
+    return make_response(gather_stats({ID}, limit)["shards"][ID], 200)
+
+# Access statistics of every shard, and of the whole cluster
+@views_route.route("/shard/stats", methods=["GET"])
+def get_cluster_stats():
+    limit = request.args.get("limit", TOP_KEYS, type=int)
+    res = gather_stats(set(shards), limit)
+    res["cluster"] = merge_summaries(res["shards"].values(), limit)
+    res["shards"] = {str(id): stats for id, stats in res["shards"].items()}
+    return make_response(res, 200)
+
+def gather_stats(ids, limit):
+    """Query every member of the shards ids for its statistics in parallel, members that do not answer
+    within STATS_TIMEOUT seconds are listed as unreachable
+
+    Returns: {"shards": {shard_id: merged statistics of its members}}
+    """
+    members = {member: id for id, shard in list(shards.items()) if id in ids for member in shard}
+    futures = {stats_pool.submit(member_stats, member, id, limit): member for member, id in members.items()}
+    done, _ = wait(futures, timeout=STATS_TIMEOUT + 1)
+    answers = {futures[future]: future.result() for future in done}
+    res = dict()
+    for id in ids:
+        shard = sorted(member for member, member_id in members.items() if member_id == id)
+        summaries = [answers[member] for member in shard if answers.get(member) is not None]
+        res[id] = merge_summaries(summaries, limit)
+        res[id]["members"] = {summary["replica"]: summary for summary in summaries}
+        res[id]["unreachable"] = [member for member in shard if answers.get(member) is None]
+    return dict(shards=res)
+
+def member_stats(member, id, limit):
+    """Returns: statistics of member, None if it did not answer"""
+    if member == socket_address:
+        return dict(access_stats.summary(limit), replica=socket_address)
+    try:
+        response = peer_request("GET", member, f"/shard/stats/{id}?local=true&limit={limit}", timeout=(CONNECT_TIMEOUT, STATS_TIMEOUT))
+        return response.json() if response.status_code == 200 else None
+    except (requests.RequestException, ValueError):
+        return None
 
 # Assign the node <ID:PORT> to the shard <ID>
 # Given JSON body {"socket-address": <IP:PORT>}
@@ -453,7 +1451,8 @@ def add_member(ID):
     if add_socket_address not in views or ID not in shard_ids:
         return make_response(dict(error=f"Shard with ID {ID} does not exist"),404)
 
-    for node in views:
+    # the new node goes last, so every other replica already hashes keys to it when it syncs
+    for node in sorted(views, key=lambda view: view == add_socket_address):
         while True:
             # Forward to every replica in the system
             try:
@@ -461,7 +1460,9 @@ def add_member(ID):
                 metadata["shards"] = shards
                 jason_friendy_shards_dictionary = to_jason_friendy_shard_dict(shards)
                 metadata["shards"] = jason_friendy_shards_dictionary
-                response = requests.put(f"http://{node}/assign/{ID}", json=metadata)
+                metadata["epoch"] = shard_epoch
+                metadata["ring-weights"] = ring_positions.weights
+                response = peer_request("PUT", node, f"/assign/{ID}", json=metadata, timeout=(CONNECT_TIMEOUT, None))
                 break
             except (requests.Timeout, requests.ConnectionError, requests.RequestException, requests.exceptions.HTTPError):
                 pass
@@ -490,6 +1491,7 @@ def assign_to_shard(ID):
     global local_vc
     global ring_positions   
     global _substore
+    global shard_epoch
     ID = int(ID)
 
     # new node does not have shards initialized
@@ -497,26 +1499,22 @@ def assign_to_shard(ID):
         # assign shard id and shards
         shard_id = ID
         shards = to_jason_unfriendy_shard_dict(request.json["shards"])
+        shard_epoch = request.json.get("epoch", 0)
 
     # update shards at ID to contain the address of the new node
     add_socket_address = in_json("socket-address", request.json)
     shards[ID].add(add_socket_address)
-    ring_positions = resharding.calculate_ring_positions(views)
+    ring_positions = resharding.calculate_ring_positions(views, request.json.get("ring-weights", ring_positions.weights))
 
     if ID == shard_id:
-        local_vc[socket_address] = 0
+        with clock_advanced:
+            local_vc.setdefault(add_socket_address, 0)
 
     # check if this node is in front of the newly added node on the imaginary ring
-    prev_pos = None
     if socket_address != add_socket_address:
-
-        for ring_pos in sorted(ring_positions.keys()):
-            if ring_positions[ring_pos] == socket_address:
-                break
-            prev_pos = ring_positions[ring_pos]
-        if prev_pos == add_socket_address:
+        if add_socket_address in ring_positions.predecessors(socket_address):
             # need to rehash our _substore
-            temp_substore = dict()
+            temp_substore = SizedDict()
             for key in _substore:
                 if consistent_hash_key(key) == socket_address:
                     temp_substore[key] = _substore[key]
@@ -524,9 +1522,10 @@ def assign_to_shard(ID):
     
     if socket_address == add_socket_address:
         # This is the newly-added node, so replicate store & vc
-        local_vc = dict()
-        for member in shards[ID]:
-            local_vc[member] = 0
+        with clock_advanced:
+            local_vc.clear()
+            for member in shards[ID]:
+                local_vc[member] = 0
         replicate_shard_member(shards[ID])
 
     return make_response(dict(result="node added to shard"),200)
@@ -537,48 +1536,31 @@ def replicate_shard_member(shard_members):
     global _store
     global _substore
     # send to all nodes in view
-    for view in views:
-        while True:
+    for view in list(views):
+        try:
+            peer_request("PUT", view, "/view", json={'view': socket_address, 'relay': False})
+        # Ignore unresponsive replicas
+        except (requests.ConnectionError, requests.RequestException, requests.exceptions.HTTPError):
+            pass
+    # New node's store and clock should match its shard: pull them from one shard peer
+    sync_with_shard([member for member in shard_members if member != socket_address])
+    # update _substore to contain keys that hash to new node, asking one member of every shard
+    for id in list(shards):
+        for member in shards[id]:
+            if member == socket_address:
+                continue
             try:
-                response = requests.put(f'http://{view}/view', json={'view': socket_address, 'relay': False})
-                metadata = response.json()
-
-                # update local clock based on members of new replica
-                if 'replica_data' in metadata and view in shards[shard_id]:                   
-                    # compare with padding
-                    received_vc = metadata['replica_data']['vc']
-                    # pad local clock {a: 0, b:0}
-                    local_vc.update(received_vc)
-                    # pad received clock {b: 0, a:0}
-                    received_vc.update(local_vc)
-
-                    # compare clocks(should equal length and share keys)
-                    if VectorClock(local_vc) <= VectorClock(received_vc):
-                        local_vc = received_vc
-                        # New node's store should match store from members         
-                        _store = metadata['replica_data']['store']
-                other_replica_store = metadata['replica_data']['store']
-                # update _substore to contain keys that hash to new node
-                for key in other_replica_store:
-                    if consistent_hash_key(key) == socket_address:
-                        _substore[key] = other_replica_store[key]
-
-                break
-
-            # Ignore unresponsive replicas
-            except (requests.ConnectionError, requests.RequestException, requests.exceptions.HTTPError):
+                fetch_substore(member, _substore.update, owner=socket_address)
                 break
+            except (requests.RequestException, ValueError):
+                continue
+    _store.commit(local_vc)
 
 # Trigger a reshard into <INTEGER> shards, maintaining fault-tolerance
-# Given JSON body {"shard-count": <INTEGER>}
+# Given JSON body {"shard-count": <INTEGER>, "dry-run": <BOOLEAN, optional>}
+# Only the keys whose shard changes are moved, in the background, while requests keep being served
 @views_route.route("/shard/reshard", methods=["PUT"])
 def reshard():
-    global shard_id
-    global shards
-    global ring_positions
-    global shard_count
-    global _store
-    global local_vc
     # validate JSON body
     new_shard_count = in_json("shard-count", request.json) 
     if not new_shard_count:
@@ -588,79 +1570,570 @@ def reshard():
     if math.floor(len(views)/new_shard_count) < MIN_NODES:
         return make_response(dict(error="Not enough nodes to provide fault tolerance with requested shard count"), 400)
     
-    # two cases
-    #(1)Reshard with changed N
-    reshard, reshard_ring_positions = resharding.partition_by_hash(views, new_shard_count)
+    relayed = "relay" in request.json
+    if relayed and "shards" in request.json:
+        # relayed from the replica that computed the new distribution
+        new_shards = to_jason_unfriendy_shard_dict(request.json["shards"])
+    else:
+        # keep every replica in its current shard where possible
+        new_shards = resharding.stable_partition(shards, views, new_shard_count)
+    if not new_shards:
+        return make_response(dict(error="Not enough nodes to provide fault tolerance with requested shard count"), 400)
+
+    if in_json("dry-run", request.json):
+        return make_response(reshard_dry_run(new_shards), 200)
 
-    # assign possible new id
-    # did this replica's shard_id change?
-    new_shard_id = find_replica_id(reshard, socket_address)
     # relay the reshard request to all views(replicas) if sent from client
-    if "relay" not in request.json:
-        relay_req = request
-        relay_req.json["relay"] = "bingus"
-        relay_reshard(relay_req)
-
-    # update this node
-    update_node(reshard[new_shard_id])
-
-    # assign vars
-    shards = reshard
-    ring_positions = reshard_ring_positions
-    shard_count = new_shard_count
-    shard_id = new_shard_id
+    if not relayed:
+        if migrating():
+            return make_response(dict(error="A reshard is still migrating keys; try again later"), 503)
+        relay_reshard(dict(request.json, relay="bingus", shards=to_jason_friendy_shard_dict(new_shards)))
+
+    # update this node, keys are migrated in the background
+    begin_migration(new_shards, new_shard_count)
     # Reshard complete
     return make_response(dict(result="resharded"), 200)
 
+# Progress of this replica's current(or last) reshard migration
+@views_route.route("/shard/reshard/status", methods=["GET"])
+def get_reshard_status():
+    if migration is None:
+        return make_response(dict(active=False, epoch=shard_epoch), 200)
+    return make_response(dict(migration), 200)
+
 def find_replica_id(shards, replica_to_find):
     for id in shards:
         if replica_to_find in shards[id]:
             return id
 
 # Relay/rebroadcast a request to all replicas on the /reshard endpoint
-def relay_reshard(relayed_request):
-    for view in views:
+def relay_reshard(body):
+    for view in list(views):
         if view != socket_address:
-            buffer_send_reshard(relayed_request, view)
+            with tracing.span("relay-reshard", peer=view):
+                buffer_send_reshard(body, view)
 
-def buffer_send_reshard(req : Flask.request_class, view : str):
+def buffer_send_reshard(body : dict, view : str):
     """Keep sending updated view information until received and processed (eventual consistency)"""
-    global views
-    metadata = req.json
-    metadata["relay"] = None
     while True:
         try:
-            response = requests.request(f"{req.method}", f"http://{view}/shard/reshard", json=metadata)
+            response = peer_request("PUT", view, "/shard/reshard", json=body, headers=tracing.headers(), timeout=(CONNECT_TIMEOUT, None))
             break
         except requests.Timeout:
             continue
         except (requests.ConnectionError, requests.RequestException):
             continue
 
+def reshard_dry_run(new_shards):
+    """Returns: the keys and bytes every replica would fetch to move to new_shards, without moving anything"""
+    plan = resharding.movement_plan(shards, new_shards)
+    sources = {source for fetch in plan.values() for source in fetch}
+    futures = {source: transfer_pool.submit(substore_summary, source) for source in sources}
+    sizes = {source: future.result() for source, future in futures.items()}
+    moves = list()
+    for replica, fetch in sorted(plan.items()):
+        for source in sorted(fetch):
+            moves.append({"to": replica, "from": source, "keys": sizes[source]["keys"], "bytes": sizes[source]["bytes"]})
+    return {"shards": to_jason_friendy_shard_dict(new_shards),
+            "replicas-moved": sum(1 for replica, fetch in plan.items() if fetch),
+            "moves": moves,
+            "keys": sum(move["keys"] for move in moves if move["keys"] is not None),
+            "bytes": sum(move["bytes"] for move in moves if move["bytes"] is not None)}
+
+def substore_summary(addr):
+    """Returns: {"keys", "bytes"} of addr's _substore(None counts if addr is unreachable)"""
+    if addr == socket_address:
+        return summarize_substore(*substore_view())
+    try:
+        response = peer_request("GET", addr, "/get-substore", params=dict(summary="true"))
+        return response.json()
+    except (requests.RequestException, ValueError):
+        return dict(keys=None, bytes=None)
+
+def migrating() -> bool:
+    return migration is not None and migration["active"]
+
+def begin_migration(new_shards, new_shard_count):
+    """Switch this replica to new_shards right away and move the keys in the background
+
+    The keys of members this replica already shared a shard with stay in place, the substores of
+    the other members of its new shard are streamed in by a migration thread(throttled to
+    MIGRATION_BANDWIDTH), and the keys of members that left its shard are dropped once it is done
+    """
+    global shards
+    global shard_id
+    global shard_count
+    global shard_epoch
+    global migration
+    global migration_thread
+    # a previous migration's keys are assumed to be here
+    if migration_thread is not None:
+        migration_thread.join()
+    old_shards = shards
+    sources = resharding.movement_plan(old_shards, new_shards).get(socket_address, set())
+    new_shard_id = find_replica_id(new_shards, socket_address)
+    with migration_lock:
+        migration_written.clear()
+        migration = dict(kind="reshard", active=True, epoch=shard_epoch + 1, started=time.time(), finished=None, keys=0, bytes=0,
+                         sources={source: "pending" for source in sources})
+    with clock_advanced:
+        shards = new_shards
+        shard_id = new_shard_id
+        shard_count = new_shard_count
+        shard_epoch += 1
+        # vector clocks restart for the new shard epoch
+        local_vc.clear()
+        local_vc.update({member: 0 for member in new_shards[new_shard_id]})
+        clock_advanced.notify_all()
+    migration_thread = Thread(target=run_migration, args=(migration, set(new_shards[new_shard_id]), old_shards), name="migration", daemon=True)
+    migration_thread.start()
+
+def run_migration(state, new_members, old_shards):
+    throttle = resharding.Throttle(MIGRATION_BANDWIDTH)
+    futures = [transfer_pool.submit(migrate_from, state, source, throttle, old_shards) for source in state["sources"]]
+    wait(futures)
+    # drop the keys whose owners are no longer members of this replica's shard
+    for key in list(_store):
+        if consistent_hash_key(key) not in new_members:
+            _store.pop(key, None)
+    _store.commit(local_vc)
+    with migration_lock:
+        state["active"] = False
+        state["finished"] = time.time()
+        migration_written.clear()
+    RESHARD_DURATION.observe(state["finished"] - state["started"])
+
+def migrate_from(state, source, throttle, old_shards):
+    """Stream source's _substore into _store, skipping keys written since the migration began
+
+    If source does not answer, its keys are streamed from another member of its shard in old_shards,
+    which replicated them
+    """
+    candidates = [source] + sorted(member for member in old_shards.get(find_replica_id(old_shards, source), ())
+                                   if member not in (source, socket_address))
+    for attempt in range(MIGRATION_RETRIES):
+        for member in candidates:
+            try:
+                keys, size = fetch_substore(member, apply_migrated_chunk, owner=None if member == source else source, throttle=throttle)
+            except (requests.RequestException, ValueError):
+                continue
+            state["keys"] += keys
+            state["bytes"] += size
+            MIGRATED_KEYS.inc(keys)
+            MIGRATED_BYTES.inc(size)
+            state["sources"][source] = "done"
+            return
+        time.sleep(CONNECT_TIMEOUT)
+    state["sources"][source] = "failed"
+
+def apply_migrated_chunk(chunk):
+    with migration_lock:
+        _store.update({key: value for key, value in chunk.items() if key not in migration_written})
+
+# --------------------------------------------------------------------------------------------------------------
+# Rebalance endpoints
+# --------------------------------------------------------------------------------------------------------------
+
+# Move ring positions from the replicas carrying the most load(owned keys and requests served) to those carrying
+# the least, migrating only the key ranges whose owner changes
+# Given JSON body {"dry-run": <BOOLEAN, optional>}, a dry run only returns the plan
+# Replicas relay the new weights as {"weights": {<IP:PORT>: <INTEGER>}, "round": <INTEGER>}, then {"cleanup": <INTEGER>}
+# With WORKERS, lane 0 plans the round from the load of the whole replica and hands the other lanes
+# {"coordinate": <INTEGER>, "weights": ..., "plan": ...}, so every lane runs the same round on its own keys
+@views_route.route("/shard/rebalance", methods=["PUT"])
+def rebalance():
+    body = request.get_json(silent=True) or dict()
+    if "relay" in body:
+        if "coordinate" in body:
+            Thread(target=follow_rebalance, args=(body["plan"], body["weights"], body["coordinate"]), name="rebalance", daemon=True).start()
+            return make_response(dict(result="rebalancing", round=body["coordinate"]), 200)
+        if "cleanup" in body:
+            drop_moved_keys(body["cleanup"])
+            return make_response(dict(result="cleaned up"), 200)
+        if not begin_rebalance(body["weights"], body["round"]):
+            return make_response(dict(result="already applied", round=rebalance_round), 200)
+        return make_response(dict(result="rebalancing", round=rebalance_round), 200)
+    plan = plan_rebalance()
+    if plan.get("error") or body.get("dry-run") or not plan["changes"]:
+        return make_response(plan, 503 if plan.get("error") else 200)
+    if migrating() or not rebalance_lock.acquire(blocking=False):
+        return make_response(dict(error="A reshard or rebalance is still migrating keys; try again later"), 503)
+    # released by run_rebalance()
+    Thread(target=coordinate_rebalance, args=(plan,), name="rebalance", daemon=True).start()
+    return make_response(plan, 202)
+
+# Load this replica carries: keys it owns and client requests per second it served(see /shard/stats)
+# With WORKERS, the sum of every lane's load
+@views_route.route("/shard/rebalance/load", methods=["GET"])
+def get_rebalance_load():
+    return make_response(local_load(), 200)
+
+def local_load():
+    stats = access_stats.summary(0)
+    return {"replica": socket_address, "keys": len(_substore), "bytes": _substore.size,
+            "requests-per-second": round(stats["reads-per-second"] + stats["writes-per-second"], 3)}
+
+# Rebalance round applied here, the ring weights, the last round coordinated here and the migration of the current round
+@views_route.route("/shard/rebalance/status", methods=["GET"])
+def get_rebalance_status():
+    return make_response(rebalance_status(), 200)
+
+def rebalance_status():
+    state = migration if migration is not None and migration["kind"] == "rebalance" else None
+    return {"round": rebalance_round, "vnodes": ring_positions.vnodes, "weights": ring_positions.weights,
+            "coordinated": rebalance_state, "migration": state}
+
+def replica_load(addr):
+    """Returns: load of addr over all of its lanes, None if it did not answer"""
+    try:
+        # untagged, so any lane of addr answers with the sum of every lane's load
+        response = peer_request("GET", addr, "/shard/rebalance/load", headers={workers.WORKER_HEADER: None},
+                                timeout=(CONNECT_TIMEOUT, STATS_TIMEOUT))
+        return response.json() if response.status_code == 200 else None
+    except (requests.RequestException, ValueError):
+        return None
+
+def plan_rebalance():
+    """Gather every replica's load and compute the ring weights that even it out
+
+    Returns: {"loads", "shares", "imbalance", "changes": {replica: {"from", "to"}}}, or {"error"} if a replica
+        did not answer
+    """
+    replicas = sorted(ring_positions.replicas & views)
+    # with WORKERS this lane only carries part of the replica's load, it asks the replica like any other
+    remote = [replica for replica in replicas if replica != socket_address or workers.lane is not None]
+    futures = {replica: stats_pool.submit(replica_load, replica) for replica in remote}
+    loads = {replica: future.result() for replica, future in futures.items()}
+    if workers.lane is None:
+        loads[socket_address] = local_load()
+    unreachable = sorted(replica for replica, load in loads.items() if load is None)
+    if unreachable:
+        return dict(error="Replicas did not report their load", unreachable=unreachable)
+    shares = resharding.load_shares(loads, REBALANCE_KEY_WEIGHT)
+    mean = 1 / len(loads)
+    new_weights = resharding.plan_weights(shares, ring_positions, REBALANCE_TRIGGER, REBALANCE_TARGET, REBALANCE_STEP)
+    return {"loads": loads, "shares": {replica: round(share, 4) for replica, share in shares.items()},
+            "imbalance": round(max(shares.values()) / mean, 3) if shares else 1.0,
+            "changes": {replica: {"from": ring_positions.vnodes_of(replica), "to": vnodes} for replica, vnodes in new_weights.items()}}
+
+def coordinate_rebalance(plan):
+    """Run the round of plan, on every lane of this replica with WORKERS
+
+    Must be called with rebalance_lock held, releases it
+    """
+    round_id = rebalance_round + 1
+    weights = dict(ring_positions.weights)
+    weights.update({replica: change["to"] for replica, change in plan["changes"].items()})
+    if workers.lane is not None:
+        try:
+            workers.send_lanes("PUT", "/shard/rebalance", json=dict(relay="bingus", coordinate=round_id, weights=weights, plan=plan))
+        except requests.RequestException:
+            # a lane that is gone takes the whole replica down with it(see workers.spawn)
+            pass
+    run_rebalance(plan, weights, round_id)
+
+def follow_rebalance(plan, weights, round_id):
+    """Run the round lane 0 coordinates for this lane's keys, once this lane's previous round is over"""
+    rebalance_lock.acquire()
+    # released by run_rebalance()
+    run_rebalance(plan, weights, round_id)
+
+def run_rebalance(plan, weights, round_id):
+    """Coordinate one rebalance round: every replica switches to the new weights and migrates the ranges
+    moved into its shard, then drops the ranges moved out of it once every replica is done
+
+    Must be called with rebalance_lock held, releases it
+    """
+    global rebalance_state
+    try:
+        rebalance_state = dict(phase="migrating", round=round_id, started=time.time(), finished=None, plan=plan, error=None)
+        peers = sorted(view for view in views if view != socket_address)
+        send_rebalance(peers, dict(relay="bingus", weights=weights, round=round_id))
+        begin_rebalance(weights, round_id)
+        # every replica must have its ranges before the replicas they came from drop them
+        deadline = time.monotonic() + REBALANCE_TIMEOUT
+        pending = set(peers) | {socket_address}
+        while pending and time.monotonic() < deadline:
+            # replicas that left the views get the weights from their shard if they rejoin
+            pending = {replica for replica in pending if replica in views and not rebalance_done(replica, round_id)}
+            if pending:
+                time.sleep(PULSE_INTERVAL)
+        if pending:
+            rebalance_state.update(phase="failed", finished=time.time(), error=f"Ranges still migrating to {sorted(pending)}")
+            return
+        rebalance_state["phase"] = "cleanup"
+        send_rebalance(peers, dict(relay="bingus", cleanup=round_id))
+        drop_moved_keys(round_id)
+        rebalance_state.update(phase="done", finished=time.time())
+    finally:
+        rebalance_lock.release()
+
+def send_rebalance(peers, body):
+    """Send body to every peer in parallel, unreachable peers get the weights from their shard when they rejoin"""
+    def send(peer):
+        for attempt in range(MIGRATION_RETRIES):
+            try:
+                peer_request("PUT", peer, "/shard/rebalance", json=body, headers=tracing.headers(), timeout=(CONNECT_TIMEOUT, None))
+                return
+            except requests.RequestException:
+                time.sleep(CONNECT_TIMEOUT)
+    wait([transfer_pool.submit(send, peer) for peer in peers])
+
+def rebalance_done(replica, round_id) -> bool:
+    """True if replica applied round round_id and migrated the ranges it moved"""
+    if replica == socket_address:
+        status = rebalance_status()
+    else:
+        try:
+            status = peer_request("GET", replica, "/shard/rebalance/status").json()
+        except (requests.RequestException, ValueError):
+            return False
+    return status["round"] >= round_id and not (status["migration"] and status["migration"]["active"])
+
+def begin_rebalance(weights, round_id) -> bool:
+    """Switch this replica to the ring with the given weights right away and migrate the key ranges that
+    moved to owners in its shard from owners in other shards in the background(throttled to MIGRATION_BANDWIDTH)
+
+    Returns: False if round_id was already applied
+    """
+    global ring_positions
+    global previous_ring
+    global rebalance_round
+    global migration
+    global migration_thread
+    if round_id <= rebalance_round:
+        return False
+    if migration_thread is not None:
+        migration_thread.join()
+    new_ring = resharding.HashRing(ring_positions.replicas, ring_positions.vnodes, weights)
+    members = shards.get(shard_id, set())
+    moved = resharding.moved_ranges(ring_positions, new_ring)
+    sources = sorted((old, new) for old, new in moved if new in members and old not in members)
+    with migration_lock:
+        migration_written.clear()
+        migration = dict(kind="rebalance", active=True, round=round_id, epoch=shard_epoch, started=time.time(), finished=None,
+                         keys=0, bytes=0, moved=len(moved), sources={f"{old}>{new}": "pending" for old, new in sources})
+    previous_ring = ring_positions
+    ring_positions = new_ring
+    rebalance_round = round_id
+    migration_thread = Thread(target=run_rebalance_migration, args=(migration, sources), name="migration", daemon=True)
+    migration_thread.start()
+    return True
+
+def run_rebalance_migration(state, sources):
+    global _substore
+    throttle = resharding.Throttle(MIGRATION_BANDWIDTH)
+    wait([transfer_pool.submit(migrate_range, state, old, new, throttle) for old, new in sources])
+    with migration_lock:
+        # keys moved between owners of this shard are already here, only their owner changed
+        _substore = SizedDict({key: value for key, value in list(_store.items()) if consistent_hash_key(key) == socket_address})
+        state["active"] = False
+        state["finished"] = time.time()
+        migration_written.clear()
+    _store.commit(local_vc)
+
+def migrate_range(state, old, new, throttle):
+    """Stream the keys of old's shard that now hash to new into _store, from old or another member of its shard"""
+    source = f"{old}>{new}"
+    candidates = [old] + sorted(member for member in shards.get(find_replica_id(shards, old), ()) if member != old)
+    deadline = time.monotonic() + REBALANCE_TIMEOUT
+    while time.monotonic() < deadline:
+        for member in candidates:
+            try:
+                keys, size = fetch_substore(member, apply_migrated_chunk, owner=new, throttle=throttle, round_id=state["round"])
+            except (requests.RequestException, ValueError):
+                continue
+            state["keys"] += keys
+            state["bytes"] += size
+            MIGRATED_KEYS.inc(keys)
+            MIGRATED_BYTES.inc(size)
+            finish_range(state, source, "done")
+            return
+        # the members of old's shard may not have applied the round yet
+        time.sleep(CONNECT_TIMEOUT)
+    finish_range(state, source, "failed")
+
+def finish_range(state, source, outcome):
+    with clock_advanced:
+        state["sources"][source] = outcome
+        clock_advanced.notify_all()
+
+def drop_moved_keys(round_id):
+    """Drop the keys of the ranges moved out of this replica's shard, once every replica migrated them"""
+    global previous_ring
+    if round_id != rebalance_round:
+        return
+    members = shards.get(shard_id, set())
+    for key in list(_store):
+        if consistent_hash_key(key) not in members:
+            _store.pop(key, None)
+    _store.commit(local_vc)
+    previous_ring = None
+
+def adopt_ring_weights(weights, round_id):
+    """Take the ring weights of a later round from a peer, the store is then repaired from a shard peer"""
+    global ring_positions
+    global rebalance_round
+    global _substore
+    ring_positions = resharding.HashRing(ring_positions.replicas, ring_positions.vnodes, weights)
+    rebalance_round = round_id
+    _substore = SizedDict({key: value for key, value in list(_store.items()) if consistent_hash_key(key) == socket_address})
+
+def periodic_rebalance():
+    """Every REBALANCE_INTERVAL seconds, the lowest addressed replica checks the load and runs a round if it is uneven
+    With WORKERS, its lane 0 does
+    """
+    while True:
+        time.sleep(REBALANCE_INTERVAL)
+        if workers.lane not in (None, 0):
+            continue
+        if socket_address != min(views) or migrating() or rebalance_lock.locked():
+            continue
+        finished = rebalance_state["finished"]
+        if finished is not None and time.time() - finished < REBALANCE_COOLDOWN:
+            continue
+        plan = plan_rebalance()
+        if plan.get("error") or not plan["changes"] or not rebalance_lock.acquire(blocking=False):
+            continue
+        coordinate_rebalance(plan)
+
+# ?owner=<IP:PORT> returns the keys of this replica's store that hash to owner instead of _substore
+# ?format=ndjson streams one [key, value] JSON array per line
+# ?limit=<INTEGER>&cursor=<key>&snapshot=<id> returns one page of keys in sorted order, starting after cursor,
+#   along with the cursor of the next page(None on the last page) and the snapshot the next page is served from
+# ?summary=true only returns the number of keys and their size in bytes
 @views_route.route("/get-substore", methods=["GET", "PUT"])
 def handle_get_substore():
     if request.method == "GET":
-        return make_response(dict(substore=_substore),200)
+        # asked for the keys of a range moved by a rebalance round this replica has not applied yet
+        if request.args.get("round", 0, type=int) > rebalance_round:
+            return make_response(dict(error="Rebalance round not applied yet; try again later"), 503)
+        owner = request.args.get("owner")
+        if request.args.get("summary") == "true":
+            return make_response(summarize_substore(*substore_view(owner)), 200)
+        if request.args.get("format") == "ndjson":
+            return Response(stream_substore(*substore_view(owner)), mimetype="application/x-ndjson")
+        if "limit" in request.args or "cursor" in request.args:
+            limit = request.args.get("limit", SUBSTORE_PAGE_LIMIT, type=int)
+            if not limit or limit < 1:
+                return make_response(dict(error="limit must be a positive integer"), 400)
+            page_keys, next_cursor, snapshot_id = substore_page(owner, request.args.get("cursor"), limit, request.args.get("snapshot"))
+            source = substore_view(owner, keys=False)[0]
+            page = {key: source[key] for key in page_keys if key in source}
+            return make_response({"substore": page, "next-cursor": next_cursor, "snapshot": snapshot_id}, 200)
+        source, keys = substore_view(owner)
+        return make_response(dict(substore={key: source[key] for key in keys if key in source}),200)
+
+def substore_page(owner, cursor, limit, snapshot_id=None):
+    """One page of the sorted keys of _substore(or of the keys of _store that hash to owner) after cursor
+
+    A walk's keys are snapshotted and sorted once, on its first page, and its next pages seek into the
+    snapshot, so a page costs a binary search plus its keys. Keys written since the snapshot are not listed
+
+    Returns: tuple in the form (keys of the page, cursor of the next page or None, snapshot id)
+    """
+    now = time.monotonic()
+    with substore_snapshots_lock:
+        for id in [id for id, (_, _, expiry) in substore_snapshots.items() if expiry < now]:
+            del substore_snapshots[id]
+        if snapshot_id not in substore_snapshots and cursor is not None:
+            # a walk whose snapshot expired(or a client that does not pass it) resumes from the latest snapshot of owner,
+            # the cursor is a key
+            snapshot_id = next((id for id, (snapshot_owner, _, _) in reversed(substore_snapshots.items()) if snapshot_owner == owner), None)
+        snapshot = substore_snapshots.get(snapshot_id)
+        if snapshot is not None and snapshot[0] == owner:
+            substore_snapshots.move_to_end(snapshot_id)
+            snapshot[2] = now + SUBSTORE_SNAPSHOT_TTL
+        else:
+            snapshot = None
+    if snapshot is None:
+        keys = substore_view(owner)[1]
+        keys.sort()
+        snapshot_id = uuid.uuid4().hex
+        snapshot = [owner, keys, now + SUBSTORE_SNAPSHOT_TTL]
+        with substore_snapshots_lock:
+            substore_snapshots[snapshot_id] = snapshot
+            while len(substore_snapshots) > SUBSTORE_SNAPSHOTS:
+                substore_snapshots.popitem(last=False)
+    keys = snapshot[1]
+    start = 0 if cursor is None else bisect.bisect_right(keys, cursor)
+    page_keys = keys[start:start + limit]
+    if start + limit < len(keys):
+        return (page_keys, page_keys[-1], snapshot_id)
+    # last page, the walk is over
+    with substore_snapshots_lock:
+        substore_snapshots.pop(snapshot_id, None)
+    return (page_keys, None, None)
+
+def substore_view(owner=None, keys=True):
+    """Returns: tuple in the form (source dictionary, snapshot of its keys) for _substore,
+        or for the keys of _store that hash to owner(None instead of the keys if not keys)
+    """
+    if owner:
+        return (_store, [key for key in list(_store) if consistent_hash_key(key) == owner] if keys else None)
+    return (_substore, list(_substore) if keys else None)
 
-def update_node(new_members):
-    """Update node to match information in new partition"""
-    global local_vc
-    global _store
-    # OLD_MEMBERS(becoming uneeded)
-    # start _store anew
-    _store = dict()
-    # add local _subtore
-    _store.update(_substore)
-    # populate rest of _store
-    for member in new_members:
-        # get member _substore
-        member_res = requests.get(f"http://{member}/get-substore", json=dict())
-        member_substore = member_res.json()['substore']
-        # update _store with recv _substore
-        _store.update(member_substore)
-
-    # Reset vc_clock to 0
-    local_vc = dict()
-  
-    for member in new_members:
-        local_vc[member] = 0
\ No newline at end of file
+def summarize_substore(source, keys):
+    """Returns: {"keys", "bytes"}, bytes being the size of the keys when streamed"""
+    size = 0
+    for key in keys:
+        try:
+            size += len(json.dumps([key, source[key]])) + 1
+        except KeyError:
+            continue
+    return dict(keys=len(keys), bytes=size)
+
+def stream_substore(source, keys):
+    """Yields NDJSON chunks of SUBSTORE_STREAM_CHUNK [key, value] lines, so values are serialized a chunk at a time"""
+    chunk = list()
+    for key in keys:
+        try:
+            chunk.append(json.dumps([key, source[key]]))
+        except KeyError:
+            # deleted since the snapshot
+            continue
+        if len(chunk) >= SUBSTORE_STREAM_CHUNK:
+            yield "\n".join(chunk) + "\n"
+            chunk = list()
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+def fetch_substore(member, apply, owner=None, throttle=None, round_id=None):
+    """Stream member's _substore(or its keys that hash to owner), passing every
+    SUBSTORE_STREAM_CHUNK keys to apply so memory stays bounded
+    round_id is the rebalance round member must have applied, for the keys that hash to owner since
+
+    Returns: tuple in the form (number of keys received, bytes received)
+    """
+    params = dict(format="ndjson")
+    if owner:
+        params["owner"] = owner
+    if round_id:
+        params["round"] = round_id
+    received = 0
+    size = 0
+    with peer_request("GET", member, "/get-substore", params=params, stream=True, timeout=(CONNECT_TIMEOUT, None)) as response:
+        response.raise_for_status()
+        chunk = dict()
+        chunk_size = 0
+        for line in response.iter_lines():
+            if not line:
+                continue
+            key, value = json.loads(line)
+            chunk[key] = value
+            chunk_size += len(line) + 1
+            if len(chunk) >= SUBSTORE_STREAM_CHUNK:
+                if throttle is not None:
+                    throttle.consume(chunk_size)
+                apply(chunk)
+                received += len(chunk)
+                size += chunk_size
+                chunk = dict()
+                chunk_size = 0
+        if chunk:
+            if throttle is not None:
+                throttle.consume(chunk_size)
+            apply(chunk)
+            received += len(chunk)
+            size += chunk_size
+    return (received, size)
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import multiprocessing
+from io import BytesIO
+from threading import Thread
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from bingus.resharding import hash_token
+from bingus.http_pool import PeerPool, CONNECT_TIMEOUT, peer_pool
+from bingus import metrics, tracing
+
+WORKER_HEADER = "X-Worker-Lane" # lane a request is meant for, set on every request a worker sends
+PARENT_CHECK_INTERVAL = 1 # seconds between two checks that the process that spawned a worker is alive
+# Requests that change the membership of a replica, every lane applies them
+BROADCAST_ROUTES = (("PUT", "/view"), ("DELETE", "/view"), ("PUT", "/shard/add-member/"), ("PUT", "/assign/"), ("PUT", "/shard/reshard"))
+# Requests lane 0 coordinates for the whole replica, it hands the outcome to the other lanes itself
+COORDINATOR_ROUTES = (("PUT", "/shard/rebalance"),)
+# Requests answered with counts over the whole replica, the sum of every lane's counts(see add_counts)
+SUM_ROUTES = ("/shard/key-count/", "/shard/key-counts", "/shard/rebalance/load")
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length", "server", "date"}
+
+count = 1 # worker processes serving this replica
+lane = None # lane of this worker process, None when a single process serves the replica
+lane_addresses = list() # loopback address every lane privately listens on, by lane
+listeners = list() # sockets this worker serves: the shared replica port and its private loopback port
+lane_pool = PeerPool()
+broadcast_pool = None
+
+def lane_of(key):
+    """Returns: lane of the worker that owns key, None when a single process serves the replica"""
+    if lane is None:
+        return None
+    return hash_token(key) % count
+
+def listen_socket(host, port, reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+def spawn(worker_count, port, target, host='0.0.0.0'):
+    """Serve one replica address with worker_count processes, each running target() as lane 0..worker_count-1
+
+    Every worker gets its own SO_REUSEPORT socket on port, so the kernel spreads connections across them,
+    plus a private loopback socket the other lanes send it the requests for its keys on
+    Returns once a worker exits, after stopping the others
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("WORKERS requires SO_REUSEPORT")
+    private = [listen_socket("127.0.0.1", 0) for _ in range(worker_count)]
+    addresses = [f"127.0.0.1:{sock.getsockname()[1]}" for sock in private]
+    public = [listen_socket(host, port, reuse_port=True) for _ in range(worker_count)]
+    context = multiprocessing.get_context("fork")
+    processes = list()
+    for i in range(worker_count):
+        sockets = [public[i], private[i]]
+        processes.append(context.Process(target=run_lane, args=(i, worker_count, addresses, sockets, target), name=f"worker-{i}"))
+    for process in processes:
+        process.start()
+    for sock in public + private:
+        sock.close()
+
+    def stop(signum, frame):
+        for process in processes:
+            process.terminate()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # a replica missing a lane cannot serve that lane's keys, stop the others so it gets restarted as a whole
+    while all(process.is_alive() for process in processes):
+        time.sleep(PARENT_CHECK_INTERVAL)
+    for process in processes:
+        process.terminate()
+    sys.exit(1)
+
+def run_lane(i, worker_count, addresses, sockets, target):
+    global count, lane, lane_addresses, listeners, broadcast_pool
+    count = worker_count
+    lane = i
+    lane_addresses = addresses
+    listeners = sockets
+    broadcast_pool = ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="lane-broadcast")
+    # peers route the requests of this lane to their own worker of the lane
+    peer_pool.headers[WORKER_HEADER] = str(lane)
+    Thread(target=watch_parent, args=(os.getppid(),), name="watch-parent", daemon=True).start()
+    target()
+
+def watch_parent(parent):
+    """Exit once the process that spawned this worker is gone, so no worker outlives its replica"""
+    while os.getppid() == parent:
+        time.sleep(PARENT_CHECK_INTERVAL)
+    os._exit(1)
+
+def send_lanes(method, path, **kwargs):
+    """Send a request to every other lane of this replica in parallel
+
+    Returns: their responses, by lane
+    """
+    futures = {other: broadcast_pool.submit(lane_pool.request, method, lane_addresses[other], path,
+                                            headers={WORKER_HEADER: str(other)}, timeout=(CONNECT_TIMEOUT, None), **kwargs)
+               for other in range(count) if other != lane}
+    return {other: future.result() for other, future in futures.items()}
+
+def read_body(environ):
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    return environ["wsgi.input"].read(length) if length > 0 else b""
+
+def add_counts(bodies):
+    """Add up JSON bodies of the same shape: numbers are summed, lists joined without duplicates,
+    dictionaries added up key by key, anything else is taken from the first body
+    """
+    first = bodies[0]
+    if isinstance(first, dict):
+        keys = list(dict.fromkeys(key for body in bodies for key in body))
+        return {key: add_counts([body[key] for body in bodies if key in body]) for key in keys}
+    if isinstance(first, list):
+        res = list()
+        for body in bodies:
+            res.extend(item for item in body if item not in res)
+        return res
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return sum(bodies)
+    return first
+
+class LaneDispatcher():
+    # WSGI middleware in front of a worker's app
+    # A request for a key of another lane, or tagged with another lane by a peer's worker, is sent on
+    # to that lane's worker, membership changes are applied by every lane, everything else is served here
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        path = environ.get("PATH_INFO", "")
+        tagged = environ.get("HTTP_X_WORKER_LANE")
+        if tagged is not None:
+            target = int(tagged)
+        elif path.startswith("/kvs/") and path != "/kvs/batch":
+            # PATH_INFO holds the raw bytes as latin-1, the app sees the key decoded as UTF-8
+            target = lane_of(path[len("/kvs/"):].encode("latin-1").decode("utf-8", "replace"))
+        elif any(method == route_method and path.startswith(prefix) for route_method, prefix in BROADCAST_ROUTES):
+            body = read_body(environ)
+            self.broadcast(environ, body)
+            environ["wsgi.input"] = BytesIO(body)
+            target = lane
+        elif any(method == route_method and path.startswith(prefix) for route_method, prefix in COORDINATOR_ROUTES):
+            target = 0
+        elif method == "GET" and any(path.startswith(prefix) for prefix in SUM_ROUTES):
+            return self.gather(environ, start_response)
+        elif method == "GET" and path == "/metrics":
+            return self.gather_metrics(environ, start_response)
+        else:
+            target = lane
+        if target == lane:
+            return self.app(environ, start_response)
+        response = self.send(target, environ, read_body(environ))
+        return self.respond(response, start_response)
+
+    def send(self, target, environ, body):
+        """Send the request in environ to the worker of lane target"""
+        path = quote(environ.get("PATH_INFO", "").encode("latin-1"))
+        if environ.get("QUERY_STRING"):
+            path += "?" + environ["QUERY_STRING"]
+        headers = {WORKER_HEADER: str(target)}
+        if environ.get("CONTENT_TYPE"):
+            headers["Content-Type"] = environ["CONTENT_TYPE"]
+        if environ.get("HTTP_X_TRACE_ID"):
+            headers[tracing.TRACE_HEADER] = environ["HTTP_X_TRACE_ID"]
+        # the target may wait on causal dependencies or a reshard, as long as the sender of the request would
+        return lane_pool.request(environ["REQUEST_METHOD"], lane_addresses[target], path, data=body,
+                                 headers=headers, timeout=(CONNECT_TIMEOUT, None))
+
+    def respond(self, response, start_response):
+        headers = [(name, value) for name, value in response.headers.items() if name.lower() not in HOP_HEADERS]
+        start_response(f"{response.status_code} {response.reason}", headers)
+        return [response.content]
+
+    def broadcast(self, environ, body):
+        """Apply the request in environ on every other lane, returns once they all answered"""
+        futures = [broadcast_pool.submit(self.send, other, environ, body) for other in range(count) if other != lane]
+        for future in futures:
+            future.result()
+
+    def gather(self, environ, start_response):
+        """Answer counts over the whole replica with the sum of every lane's counts"""
+        futures = [broadcast_pool.submit(self.send, other, environ, b"") for other in range(count)]
+        responses = [future.result() for future in futures]
+        for response in responses:
+            if response.status_code != 200:
+                return self.respond(response, start_response)
+        start_response("200 OK", [("Content-Type", "application/json")])
+        return [json.dumps(add_counts([response.json() for response in responses])).encode("utf-8")]
+
+    def gather_metrics(self, environ, start_response):
+        """Answer /metrics with the metrics of every lane, told apart by their lane label"""
+        futures = [broadcast_pool.submit(self.send, other, environ, b"") for other in range(count)]
+        texts = [future.result().text for future in futures]
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")])
+        return [metrics.merge(texts).encode("utf-8")]
@@ -0,0 +1 @@
+from .client import Client, ClientError, merge_metadata
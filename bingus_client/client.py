@@ -0,0 +1,136 @@
+import random
+from threading import Lock
+import requests
+from bingus.resharding import HashRing
+from bingus.http_pool import PeerPool
+
+TOPOLOGY_HEADER = "X-Topology-Epoch"
+
+class ClientError(Exception):
+    # Error response(or no response) from the key value store
+    def __init__(self, status, body):
+        super().__init__(f"{status}: {body}")
+        self.status = status
+        self.body = body
+
+def merge_metadata(first, second):
+    """Merge two causal metadata of the form {"vc": {shard_id: vc}, "epoch": n} by taking the max of every clock
+
+    Clocks from an older shard epoch are dropped, replicas ignore them anyway
+    """
+    if not first:
+        return second
+    if not second:
+        return first
+    first_epoch = first.get("epoch", 0)
+    second_epoch = second.get("epoch", 0)
+    if first_epoch != second_epoch:
+        return first if first_epoch > second_epoch else second
+    merged = {id: dict(vc) for id, vc in first["vc"].items()}
+    for id, vc in second["vc"].items():
+        merged_vc = merged.setdefault(id, dict())
+        for addr, val in vc.items():
+            merged_vc[addr] = max(merged_vc.get(addr, 0), val)
+    return {"vc": merged, "epoch": first_epoch}
+
+class Client():
+    # Client for a bingus cluster that sends every request straight to the replica owning its key
+    # The ring and shard map are fetched from the cluster and cached until a response reports
+    # a different topology epoch, so requests skip the replicas' forwarding hop
+    # Causal metadata of every shard the client talked to is kept and sent with each request
+    def __init__(self, addresses, address_map=None, pool_maxsize=None):
+        """
+        addresses: replicas to fetch the topology from
+        address_map: optional {replica address: address reachable from the client}, e.g. for port-mapped containers
+        """
+        self.seeds = list(addresses)
+        self.address_map = dict(address_map or ())
+        self.pool = PeerPool(pool_maxsize)
+        self.lock = Lock()
+        self.ring = None
+        self.shards = dict() # {shard_id: set of replicas}
+        self.epoch = None # topology epoch of the cached ring
+        self.metadata = None # causal metadata returned by the cluster so far
+
+    def reachable(self, addr):
+        return self.address_map.get(addr, addr)
+
+    def refresh(self):
+        """Fetch the ring and shard map from the first replica that answers"""
+        candidates = list(self.seeds)
+        if self.ring is not None:
+            candidates += [self.reachable(replica) for replica in self.ring.replicas if self.reachable(replica) not in candidates]
+        for addr in candidates:
+            try:
+                ring = self.pool.request("GET", addr, "/shard/ring").json()
+                shards = dict()
+                for id in self.pool.request("GET", addr, "/shard/ids").json()["shard-ids"]:
+                    shards[int(id)] = set(self.pool.request("GET", addr, f"/shard/members/{id}").json()["shard-members"])
+            except (requests.RequestException, ValueError, KeyError):
+                continue
+            with self.lock:
+                self.ring = HashRing(ring["replicas"], ring["vnodes"], ring.get("weights"))
+                self.shards = shards
+                self.epoch = ring["epoch"]
+            return
+        raise ClientError(503, "No replica is reachable")
+
+    def owner(self, key):
+        """Returns: address of the replica key hashes to"""
+        if self.ring is None:
+            self.refresh()
+        return self.ring.lookup(key)
+
+    def request(self, method, key, payload=None):
+        """Send a request for key straight to its owner
+
+        Returns: tuple in the form (response body, status code)
+        """
+        payload = dict(payload or ())
+        payload["causal-metadata"] = self.metadata
+        owner = self.owner(key)
+        try:
+            response = self.pool.request(method, self.reachable(owner), f"/kvs/{key}", json=payload)
+        except requests.ConnectionError:
+            # owner is down, let another replica route the request
+            self.pool.close(self.reachable(owner))
+            others = [replica for replica in self.ring.replicas if replica != owner]
+            if not others:
+                raise ClientError(503, f"Replica {owner} is unreachable")
+            response = self.pool.request(method, self.reachable(random.choice(others)), f"/kvs/{key}", json=payload)
+        epoch = response.headers.get(TOPOLOGY_HEADER)
+        if epoch is not None and epoch != self.epoch:
+            self.refresh()
+        body = response.json()
+        if "causal-metadata" in body:
+            with self.lock:
+                self.metadata = merge_metadata(self.metadata, body["causal-metadata"])
+        return (body, response.status_code)
+
+    def get(self, key):
+        """Returns: value of key, raises KeyError if it does not exist"""
+        body, status = self.request("GET", key)
+        if status == 404:
+            raise KeyError(key)
+        if status != 200:
+            raise ClientError(status, body)
+        return body["value"]
+
+    def put(self, key, value):
+        """Returns: "created" or "replaced" """
+        body, status = self.request("PUT", key, dict(value=value))
+        if status not in (200, 201):
+            raise ClientError(status, body)
+        return body["result"]
+
+    def delete(self, key):
+        """Raises KeyError if key does not exist"""
+        body, status = self.request("DELETE", key)
+        if status == 404:
+            raise KeyError(key)
+        if status != 200:
+            raise ClientError(status, body)
+
+    def close(self):
+        for addr in list(self.pool.sessions):
+            self.pool.close(addr)
@@ -1,13 +1,18 @@
 from flask import Flask, request
 import requests
 import sys
+import os
 import time
-from bingus import create_app, views_route, resharding
-from vectorclock import VectorClock
+from bingus import create_app, views_route, debug_route, resharding, storage, workers, tracing
+from collections import deque
+from bingus.http_pool import peer_request
 import threading
 import hashlib
 import math
 TIME_TO_BOOT = 2.5
+PORT = None # port to listen on, None = the port of the replica's socket address
+SERVER = "waitress" # "waitress"(multi-threaded production WSGI server) or "flask"(development server)
+SERVER_THREADS = 64 # waitress worker threads, requests block while relaying and waiting on causal dependencies
 
 def find_replica_id(shards, replica_to_find):
     for id in shards:
@@ -19,34 +24,32 @@ def notify_replicas(view_points, socket_address):
     # views = {a}
     # vc = {a: 0}
     # Add this replica to other replicas
+    shard_peers = list()
     for view_address in view_points:
-        while True:
-            # Add Replicas that respond
-            try:
-                # Send PUT request
-                response = requests.put(f'http://{view_address}/view', json={'view': socket_address, 'relay': True})
-                metadata = response.json()
-                views_route.views.add(view_address)
+        # Add Replicas that respond
+        try:
+            # Send PUT request
+            response = peer_request("PUT", view_address, "/view", json={'view': socket_address, 'relay': True})
+            metadata = response.json()
+            views_route.views.add(view_address)
+            # a replica restarting into a rebalanced cluster takes the ring weights of its peers
+            replica_data = metadata.get('replica_data', dict())
+            if replica_data.get('rebalance-round', 0) > views_route.rebalance_round:
+                views_route.adopt_ring_weights(replica_data['ring-weights'], replica_data['rebalance-round'])
+            if find_replica_id(views_route.shards, view_address) == views_route.shard_id:
+                shard_peers.append(view_address)
+                # pad local clock with every member the shard peer knows of {a: 0, b:0}
+                if 'replica_data' in metadata:
+                    with views_route.clock_advanced:
+                        for member in metadata['replica_data']['vc']:
+                            views_route.local_vc.setdefault(member, 0)
+        # Ignore unresponsive replicas
+        except (requests.ConnectionError, requests.RequestException, requests.exceptions.HTTPError, ValueError):
+            pass
 
-                # update local clock
-                if 'replica_data' in metadata and (find_replica_id(views_route.shards, view_address) == views_route.shard_id):                   
-                    # compare with padding
-                    received_vc = metadata['replica_data']['vc']
-                    # pad local clock {a: 0, b:0}
-                    views_route.local_vc.update(received_vc)
-                    # pad received clock {b: 0, a:0}
-                    received_vc.update(views_route.local_vc)
-
-                    # compare clocks(should equal length and share keys)
-                    with views_route.update_views_lock:
-                        if VectorClock(views_route.local_vc) <= VectorClock(received_vc):
-                            views_route.local_vc = received_vc
-                            views_route._store = metadata['replica_data']['store']
-                break
-
-            # Ignore unresponsive replicas
-            except (requests.ConnectionError, requests.RequestException, requests.exceptions.HTTPError):
-                break
+    # Repair the store(empty, or recovered from disk) and clock from one shard peer,
+    # transferring only the keys that differ
+    views_route.sync_with_shard(shard_peers)
     
     print("Replica After boot", flush=True)
     print(f"socket_addr {views_route.socket_address}\n"
@@ -68,10 +71,14 @@ def startup():
     """
 
     views_route.socket_address = sys.argv[1]
+    views_route.membership.addr = views_route.socket_address
     views_route.views.add(views_route.socket_address)
     views_route.local_vc[views_route.socket_address] = 0
     
     starting_views = sys.argv[2].split(',')
+    # every replica must use the same number of virtual nodes
+    if os.environ.get("VNODES"):
+        resharding.VNODES_PER_REPLICA = int(os.environ["VNODES"])
     # Check for shard_count
     try:
         if sys.argv[3]:
@@ -87,6 +94,62 @@ def startup():
     except IndexError:
         pass
     starting_views.remove(views_route.socket_address)
+
+    # Opt-in durable storage, recover the store and clock left by a previous run
+    if os.environ.get("STORAGE_DIR"):
+        directory = os.environ["STORAGE_DIR"]
+        # every worker process keeps the keys of its lane
+        if workers.lane is not None:
+            directory = os.path.join(directory, f"lane-{workers.lane}")
+        views_route._store = storage.WalStore(directory)
+        if views_route._store.vc:
+            views_route.local_vc.update(views_route._store.vc)
+        # rebuild _substore from the recovered store
+        for key in views_route._store:
+            if views_route.consistent_hash_key(key) == views_route.socket_address:
+                views_route._substore[key] = views_route._store[key]
+        print(f"recovered {len(views_route._store)} keys from {directory}", flush=True)
+
+    # Shard peers that must confirm a relayed write before the client is answered
+    if os.environ.get("RELAY_ACK_COUNT"):
+        views_route.RELAY_ACK_COUNT = int(os.environ["RELAY_ACK_COUNT"])
+    # Opt-in async replication
+    if os.environ.get("ASYNC_REPLICATION"):
+        views_route.ASYNC_REPLICATION = True
+        views_route.REPLICATION_BATCH_SIZE = int(os.environ.get("REPLICATION_BATCH_SIZE", views_route.REPLICATION_BATCH_SIZE))
+        views_route.REPLICATION_FLUSH_INTERVAL = float(os.environ.get("REPLICATION_FLUSH_INTERVAL", views_route.REPLICATION_FLUSH_INTERVAL))
+    if os.environ.get("ANTI_ENTROPY_INTERVAL"):
+        views_route.ANTI_ENTROPY_INTERVAL = float(os.environ["ANTI_ENTROPY_INTERVAL"])
+    if os.environ.get("TOMBSTONE_TTL"):
+        views_route.TOMBSTONE_TTL = float(os.environ["TOMBSTONE_TTL"])
+    # Which member of the owning shard serves a client GET
+    if os.environ.get("READ_POLICY"):
+        if os.environ["READ_POLICY"] not in views_route.READ_POLICIES:
+            sys.exit(f"READ_POLICY must be one of {', '.join(views_route.READ_POLICIES)}")
+        views_route.READ_POLICY = os.environ["READ_POLICY"]
+    # Bytes per second a replica receives while migrating keys after a reshard
+    if os.environ.get("MIGRATION_BANDWIDTH"):
+        views_route.MIGRATION_BANDWIDTH = float(os.environ["MIGRATION_BANDWIDTH"])
+    # Opt-in automatic rebalancing of ring positions by load, see /shard/rebalance
+    if os.environ.get("REBALANCE_INTERVAL"):
+        views_route.REBALANCE_INTERVAL = float(os.environ["REBALANCE_INTERVAL"])
+    if os.environ.get("REBALANCE_TRIGGER"):
+        views_route.REBALANCE_TRIGGER = float(os.environ["REBALANCE_TRIGGER"])
+    if os.environ.get("REBALANCE_TARGET"):
+        views_route.REBALANCE_TARGET = float(os.environ["REBALANCE_TARGET"])
+    # Opt-in request tracing, requests carrying a trace id from a peer are always traced
+    if os.environ.get("TRACE_SAMPLE_RATE"):
+        tracing.TRACE_SAMPLE_RATE = float(os.environ["TRACE_SAMPLE_RATE"])
+    if os.environ.get("TRACE_SLOW_THRESHOLD"):
+        tracing.TRACE_SLOW_THRESHOLD = float(os.environ["TRACE_SLOW_THRESHOLD"])
+    if os.environ.get("TRACE_BUFFER_SIZE"):
+        tracing.TRACE_BUFFER_SIZE = int(os.environ["TRACE_BUFFER_SIZE"])
+        tracing.recent = deque(maxlen=tracing.TRACE_BUFFER_SIZE)
+    if os.environ.get("TRACE_EXPORT_PATH"):
+        tracing.TRACE_EXPORT_PATH = os.environ["TRACE_EXPORT_PATH"]
+    # Opt-in /debug/profile and /debug/alloc
+    if os.environ.get("DEBUG_ENDPOINTS"):
+        debug_route.DEBUG_ENDPOINTS = True
     
     print(f"starting replica: {views_route.socket_address}")
     # Notify other replicas about this new instance
@@ -94,11 +157,57 @@ def startup():
     t.start()
 
     my_app = create_app()
+    run_server(my_app, listen_port())
+
+def listen_port():
+    """Port to listen on: PORT, else the PORT environment variable, else the port of the socket address"""
+    if PORT is not None:
+        return PORT
+    if os.environ.get("PORT"):
+        return int(os.environ["PORT"])
+    return int(sys.argv[1].rsplit(':', 1)[1])
+
+def run_server(app, port):
+    """Serve app with waitress when it is installed, else with Flask's threaded development server"""
+    server = os.environ.get("SERVER", SERVER)
+    threads = int(os.environ.get("SERVER_THREADS", SERVER_THREADS))
+    # worker processes serve the sockets bound for them by workers.spawn()
+    if workers.listeners:
+        import waitress
+        print(f"worker {workers.lane} of {workers.count} serving with waitress, {threads} threads", flush=True)
+        waitress.serve(app, sockets=workers.listeners, threads=threads)
+        return
+    if server == "waitress":
+        try:
+            import waitress
+        except ImportError:
+            print("waitress is not installed, falling back to the development server", flush=True)
+        else:
+            print(f"serving with waitress, {threads} threads", flush=True)
+            waitress.serve(app, host='0.0.0.0', port=port, threads=threads)
+            return
     # https://stackoverflow.com/questions/43644083/python-thread-running-twice-when-called-once-in-main
-    my_app.run(host='0.0.0.0', port=8090, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
 
 def pulse_starter():
+    # Start Anti-entropy Thread
+    threading.Thread(target=views_route.periodic_anti_entropy, name="anti-entropy", daemon=True).start()
+    # Opt-in automatic rebalancing
+    if views_route.REBALANCE_INTERVAL:
+        threading.Thread(target=views_route.periodic_rebalance, name="rebalance", daemon=True).start()
     views_route.periodic_pulse_sender()
 
+def main():
+    # Opt-in: serve this replica with several worker processes, each owning a lane of the keys
+    worker_count = int(os.environ.get("WORKERS", 1))
+    if worker_count > 1:
+        try:
+            import waitress
+        except ImportError:
+            sys.exit("WORKERS requires waitress")
+        workers.spawn(worker_count, listen_port(), startup)
+    else:
+        startup()
+
 if __name__ == '__main__':
-    startup()
+    main()
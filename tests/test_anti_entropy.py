@@ -0,0 +1,89 @@
+import pytest
+from bingus import views_route, resharding
+from bingus.storage import MemoryStore
+from vectorclock import has_dependency
+
+A = "10.10.0.2:8090"
+B = "10.10.0.3:8090"
+
+class FakeResponse():
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+class FakePeer():
+    # Answers the anti-entropy endpoints of shard peer B from its own store and clock
+    def __init__(self, store, vc):
+        self.store = store
+        self.vc = vc
+
+    def request(self, method, addr, path, **kwargs):
+        body = kwargs["json"]
+        if path == "/anti-entropy/tree":
+            return FakeResponse({"hashes": self.store.tree_hashes(body["level"], body["indices"]), "depth": self.store.tree.depth,
+                                 "vc": dict(self.vc), "epoch": 0, "migrating": False, "shard-id": 0})
+        data, versions, tombstones = self.store.leaf_items(body["leaves"])
+        return FakeResponse(dict(data=data, versions=versions, tombstones=tombstones, vc=dict(self.vc)))
+
+@pytest.fixture
+def replica(monkeypatch):
+    """Replica A of a two member shard {A, B}, returns its store"""
+    store = MemoryStore()
+    monkeypatch.setattr(views_route, "_store", store)
+    monkeypatch.setattr(views_route, "_substore", views_route.SizedDict())
+    monkeypatch.setattr(views_route, "socket_address", A)
+    monkeypatch.setattr(views_route, "shard_id", 0)
+    monkeypatch.setattr(views_route, "shards", {0: {A, B}})
+    monkeypatch.setattr(views_route, "shard_epoch", 0)
+    monkeypatch.setattr(views_route, "migration", None)
+    monkeypatch.setattr(views_route, "ring_positions", resharding.HashRing([A, B]))
+    return store
+
+def sync(monkeypatch, peer_store, peer_vc):
+    peer = FakePeer(peer_store, peer_vc)
+    monkeypatch.setattr(views_route, "peer_request", peer.request)
+    return views_route.anti_entropy(B)
+
+def test_concurrent_clocks_converge(replica, monkeypatch):
+    # A delivered its own write B never got, B wrote while A was down
+    replica.put("written-at-a", "a", (1000, A))
+    monkeypatch.setattr(views_route, "local_vc", {A: 1, B: 0})
+    peer_store = MemoryStore()
+    peer_store.put("written-at-b", "b", (1001, B))
+    assert sync(monkeypatch, peer_store, {A: 0, B: 1}) == 1
+    assert views_route.local_vc == {A: 1, B: 1}
+    assert replica["written-at-b"] == "b" and replica["written-at-a"] == "a"
+    # B's next relay is deliverable right away instead of waiting on the write A missed
+    assert not has_dependency(B, {A: 1, B: 2}, views_route.local_vc)
+
+def test_concurrent_clocks_converge_once_data_matches(replica, monkeypatch):
+    # the data was repaired earlier, only the clocks still differ
+    replica.put("key", "value", (1000, A))
+    monkeypatch.setattr(views_route, "local_vc", {A: 3, B: 1})
+    peer_store = MemoryStore()
+    peer_store.put("key", "value", (1000, A))
+    assert sync(monkeypatch, peer_store, {A: 2, B: 4}) == 0
+    assert views_route.local_vc == {A: 3, B: 4}
+
+def test_clock_ahead_of_peer_is_kept(replica, monkeypatch):
+    replica.put("key", "new", (2000, A))
+    monkeypatch.setattr(views_route, "local_vc", {A: 2, B: 1})
+    peer_store = MemoryStore()
+    peer_store.put("key", "old", (1000, A))
+    assert sync(monkeypatch, peer_store, {A: 1, B: 1}) == 0
+    assert views_route.local_vc == {A: 2, B: 1}
+    assert replica["key"] == "new"
+
+def test_older_write_does_not_overwrite_newer(replica, monkeypatch):
+    replica.put("key", "new", (2000, A))
+    monkeypatch.setattr(views_route, "local_vc", {A: 2, B: 0})
+    peer_store = MemoryStore()
+    peer_store.put("key", "old", (1000, B))
+    peer_store.put("other", "b", (1500, B))
+    sync(monkeypatch, peer_store, {A: 1, B: 1})
+    assert replica["key"] == "new" and replica["other"] == "b"
+    assert views_route.local_vc == {A: 2, B: 1}
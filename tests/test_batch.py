@@ -0,0 +1,39 @@
+import requests
+from bingus import views_route
+
+def test_forward_batch_times_out_with_503(monkeypatch):
+    calls = list()
+    def hung_owner(method, addr, path, **kwargs):
+        calls.append(kwargs["timeout"])
+        raise requests.ReadTimeout()
+    monkeypatch.setattr(views_route, "peer_request", hung_owner)
+    metadata = {"vc": {"0": {"a": 1}}, "epoch": 0}
+    operations = [{"method": "GET", "key": "x"}, {"method": "PUT", "key": "y", "value": 1}]
+    results, meta = views_route.forward_batch("10.10.0.3:8090", operations, metadata)
+    assert [result["status"] for result in results] == [503, 503]
+    assert meta == metadata
+    # the read is bounded, a hung owner cannot hold the scatter thread forever
+    assert calls[0][1] == views_route.BATCH_TIMEOUT
+
+def test_get_metadata_leaves_client_metadata_unchanged(monkeypatch):
+    monkeypatch.setattr(views_route, "shard_id", 0)
+    monkeypatch.setattr(views_route, "shard_epoch", 0)
+    monkeypatch.setattr(views_route, "local_vc", {"a": 2, "b": 1})
+    shared = {"causal-metadata": {"vc": {"1": {"c": 4}}, "epoch": 0}}
+    sender, sender_vc, sender_vc_all = views_route.get_metadata(shared)
+    assert sender is None and sender_vc == {"a": 2, "b": 1}
+    # a copy of the local clock, not the live one
+    assert sender_vc is not views_route.local_vc
+    assert shared == {"causal-metadata": {"vc": {"1": {"c": 4}}, "epoch": 0}}
+    views_route.get_local_causal_metadata(None, sender_vc_all)
+    assert shared["causal-metadata"]["vc"] == {"1": {"c": 4}}
+
+def test_get_metadata_copies_the_shard_clock(monkeypatch):
+    monkeypatch.setattr(views_route, "shard_id", 0)
+    monkeypatch.setattr(views_route, "shard_epoch", 0)
+    monkeypatch.setattr(views_route, "local_vc", {"a": 2, "b": 1})
+    shared = {"causal-metadata": {"vc": {"0": {"a": 1}}, "epoch": 0}}
+    _, sender_vc, _ = views_route.get_metadata(shared)
+    # the dependency check pads the client's clock
+    views_route.dependency_check(None, sender_vc)
+    assert shared["causal-metadata"]["vc"] == {"0": {"a": 1}}
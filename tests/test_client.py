@@ -0,0 +1,97 @@
+import pytest
+import requests
+from bingus.resharding import HashRing
+from bingus_client import Client, ClientError, merge_metadata
+from bingus_client.client import TOPOLOGY_HEADER
+
+A = "10.10.0.2:8090"
+B = "10.10.0.3:8090"
+C = "10.10.0.4:8090"
+
+class FakeResponse():
+    def __init__(self, body, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or dict()
+
+    def json(self):
+        return self.body
+
+class FakePool():
+    # Serves the topology endpoints and records every /kvs request as (address, method, key)
+    def __init__(self, replicas, epoch="1", down=()):
+        self.replicas = list(replicas)
+        self.epoch = epoch
+        self.down = set(down)
+        self.sent = list()
+        self.rings = 0
+        self.sessions = dict()
+
+    def request(self, method, addr, path, **kwargs):
+        if addr in self.down:
+            raise requests.ConnectionError(addr)
+        if path == "/shard/ring":
+            self.rings += 1
+            return FakeResponse(dict(replicas=self.replicas, vnodes=8, epoch=self.epoch))
+        if path == "/shard/ids":
+            return FakeResponse({"shard-ids": [0]})
+        if path.startswith("/shard/members/"):
+            return FakeResponse({"shard-members": self.replicas})
+        self.sent.append((addr, method, path[len("/kvs/"):]))
+        metadata = {"vc": {"0": {addr: len(self.sent)}}, "epoch": 0}
+        return FakeResponse({"value": 1, "causal-metadata": metadata}, headers={TOPOLOGY_HEADER: self.epoch})
+
+    def close(self, addr):
+        pass
+
+def client_of(pool, **kwargs):
+    client = Client([A], **kwargs)
+    client.pool = pool
+    return client
+
+def test_requests_go_straight_to_the_owner():
+    pool = FakePool([A, B, C])
+    client = client_of(pool, address_map={B: "localhost:9001"})
+    ring = HashRing([A, B, C], 8)
+    for i in range(30):
+        assert client.get(f"key{i}") == 1
+    assert [addr for addr, _, _ in pool.sent] == [client.reachable(ring.lookup(f"key{i}")) for i in range(30)]
+    # the topology is fetched once while its epoch does not change
+    assert pool.rings == 1
+    assert any(addr == "localhost:9001" for addr, _, _ in pool.sent)
+
+def test_a_new_topology_epoch_refreshes_the_ring():
+    pool = FakePool([A, B])
+    client = client_of(pool)
+    client.get("key")
+    pool.replicas, pool.epoch = [A, B, C], "2"
+    client.get("key")
+    assert pool.rings == 2 and C in client.ring and client.epoch == "2"
+
+def test_an_unreachable_owner_is_routed_around():
+    ring = HashRing([A, B, C], 8)
+    key = next(f"key{i}" for i in range(100) if ring.lookup(f"key{i}") == B)
+    pool = FakePool([A, B, C], down={B})
+    client = client_of(pool)
+    assert client.get(key) == 1
+    assert pool.sent[0][0] in (A, C)
+    with pytest.raises(ClientError):
+        client_of(FakePool([A], down={A})).get(key)
+
+def test_metadata_is_merged_across_responses():
+    pool = FakePool([A, B, C])
+    client = client_of(pool)
+    for i in range(5):
+        client.get(f"key{i}")
+    assert client.metadata["epoch"] == 0
+    assert all(client.metadata["vc"]["0"][addr] == max(n + 1 for n, sent in enumerate(pool.sent) if sent[0] == addr)
+               for addr in client.metadata["vc"]["0"])
+
+def test_merge_metadata_keeps_the_newest_epoch_and_the_max_of_every_clock():
+    first = {"vc": {"0": {A: 2, B: 1}}, "epoch": 1}
+    second = {"vc": {"0": {A: 1, B: 3}, "1": {C: 4}}, "epoch": 1}
+    assert merge_metadata(first, second) == {"vc": {"0": {A: 2, B: 3}, "1": {C: 4}}, "epoch": 1}
+    assert merge_metadata(first, {"vc": {"0": {A: 9}}, "epoch": 0}) == first
+    assert merge_metadata(None, first) == first
+    # the inputs are not changed
+    assert first == {"vc": {"0": {A: 2, B: 1}}, "epoch": 1}
@@ -0,0 +1,51 @@
+from bingus.resharding import HashRing, hash_token, calculate_ring_positions, VNODES_PER_REPLICA
+
+REPLICAS = [f"10.10.0.{i}:8090" for i in range(2, 8)]
+KEYS = [f"key{i}" for i in range(2000)]
+
+def walk(ring, key):
+    # first position clockwise from the key, the definition lookup() must match
+    token = hash_token(key)
+    positions = sorted(zip(ring.tokens, ring.owners))
+    for position, owner in positions:
+        if position >= token:
+            return owner
+    return positions[0][1]
+
+def test_lookup_matches_a_walk_of_the_ring():
+    ring = HashRing(REPLICAS)
+    assert len(ring.tokens) == len(REPLICAS) * VNODES_PER_REPLICA
+    assert all(ring.lookup(key) == walk(ring, key) for key in KEYS)
+
+def test_lookup_wraps_around_and_handles_an_empty_ring():
+    ring = HashRing(REPLICAS)
+    assert ring.owner_of_token(ring.tokens[-1] + 1) == ring.owners[0]
+    assert ring.owner_of_token(ring.tokens[3]) == ring.owners[3]
+    assert HashRing().lookup("key") is None
+
+def test_every_replica_builds_the_same_ring():
+    assert calculate_ring_positions(REPLICAS).owners == calculate_ring_positions(reversed(REPLICAS)).owners
+
+def test_adding_a_replica_only_moves_keys_to_it():
+    old = HashRing(REPLICAS)
+    new = HashRing(REPLICAS + ["10.10.0.9:8090"])
+    moved = [key for key in KEYS if old.lookup(key) != new.lookup(key)]
+    assert moved and all(new.lookup(key) == "10.10.0.9:8090" for key in moved)
+
+def test_weights_set_the_positions_of_a_replica():
+    heavy, light = REPLICAS[0], REPLICAS[1]
+    ring = HashRing(REPLICAS, weights={heavy: 256, light: 32, "10.10.0.99:8090": 5})
+    assert ring.vnodes_of(heavy) == 256 and ring.vnodes_of(light) == 32 and ring.vnodes_of(REPLICAS[2]) == VNODES_PER_REPLICA
+    assert ring.owners.count(heavy) == 256 and ring.owners.count(light) == 32
+    # weights of replicas outside the ring are ignored
+    assert "10.10.0.99:8090" not in ring.weights
+    # a replica's positions are a prefix of each other, so fewer positions only give up ranges
+    plain = HashRing(REPLICAS)
+    assert set(ring.tokens[i] for i, owner in enumerate(ring.owners) if owner == light) < \
+        set(plain.tokens[i] for i, owner in enumerate(plain.owners) if owner == light)
+
+def test_predecessors_are_the_owners_of_the_previous_positions():
+    ring = HashRing(REPLICAS)
+    replica = REPLICAS[0]
+    expected = {ring.owners[i - 1] for i, owner in enumerate(ring.owners) if owner == replica} - {replica}
+    assert ring.predecessors(replica) == expected
@@ -0,0 +1,32 @@
+import requests
+from bingus import views_route, resharding
+
+A = "10.10.0.2:8090"
+B = "10.10.0.3:8090"
+C = "10.10.0.4:8090"
+
+def test_migrate_from_falls_back_to_old_shard_peer(monkeypatch):
+    monkeypatch.setattr(views_route, "socket_address", A)
+    monkeypatch.setattr(views_route, "CONNECT_TIMEOUT", 0)
+    calls = list()
+    def fetch(member, apply, owner=None, throttle=None, round_id=None):
+        calls.append((member, owner))
+        if member == B:
+            raise requests.ConnectionError()
+        return (3, 30)
+    monkeypatch.setattr(views_route, "fetch_substore", fetch)
+    state = dict(keys=0, bytes=0, sources={B: "pending"})
+    views_route.migrate_from(state, B, resharding.Throttle(), {0: {A}, 1: {B, C}})
+    # C replicated B's keys, it streams the ones that hash to B
+    assert calls == [(B, None), (C, B)]
+    assert state == dict(keys=3, bytes=30, sources={B: "done"})
+
+def test_migrate_from_fails_when_no_member_answers(monkeypatch):
+    monkeypatch.setattr(views_route, "socket_address", A)
+    monkeypatch.setattr(views_route, "CONNECT_TIMEOUT", 0)
+    def fetch(member, apply, owner=None, throttle=None, round_id=None):
+        raise requests.ConnectionError()
+    monkeypatch.setattr(views_route, "fetch_substore", fetch)
+    state = dict(keys=0, bytes=0, sources={B: "pending"})
+    views_route.migrate_from(state, B, resharding.Throttle(), {0: {A}, 1: {B, C}})
+    assert state["sources"] == {B: "failed"} and state["keys"] == 0
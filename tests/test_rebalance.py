@@ -0,0 +1,42 @@
+import pytest
+from bingus.resharding import HashRing, load_shares, plan_weights, moved_ranges, MIN_VNODES_DIVISOR, MAX_VNODES_FACTOR
+
+A = "10.10.0.2:8090"
+B = "10.10.0.3:8090"
+C = "10.10.0.4:8090"
+
+def test_load_shares_weigh_keys_and_requests():
+    shares = load_shares({A: {"keys": 30, "requests-per-second": 0.0}, B: {"keys": 10, "requests-per-second": 10.0}})
+    assert shares[A] == pytest.approx(0.375) and shares[B] == pytest.approx(0.625)
+    # without requests only the keys count, and the other way around
+    assert load_shares({A: {"keys": 3, "requests-per-second": 0}, B: {"keys": 1, "requests-per-second": 0}})[A] == pytest.approx(0.75)
+    assert load_shares({A: {"keys": 0, "requests-per-second": 1}, B: {"keys": 0, "requests-per-second": 3}})[B] == pytest.approx(0.75)
+    assert load_shares({A: {"keys": 0, "requests-per-second": 0}}) == dict()
+
+def test_plan_weights_waits_for_the_trigger():
+    ring = HashRing([A, B, C])
+    assert plan_weights({A: 0.4, B: 0.3, C: 0.3}, ring) == dict()
+    assert plan_weights({A: 1.0}, ring) == dict()
+
+def test_plan_weights_moves_positions_from_hot_to_cold_replicas():
+    ring = HashRing([A, B, C])
+    weights = plan_weights({A: 0.55, B: 0.33, C: 0.12}, ring)
+    # each step is at most step(25%) of the replica's positions
+    assert weights[A] == round(ring.vnodes * 0.75)
+    assert weights[C] == round(ring.vnodes * 1.25)
+    # B is within target of the mean
+    assert B not in weights
+
+def test_plan_weights_stays_within_bounds():
+    vnodes = HashRing().vnodes
+    # A already has the fewest positions allowed and B the most
+    ring = HashRing([A, B], weights={A: max(1, vnodes // MIN_VNODES_DIVISOR), B: vnodes * MAX_VNODES_FACTOR})
+    assert plan_weights({A: 0.9, B: 0.1}, ring) == dict()
+
+def test_moved_ranges_lists_the_owners_that_swap_ranges():
+    old = HashRing([A, B, C])
+    assert moved_ranges(old, HashRing([A, B, C])) == set()
+    new = HashRing([A, B, C], weights={A: 96})
+    moved = moved_ranges(old, new)
+    # the positions A gives up go to the others, nothing moves between B and C
+    assert moved and all(old_owner == A and new_owner in (B, C) for old_owner, new_owner in moved)
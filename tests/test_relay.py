@@ -0,0 +1,44 @@
+import threading
+import pytest
+from bingus import views_route, resharding
+from bingus.storage import MemoryStore
+
+A = "10.10.0.2:8090"
+B = "10.10.0.3:8090"
+C = "10.10.0.4:8090"
+
+@pytest.fixture
+def owner(monkeypatch):
+    """Replica A of the shard {A, B, C}, owning every key"""
+    monkeypatch.setattr(views_route, "_store", MemoryStore())
+    monkeypatch.setattr(views_route, "_substore", views_route.SizedDict())
+    monkeypatch.setattr(views_route, "socket_address", A)
+    monkeypatch.setattr(views_route, "views", {A, B, C})
+    monkeypatch.setattr(views_route, "shard_id", 0)
+    monkeypatch.setattr(views_route, "shards", {0: {A, B, C}})
+    monkeypatch.setattr(views_route, "shard_epoch", 0)
+    monkeypatch.setattr(views_route, "migration", None)
+    monkeypatch.setattr(views_route, "local_vc", {A: 0, B: 0, C: 0})
+    monkeypatch.setattr(views_route, "ring_positions", resharding.HashRing([A]))
+
+def test_write_reports_every_peer_outcome(owner, monkeypatch):
+    outcomes = {B: "delivered", C: "unreachable"}
+    monkeypatch.setattr(views_route, "buffer_send_kvs", lambda method, key, addr, metadata, trace=None: outcomes[addr])
+    body, status = views_route.process_kvs("PUT", "key", {"value": 1, "causal-metadata": None})
+    assert status == 201 and body["relay"] == outcomes
+    body, status = views_route.process_kvs("DELETE", "key", {"causal-metadata": body["causal-metadata"]})
+    assert status == 200 and body["relay"] == outcomes
+
+def test_client_is_answered_after_ack_count(owner, monkeypatch):
+    slow = threading.Event()
+    def send(method, key, addr, metadata, trace=None):
+        if addr == C:
+            slow.wait(5)
+        return "delivered"
+    monkeypatch.setattr(views_route, "buffer_send_kvs", send)
+    monkeypatch.setattr(views_route, "RELAY_ACK_COUNT", 1)
+    try:
+        body, status = views_route.process_kvs("PUT", "key", {"value": 1, "causal-metadata": None})
+    finally:
+        slow.set()
+    assert status == 201 and body["relay"] == {B: "delivered", C: "pending"}
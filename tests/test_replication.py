@@ -0,0 +1,24 @@
+from bingus.replication import ReplicationQueue
+
+def test_queue_of_unreachable_peer_counts_dropped_writes():
+    queue = ReplicationQueue("10.10.0.3:8090", lambda peer, ops: None, batch_size=10, flush_interval=0.05)
+    for i in range(3):
+        queue.put(dict(method="PUT", key=f"k{i}", value=i))
+    queue.thread.join(5)
+    assert queue.closed
+    assert queue.stats()["dropped"] == 3 and queue.stats()["depth"] == 0
+
+def test_queue_sends_in_order():
+    sent = list()
+    def send(peer, ops):
+        sent.extend(op["key"] for op in ops)
+        return len(ops)
+    queue = ReplicationQueue("10.10.0.3:8090", send, batch_size=2, flush_interval=0.01)
+    for i in range(5):
+        queue.put(dict(method="PUT", key=f"k{i}", value=i))
+    for _ in range(100):
+        if queue.stats()["sent_ops"] == 5:
+            break
+        queue.thread.join(0.01)
+    queue.close()
+    assert sent == [f"k{i}" for i in range(5)] and queue.stats()["dropped"] == 0
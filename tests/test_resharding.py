@@ -0,0 +1,43 @@
+from bingus.resharding import stable_partition, movement_plan
+
+REPLICAS = [f"10.10.0.{i}:8090" for i in range(2, 10)]
+
+def test_stable_partition_keeps_replicas_in_their_shard():
+    shards = {0: set(REPLICAS[:4]), 1: set(REPLICAS[4:])}
+    # same replicas and shard count: nothing moves
+    assert stable_partition(shards, REPLICAS, 2) == shards
+    # a new replica joins the smaller side, the others stay
+    partition = stable_partition(shards, REPLICAS + ["10.10.0.20:8090"], 2)
+    assert shards[0] <= partition[0] and shards[1] <= partition[1]
+    assert sorted(len(members) for members in partition.values()) == [4, 5]
+
+def test_stable_partition_sizes_differ_by_at_most_one():
+    shards = {0: set(REPLICAS[:4]), 1: set(REPLICAS[4:])}
+    partition = stable_partition(shards, REPLICAS, 3)
+    assert sorted(len(members) for members in partition.values()) == [2, 3, 3]
+    assert set().union(*partition.values()) == set(REPLICAS)
+    # the shards that keep replicas only give up their surplus
+    assert all(len(partition[id] & shards[id]) == 3 for id in (0, 1))
+
+def test_stable_partition_rejects_shards_below_the_minimum():
+    assert stable_partition(dict(), REPLICAS, 5) is None
+    assert stable_partition(dict(), REPLICAS, 0) is None
+
+def test_stable_partition_fills_dropped_shards_into_the_rest():
+    shards = {0: set(REPLICAS[:3]), 1: set(REPLICAS[3:6]), 2: set(REPLICAS[6:])}
+    partition = stable_partition(shards, REPLICAS, 2)
+    assert set(partition) == {0, 1}
+    assert shards[0] <= partition[0] and shards[1] <= partition[1]
+    assert set().union(*partition.values()) == set(REPLICAS)
+
+def test_movement_plan_only_fetches_from_new_shard_peers():
+    old = {0: set(REPLICAS[:4]), 1: set(REPLICAS[4:])}
+    new = {0: set(REPLICAS[:3]), 1: set(REPLICAS[3:6]), 2: set(REPLICAS[6:])}
+    plan = movement_plan(old, new)
+    # REPLICAS[3] left shard 0 for shard 1: it fetches from its new peers it did not share a shard with
+    assert plan[REPLICAS[3]] == {REPLICAS[4], REPLICAS[5]}
+    assert plan[REPLICAS[4]] == {REPLICAS[3]}
+    # replicas that stay together fetch nothing
+    assert plan[REPLICAS[0]] == set() and plan[REPLICAS[6]] == set()
+    # a joining replica fetches from every peer of its new shard
+    assert movement_plan(old, {0: set(REPLICAS[:4]) | {"10.10.0.20:8090"}})["10.10.0.20:8090"] == set(REPLICAS[:4])
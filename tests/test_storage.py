@@ -0,0 +1,132 @@
+import os
+from bingus.storage import MemoryStore, WalStore, newer, SNAPSHOT_FILE
+from bingus.merkle import MerkleTree
+
+A = "10.10.0.2:8090"
+B = "10.10.0.3:8090"
+
+def test_newer_orders_versions_and_lets_any_write_replace_an_unversioned_key():
+    assert newer((2, A), (1, B)) and newer((1, B), (1, A)) and not newer((1, A), (1, A))
+    assert newer(None, None) and newer((1, A), None)
+    assert not newer(None, (1, A))
+    # versions come back from JSON as lists
+    assert newer([2, A], (1, A))
+
+def test_older_writes_and_deletes_are_ignored():
+    store = MemoryStore()
+    assert store.put("x", 1, (5, A))
+    assert not store.put("x", 0, (4, B))
+    assert not store.delete("x", (3, B))
+    assert store["x"] == 1 and store.versions["x"] == (5, A)
+    assert store.put("x", 2, (5, B)) and store["x"] == 2
+
+def test_delete_leaves_a_tombstone_that_blocks_older_writes():
+    store = MemoryStore()
+    store.put("x", 1, (5, A))
+    assert store.delete("x", (6, A))
+    assert "x" not in store and store.tombstones == {"x": (6, A)} and "x" not in store.versions
+    # a stale write of the deleted key does not bring it back
+    assert not store.put("x", 1, (5, A)) and "x" not in store
+    # a tombstone is left even for an absent key, so a late write stays deleted
+    assert store.delete("y", (3, B)) and store.tombstones["y"] == (3, B)
+    assert store.put("x", 3, (7, B)) and store["x"] == 3 and "x" not in store.tombstones
+
+def test_unversioned_delete_drops_the_key_without_a_tombstone():
+    store = MemoryStore()
+    store.put("x", 1, (5, A))
+    store.pop("x")
+    assert "x" not in store and "x" not in store.versions and "x" not in store.tombstones
+
+def test_purge_tombstones_only_drops_expired_ones():
+    store = MemoryStore()
+    store.delete("old", (100, A))
+    store.delete("new", (200, A))
+    assert store.purge_tombstones(150) == 1
+    assert store.tombstones == {"new": (200, A)}
+
+def test_next_version_is_newer_than_every_version_of_the_key():
+    store = MemoryStore()
+    future = 1 << 50
+    store.delete("x", (future, B))
+    assert store.next_version("x", A) == (future + 1, A)
+    assert store.next_version("y", A)[0] < future
+
+def test_merkle_root_depends_on_the_contents_only():
+    first, second = MemoryStore(), MemoryStore()
+    for i in range(50):
+        first[f"k{i}"] = i
+    for i in reversed(range(50)):
+        second[f"k{i}"] = i
+    assert first.tree.root() == second.tree.root() != 0
+    second["k7"] = "changed"
+    assert first.tree.root() != second.tree.root()
+    second["k7"] = 7
+    assert first.tree.root() == second.tree.root()
+    del second["k7"]
+    first.pop("k7")
+    assert first.tree.root() == second.tree.root()
+    second.replace(dict())
+    assert second.tree.root() == 0 and second.size == 0
+
+def test_merkle_leaves_list_the_keys_that_differ():
+    store = MemoryStore()
+    store.update({f"k{i}": i for i in range(20)})
+    other = MerkleTree()
+    other.rebuild({f"k{i}": i for i in range(20) if i != 3})
+    leaf = store.tree.leaf("k3")
+    depth = store.tree.depth
+    differing = [i for i, (mine, theirs) in enumerate(zip(store.tree.hashes(depth, range(1 << depth)),
+                                                         other.hashes(depth, range(1 << depth)))) if mine != theirs]
+    assert differing == [leaf]
+    data, versions, tombstones = store.leaf_items(differing)
+    assert data["k3"] == 3 and set(data) == set(store.tree.keys([leaf]))
+    assert versions == dict() and tombstones == dict()
+
+def test_wal_store_recovers_writes_versions_and_clock(tmp_path):
+    store = WalStore(str(tmp_path))
+    store.put("x", 1, (5, A))
+    store.put("y", [1, 2], (6, A))
+    store.delete("y", (7, B))
+    store.update({"z": "moved"})
+    store.commit({A: 3, B: 1})
+    store.close()
+    recovered = WalStore(str(tmp_path))
+    assert dict(recovered) == {"x": 1, "z": "moved"}
+    assert recovered.versions == {"x": (5, A)} and recovered.tombstones == {"y": (7, B)}
+    assert recovered.vc == {A: 3, B: 1}
+    assert recovered.tree.root() == store.tree.root() and recovered.size == store.size
+    recovered.close()
+
+def test_wal_store_ignores_a_torn_record_and_appends_to_a_new_segment(tmp_path):
+    store = WalStore(str(tmp_path))
+    store["x"] = 1
+    store.commit()
+    store.close()
+    with open(store.segment_path(store.segment), "a", encoding="utf-8") as f:
+        f.write('{"op": "put", "key": "y", "va')
+    recovered = WalStore(str(tmp_path))
+    assert dict(recovered) == {"x": 1}
+    assert recovered.segment == store.segment + 1
+    recovered["z"] = 2
+    recovered.commit()
+    recovered.close()
+    assert dict(WalStore(str(tmp_path))) == {"x": 1, "z": 2}
+
+def test_wal_store_recovers_from_the_snapshot_and_the_log_after_it(tmp_path):
+    # snapshot by hand, not from commit()
+    store = WalStore(str(tmp_path), snapshot_every=1000)
+    for i in range(10):
+        store.put(f"k{i}", i, (i + 1, A))
+    store.commit({A: 10})
+    store.snapshot()
+    store.delete("k0", (20, A))
+    store.commit({A: 11})
+    store.close()
+    assert os.path.exists(os.path.join(str(tmp_path), SNAPSHOT_FILE))
+    # the snapshot covers every segment before the current one
+    assert store.segments() == [store.segment]
+    recovered = WalStore(str(tmp_path))
+    assert dict(recovered) == {f"k{i}": i for i in range(1, 10)}
+    assert recovered.tombstones == {"k0": (20, A)} and recovered.versions["k9"] == (10, A)
+    assert recovered.vc == {A: 11}
+    recovered.close()
@@ -1,3 +1,66 @@
+# Results of compare()
+BEFORE = -1
+EQUAL = 0
+AFTER = 1
+CONCURRENT = 2
+
+# Compares two dictionary clocks in a single pass
+# Returns BEFORE, EQUAL, AFTER or CONCURRENT, or None if the clocks have different views
+def compare(first, second):
+    if len(first) != len(second):
+        return None
+    lt = False
+    gt = False
+    for address, val in first.items():
+        other = second.get(address)
+        if other is None:
+            return None
+        if val < other:
+            lt = True
+        elif val > other:
+            gt = True
+    if lt and gt:
+        return CONCURRENT
+    if lt:
+        return BEFORE
+    if gt:
+        return AFTER
+    return EQUAL
+
+# Piecewise maximum of two dictionary clocks, written into first
+# Only addresses in first are considered
+def merge_into(first, second):
+    for address, val in second.items():
+        if address in first and val > first[address]:
+            first[address] = val
+    return first
+
+# True if a message with sender_vc has causal dependencies that local_vc has not delivered yet
+# sender_addr is None for client requests, else the address of the relaying replica
+def has_dependency(sender_addr, sender_vc, local_vc):
+    # Request is from client
+    if not sender_addr:
+        # Pad if unequal length from sender
+        if len(sender_vc) < len(local_vc):
+            for address in local_vc:
+                if address not in sender_vc:
+                    sender_vc[address] = local_vc[address]
+        # Compare clocks
+        return compare(sender_vc, local_vc) not in (BEFORE, EQUAL)
+    # Request is from a Replica(i.e it is a relayed/broadcasted msg)
+    # Make sure that both VCs have the same view before comparing
+    if sender_vc.keys() != local_vc.keys():
+        return True
+    for address, val in sender_vc.items():
+        if address == sender_addr:
+            # must be the next message from the sender
+            if val != local_vc[address] + 1:
+                return True
+        elif val > local_vc[address]:
+            return True
+    # There are no dependencies
+    return False
+
 class VectorClock():
     # Simple data structure that functions as a changing-size Vector Clock
     # New addresses can be added via set_address()
@@ -46,65 +109,36 @@ class VectorClock():
     # Condition for lt - Given two VCs A and B:
     # At least one element's value in A must be strictly < the corresponding value in B,
     # and all elements in A must be <= their corresponding elements in B
+    # All comparisons return None if both VCs do not have the same addresses, since they cannot be compared
     def __lt__(self, other):
-        # Check if both VCs have the same addresses, return None if not since they cannot be compared
-        if not self.has_same_view_as(other):
-            return None
-
-        has_strictly_lt_val = False
-        for address in other.vc_dict:
-            val = other.vc_dict[address]
-            if self.vc_dict[address] > val:
-                return False
-            
-            if self.vc_dict[address] < val:
-                has_strictly_lt_val = True
-        
-        return has_strictly_lt_val
+        res = compare(self.vc_dict, other.vc_dict)
+        return None if res is None else res == BEFORE
 
     # <= 
     def __le__(self, other):
-        if not self.has_same_view_as(other):
-            return None   
-        return self.__lt__(other) or self.__eq__(other)
+        res = compare(self.vc_dict, other.vc_dict)
+        return None if res is None else res in (BEFORE, EQUAL)
     
     # >=
     def __ge__(self, other):
-        if not self.has_same_view_as(other):
-            return None   
-        return self.__gt__(other) or self.__eq__(other)
+        res = compare(self.vc_dict, other.vc_dict)
+        return None if res is None else res in (AFTER, EQUAL)
 
     # !=
     def __ne__(self, other):
-        if not self.has_same_view_as(other):
-            return None 
-        return self < other or self > other
+        res = compare(self.vc_dict, other.vc_dict)
+        return None if res is None else res in (BEFORE, AFTER)
     
     # >
     def __gt__(self, other):
-        if not self.has_same_view_as(other):
-            return None
-
-        has_strictly_gt_val = False
-        for address in other.vc_dict:
-            val = other.vc_dict[address]
-            if self.vc_dict[address] < val:
-                return False
-            
-            if self.vc_dict[address] > val:
-                has_strictly_gt_val = True
-        
-        return has_strictly_gt_val
+        res = compare(self.vc_dict, other.vc_dict)
+        return None if res is None else res == AFTER
 
     # ==
     # Checks if all VC addresses have the same exact values - returns True if so, False if not
     def __eq__(self, other):
-        if not self.has_same_view_as(other):
-            return None
-        for addr in self.vc_dict:
-            if self.vc_dict[addr] != other.vc_dict[addr]:
-                return False
-        return True
+        res = compare(self.vc_dict, other.vc_dict)
+        return None if res is None else res == EQUAL
  
     # |
     # Concurrency check
@@ -112,6 +146,5 @@ class VectorClock():
     # A | B if A has at least one element that is strictly < the corresponding element in B,
     # and A also has at least one element that is strictly > the corresponding element in B
     def concurrent_with(self, other):
-        if not self.has_same_view_as(other):
-            return None
-        return not self.__lt__(other) and not self.__gt__(other)
+        res = compare(self.vc_dict, other.vc_dict)
+        return None if res is None else res in (CONCURRENT, EQUAL)